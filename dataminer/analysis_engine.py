@@ -0,0 +1,280 @@
+"""Analysis Engine (analysis_engine.py)
+Streams each file of a directory of tweets once and hands every row to a set of
+registered consumers (term counts, mention edges, daily timeline, top term
+tweets), so that several analyses share a single read of the corpus
+
+Contributors:
+Devin Gaffney & Ryan J. Gallagher
+Network Science Institute, Northeastern University, 2017
+"""
+import os
+import sys
+import csv
+from array import array
+import corpus_store
+
+class AnalysisEngine:
+    """
+    Runs registered consumers over a directory of tweets, reading each tweet
+    file once per pass
+
+    Example:
+        import analysis_engine
+        engine = analysis_engine.AnalysisEngine(tweet_dir)
+        terms = engine.register(analysis_engine.TermConsumer(tc))
+        engine.register(analysis_engine.TopTermTweetConsumer(tc, after=[terms]))
+        engine.register(analysis_engine.EdgeConsumer(na))
+        engine.register(analysis_engine.TimelineConsumer(ta))
+        engine.run()
+
+    Parameters
+    ----------
+    tweet_dir: string
+        Complete file path from working directory to directory of tweets
+
+    Attributes
+    ----------
+    reduced_data: boolean
+        True if working with tweets from summarized CSV file. False if working
+        with the full JSON data.
+
+    consumers: list
+        Consumers in the order they were registered
+
+    n_passes: int
+        Number of reads of the corpus made by the last call to run()
+    """
+    def __init__(self, tweet_dir):
+        self.tweet_dir = tweet_dir
+        self.consumers = []
+        self.n_passes = 0
+        if 'reduced' in self.tweet_dir:
+            self.reduced_data = True
+        else:
+            self.reduced_data = False
+
+    def register(self, consumer):
+        """
+        Adds a consumer to the engine and returns it, so that it can be passed
+        as a dependency (after=[...]) of consumers registered later
+        """
+        self.consumers.append(consumer)
+        return consumer
+
+    def run(self):
+        """
+        Reads the corpus once for every consumer whose dependencies have
+        already finished. Consumers without dependencies all share the first
+        pass; consumers that need the outputs of another consumer (eg. top term
+        tweets needing the term counts) share a second pass
+        """
+        self.n_passes = 0
+        finished = []
+        pending = list(self.consumers)
+        while pending:
+            batch = [c for c in pending if all(d in finished for d in c.after)]
+            if not batch:
+                print "Consumers have dependencies that were never registered"
+                sys.exit()
+            self.run_pass(batch)
+            finished.extend(batch)
+            pending = [c for c in pending if c not in batch]
+
+    def run_pass(self, consumers):
+        """
+        Streams every tweet file once, handing each row to all consumers
+        """
+        self.n_passes += 1
+        for consumer in consumers:
+            consumer.start()
+        # Use the columnar store unless a consumer writes out whole rows
+        store = None
+        if self.reduced_data is True and not any([consumer.needs_full_rows for consumer in consumers]):
+            store = corpus_store.open_corpus_store(self.tweet_dir)
+        # Full (JSON) tweets are decoded into the fields of all consumers
+        fields = sorted(set([field for consumer in consumers for field in consumer.json_fields]))
+        keep_lines = any([consumer.needs_full_rows for consumer in consumers])
+        # and reduced ones split into their columns
+        columns = tuple(sorted(set([column for consumer in consumers for column in consumer.reduced_columns])))
+        tweet_files = os.listdir(self.tweet_dir)
+        for filename in tweet_files:
+            print filename
+            for tweet in corpus_store.read_rows(self.tweet_dir, filename, self.reduced_data, store, fields, keep_lines, columns):
+                for consumer in consumers:
+                    consumer.consume(tweet)
+            for consumer in consumers:
+                consumer.end_file(filename)
+        for consumer in consumers:
+            consumer.finish()
+
+# ------------------------------------------------------------------------------
+# -------------------------------- Consumers -----------------------------------
+# ------------------------------------------------------------------------------
+class Consumer:
+    """
+    Base consumer. start() is called before a pass over the corpus, consume()
+    once per row, end_file() after the last row of each file and finish() once
+    all files have been read. Rows that raise
+    are counted as null rows, as in the analyzers' own loops
+
+    Parameters
+    ----------
+    after: list of consumers, defaults to None
+        Consumers that must finish before this one can start
+
+    Attributes
+    ----------
+    needs_full_rows: boolean
+        True if the consumer needs every column of the tweet files, in which
+        case its pass does not read the columnar store (and keeps the raw
+        lines of full JSON tweets)
+
+    json_fields: list of strings
+        Fields of full (JSON) tweets the consumer reads (see corpus_io.py)
+
+    reduced_columns: tuple of ints
+        Columns of reduced tweets the consumer reads
+    """
+    needs_full_rows = False
+    json_fields = []
+    reduced_columns = ()
+
+    def __init__(self, after=None):
+        if after is None:
+            self.after = []
+        else:
+            self.after = after
+        self.null_rows = 0
+
+    def start(self):
+        self.null_rows = 0
+
+    def consume(self, tweet):
+        try:
+            self.consume_row(tweet)
+        except:
+            self.null_rows += 1
+
+    def consume_row(self, tweet):
+        pass
+
+    def end_file(self, filename):
+        pass
+
+    def finish(self):
+        pass
+
+class TermConsumer(Consumer):
+    """
+    Counts terms, hashtags, mentions and urls as TermCounter.get_ranked_terms()
+    does and writes the same term_counts files. With top_k, the counts of each
+    file are folded into bounded-memory summaries at the end of the file, as in
+    get_ranked_terms(top_k=...)
+    """
+    def __init__(self, term_counter, max_n=1, top_k=None, sketch_width=2**18, sketch_depth=4, after=None):
+        Consumer.__init__(self, after)
+        self.term_counter = term_counter
+        self.json_fields = term_counter.json_fields
+        self.reduced_columns = term_counter.reduced_columns
+        self.max_n = max_n
+        self.top_k = top_k
+        self.sketch_width = sketch_width
+        self.sketch_depth = sketch_depth
+
+    def start(self):
+        Consumer.start(self)
+        self.counts = self.term_counter.new_term_counts(self.max_n)
+        if self.top_k is not None:
+            self.heavy_hitters = self.term_counter.new_heavy_hitters(self.top_k, self.sketch_width, self.sketch_depth, self.max_n)
+
+    def consume_row(self, tweet):
+        self.term_counter.count_tweet(tweet, self.counts)
+
+    def end_file(self, filename):
+        if self.top_k is not None:
+            for key in self.counts.keys():
+                self.heavy_hitters[key].update_counts(self.counts[key])
+            self.counts = self.term_counter.new_term_counts(self.max_n)
+
+    def finish(self):
+        print str(self.null_rows)+" null rows encountered"
+        if self.top_k is not None:
+            self.term_counter.write_heavy_hitters(self.heavy_hitters)
+        else:
+            self.term_counter.write_ranked_terms(self.counts)
+
+class TopTermTweetConsumer(Consumer):
+    """
+    Captures tweets containing the top terms as
+    TermCounter.tweets_matching_tokens() does and writes the same
+    top_term_tweets files. Register with after=[term_consumer] to use the term
+    counts written earlier in the same run
+    """
+    needs_full_rows = True
+
+    def __init__(self, term_counter, top_count=20, types=["hashtags"], include_user_if_user_mentions=False, after=None):
+        Consumer.__init__(self, after)
+        self.term_counter = term_counter
+        self.json_fields = term_counter.json_fields
+        self.reduced_columns = term_counter.reduced_columns
+        self.top_count = top_count
+        self.types = types
+        self.include_user_if_user_mentions = include_user_if_user_mentions
+
+    def start(self):
+        Consumer.start(self)
+        self.top_terms = self.term_counter.get_top_terms(self.top_count, self.types)
+        if self.top_terms is None:
+            print "Cannot run this until you've run get_ranked_terms to generate term counts!!"
+            sys.exit()
+        self.matcher = self.term_counter.top_term_matcher(self.top_terms)
+        self.output = self.term_counter.open_top_term_tweets(self.include_user_if_user_mentions)
+        self.csvwriter = csv.writer(self.output, delimiter=',')
+
+    def consume_row(self, tweet):
+        if self.term_counter.matches_top_terms(tweet, self.matcher, self.top_terms, self.include_user_if_user_mentions):
+            self.csvwriter.writerow(self.term_counter.top_term_row(tweet))
+
+    def finish(self):
+        self.output.close()
+
+class EdgeConsumer(Consumer):
+    """
+    Builds the interaction layers as NetworkAnalyzer.get_edge_list() does and
+    writes the same edge lists. The edges are kept on the NetworkAnalyzer for
+    later calls such as get_ranked_in_degree()
+    """
+    def __init__(self, network_analyzer, after=None):
+        Consumer.__init__(self, after)
+        self.network_analyzer = network_analyzer
+        self.json_fields = network_analyzer.json_fields
+        self.reduced_columns = network_analyzer.reduced_columns
+
+    def consume_row(self, tweet):
+        self.network_analyzer.update_edges(tweet, self.network_analyzer.layers)
+
+    def finish(self):
+        self.network_analyzer.write_edges()
+
+class TimelineConsumer(Consumer):
+    """
+    Collects the tweet timestamps as TimeAnalyzer.get_timestamps() does and
+    writes the same spiked and cumulative timelines, for each granularity
+    """
+    def __init__(self, time_analyzer, granularities=["day"], after=None):
+        Consumer.__init__(self, after)
+        self.time_analyzer = time_analyzer
+        self.json_fields = time_analyzer.json_fields
+        self.reduced_columns = time_analyzer.reduced_columns
+        self.granularities = granularities
+
+    def start(self):
+        Consumer.start(self)
+        self.timeline = array('l')
+
+    def consume_row(self, tweet):
+        self.time_analyzer.update_timeline(tweet, self.timeline)
+
+    def finish(self):
+        for granularity in self.granularities:
+            self.time_analyzer.write_timelines(self.timeline, granularity)
@@ -0,0 +1,248 @@
+"""Batch Runner (batch_runner.py)
+Runs the term, network and time analyses of many corpora on one pool of
+worker processes. Each analysis of each corpus is a job; jobs are handed out
+largest corpus first (cost estimated from the bytes of its tweet files), so
+that the small corpora fill the gaps left at the end by the large ones. A
+summary row of each corpus (TermCounter.get_counts(),
+NetworkAnalyzer.basic_stats() and the extent of its timeline) is appended to
+one combined table as soon as all its analyses are done
+
+    python batch_runner.py /home/dgaffney/hashtag_results 16 "/home/dgaffney/hashtag_extractions/#*_reduced"
+
+Contributors:
+Devin Gaffney & Ryan J. Gallagher
+Network Science Institute, Northeastern University, 2017
+"""
+import os
+import sys
+import csv
+import glob
+import time
+import traceback
+from multiprocessing import Pool
+import term_counter
+import network_analyzer
+import time_analyzer
+
+# Analyses in decreasing order of cost per byte, which breaks ties between
+# jobs of corpora of the same size
+analyses = ["terms", "network", "time"]
+
+# Columns of the summary table
+summary_columns = ["corpus", "bytes", "files", "tweets", "first_day", "last_day", "peak_day", "peak_tweets",
+                   "terms", "hashtags", "mentions", "urls",
+                   "node_count", "edge_count", "component_count", "lcc_node_count", "lcc_edge_count",
+                   "lcc_diameter_lower", "lcc_diameter_upper", "lcc_diameter", "diameter", "seconds", "errors"]
+
+def corpus_dirs(patterns):
+    """
+    Returns the corpus directories named by a list of paths and glob patterns,
+    without duplicates, in the order given
+    """
+    dirs = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            matches = [pattern]
+        else:
+            matches = sorted(glob.glob(pattern))
+        for path in matches:
+            path = os.path.abspath(path)
+            if os.path.isdir(path) and path not in dirs:
+                dirs.append(path)
+    return dirs
+
+def corpus_bytes(corpus_dir):
+    """
+    Returns the number of tweet files of a corpus and their total size, the
+    cost estimate of its jobs. Compressed files count as their compressed
+    size, which orders corpora by cost as long as they share a compression
+    """
+    sizes = [os.path.getsize(corpus_dir+'/'+filename) for filename in os.listdir(corpus_dir)
+             if os.path.isfile(corpus_dir+'/'+filename)]
+    return len(sizes), sum(sizes)
+
+class BatchRunner:
+    """
+    Runs analyses over a set of corpora on a shared pool of processes
+
+    Example:
+        import batch_runner
+        runner = batch_runner.BatchRunner(["/home/dgaffney/hashtag_extractions/#*_reduced"],
+                                          "/home/dgaffney/hashtag_results", n_workers=16)
+        runner.run()
+
+    Parameters
+    ----------
+    patterns: list of strings
+        Corpus directories, or glob patterns of them
+
+    results_dir: string
+        Directory in which the outputs of each corpus are written, in a
+        directory of the corpus name (as the working_dir of the analyzers),
+        along with the combined table, summary.csv
+
+    n_workers: int, defaults to 1
+        Number of jobs run at the same time. Each job runs in its own process
+        (a new one per job, so that the memory of a large corpus is given
+        back) and reads its corpus serially
+
+    analyses: list of strings, defaults to all of analyses
+        Any of "terms" (ranked terms and top term tweets), "network" (edge
+        lists, ranked in-degree and centralities) and "time" (timelines)
+
+    time_budget: float, defaults to 60
+        Seconds spent tightening the diameter bounds of each network (see
+        NetworkAnalyzer.basic_stats())
+
+    incremental: boolean, defaults to False
+        If True, the analyses keep checkpoints in the results directories and
+        a rerun only reads the tweet files added or changed since (see
+        checkpoint.py)
+
+    Attributes
+    ----------
+    corpora: list of (corpus_dir, n_files, n_bytes) tuples
+        Corpora from the largest to the smallest
+
+    summaries: dict (corpus_dir -> dict)
+        Summary of each corpus whose analyses are done, keyed by the
+        summary_columns
+    """
+    def __init__(self, patterns, results_dir, n_workers=1, analyses=analyses, time_budget=60, incremental=False):
+        self.results_dir = results_dir
+        self.n_workers = n_workers
+        self.analyses = analyses
+        self.options = {'time_budget': time_budget, 'incremental': incremental}
+        self.summaries = {}
+        corpora = [(corpus_dir,)+corpus_bytes(corpus_dir) for corpus_dir in corpus_dirs(patterns)]
+        self.corpora = sorted(corpora, key=lambda corpus: -corpus[2])
+        try:
+            os.makedirs(results_dir)
+        except:
+            print "File '"+results_dir+"' exists"
+
+    def jobs(self):
+        """
+        Returns the (analysis, corpus_dir, working_dir, options) jobs, largest
+        first
+        """
+        jobs = []
+        for corpus_dir, n_files, n_bytes in self.corpora:
+            working_dir = self.results_dir+'/'+os.path.basename(corpus_dir)
+            for analysis in sorted(self.analyses, key=analyses.index):
+                jobs.append((analysis, corpus_dir, working_dir, self.options))
+        return jobs
+
+    def run(self):
+        """
+        Runs every job on a pool of n_workers processes, appending the
+        summary of each corpus to summary.csv as soon as its jobs are done
+
+        OUTPUT
+        ------
+        summaries, dict (corpus_dir -> dict)
+        """
+        jobs = self.jobs()
+        print str(len(jobs))+" jobs over "+str(len(self.corpora))+" corpora ("+str(sum([corpus[2] for corpus in self.corpora])/2**20)+" MB)"
+        corpus_info = dict([(corpus_dir, (n_files, n_bytes)) for corpus_dir, n_files, n_bytes in self.corpora])
+        pending = dict([(corpus_dir, len(self.analyses)) for corpus_dir in corpus_info])
+        partial_summaries = dict([(corpus_dir, {'seconds': 0.0, 'errors': []}) for corpus_dir in corpus_info])
+        with open(self.results_dir+'/summary.csv', 'wb') as f:
+            csvwriter = csv.writer(f, delimiter=',')
+            csvwriter.writerow(summary_columns)
+            f.flush()
+            for corpus_dir, analysis, summary, seconds, error in self.results(jobs):
+                partial = partial_summaries[corpus_dir]
+                partial.update(summary)
+                partial['seconds'] += seconds
+                if error is not None:
+                    print analysis+" of "+corpus_dir+" failed:\n"+error
+                    partial['errors'].append(analysis+": "+error.strip().split('\n')[-1])
+                pending[corpus_dir] -= 1
+                if pending[corpus_dir] > 0:
+                    continue
+                # Every analysis of the corpus is done
+                partial['corpus'] = os.path.basename(corpus_dir)
+                partial['files'], partial['bytes'] = corpus_info[corpus_dir]
+                partial['seconds'] = round(partial['seconds'], 1)
+                partial['errors'] = "; ".join(partial['errors'])
+                self.summaries[corpus_dir] = partial
+                csvwriter.writerow([unicode(partial.get(column, "NA")).encode('utf-8') for column in summary_columns])
+                f.flush()
+                print str(len(self.summaries))+" of "+str(len(self.corpora))+" corpora done: "+partial['corpus']
+        return self.summaries
+
+    def results(self, jobs):
+        """
+        Yields the (corpus_dir, analysis, summary, seconds, error) of each job
+        as it finishes. Jobs are handed out one at a time in the given order
+        """
+        if self.n_workers > 1 and len(jobs) > 1:
+            pool = Pool(processes=min(self.n_workers, len(jobs)), maxtasksperchild=1)
+            try:
+                for result in pool.imap_unordered(run_job, jobs, chunksize=1):
+                    yield result
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            for job in jobs:
+                yield run_job(job)
+
+def run_job(job):
+    """
+    Runs one analysis of one corpus. Module level so that it can be sent to
+    pool workers
+
+    OUTPUT
+    ------
+    (corpus_dir, analysis, summary, seconds, error), tuple
+        summary is a dict of summary_columns; error is the traceback of a
+        failed analysis (None otherwise)
+    """
+    analysis, corpus_dir, working_dir, options = job
+    print analysis+": "+corpus_dir
+    start = time.time()
+    try:
+        summary = run_functions[analysis](corpus_dir, working_dir, options)
+        error = None
+    except (Exception, SystemExit):
+        # The analyzers exit on corpora they cannot analyze (eg. without
+        # edges), which would otherwise stop the pool worker and the batch
+        summary = {}
+        error = traceback.format_exc()
+    return corpus_dir, analysis, summary, time.time()-start, error
+
+def run_terms(corpus_dir, working_dir, options):
+    tc = term_counter.TermCounter(corpus_dir, working_dir)
+    tc.get_ranked_terms(incremental=options['incremental'])
+    tc.tweets_matching_tokens()
+    tc.tweets_matching_tokens(20, ["mentions"], True)
+    return tc.get_counts()
+
+def run_network(corpus_dir, working_dir, options):
+    na = network_analyzer.NetworkAnalyzer(corpus_dir, working_dir)
+    na.get_edge_list(incremental=options['incremental'])
+    na.get_ranked_in_degree()
+    na.get_ranked_centrality()
+    return na.basic_stats(time_budget=options['time_budget'])
+
+def run_time(corpus_dir, working_dir, options):
+    ta = time_analyzer.TimeAnalyzer(corpus_dir, working_dir)
+    timestamps = ta.get_timestamps(options['incremental'])
+    ta.write_timelines(timestamps)
+    labels, counts = time_analyzer.bucket_timestamps(timestamps, "day")
+    summary = {'tweets': len(timestamps)}
+    if labels:
+        peak = int(counts.argmax())
+        summary.update({'first_day': labels[0], 'last_day': labels[-1],
+                        'peak_day': labels[peak], 'peak_tweets': int(counts[peak])})
+    return summary
+
+run_functions = {"terms": run_terms, "network": run_network, "time": run_time}
+
+if __name__ == '__main__':
+    if len(sys.argv) < 4:
+        print "Usage: python batch_runner.py results_dir n_workers corpus_dir_or_glob [corpus_dir_or_glob ...]"
+        sys.exit()
+    BatchRunner(sys.argv[3:], sys.argv[1], int(sys.argv[2])).run()
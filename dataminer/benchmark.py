@@ -0,0 +1,321 @@
+"""Benchmarks (benchmark.py)
+Checks that the fast paths of the analyzers give the same output as the
+implementations they replace, and reports how much faster they are on a real
+corpus
+
+    python benchmark.py clean_tweet /home/dgaffney/hashtag_extractions/#Ferguson_2015-08-09_2017-08-09_reduced
+    python benchmark.py parse_timestamp /home/dgaffney/hashtag_extractions/#Ferguson_2015-08-09_2017-08-09_reduced
+    python benchmark.py read_reduced /home/dgaffney/hashtag_extractions/#Ferguson_2015-08-09_2017-08-09_reduced
+    python benchmark.py read_json /home/dgaffney/hashtag_extractions/#Ferguson_2015-08-09_2017-08-09_full
+    python benchmark.py compression /home/dgaffney/hashtag_extractions/#Ferguson_2015-08-09_2017-08-09_reduced
+
+Contributors:
+Devin Gaffney & Ryan J. Gallagher
+Network Science Institute, Northeastern University, 2017
+"""
+import os
+import sys
+import csv
+import gc
+import time
+import json
+import shutil
+import calendar
+import tempfile
+from dateutil import parser
+import corpus_io
+import corpus_store
+import term_counter
+import time_analyzer
+import network_analyzer
+import analysis_engine
+
+def corpus_texts(tweet_dir, max_tweets=None):
+    """
+    Returns the (unicode) texts of the tweets of a reduced corpus
+    """
+    texts = []
+    for filename in sorted(os.listdir(tweet_dir)):
+        for tweet in corpus_store.read_rows(tweet_dir, filename, True):
+            texts.append(tweet[corpus_store.TEXT])
+            if max_tweets is not None and len(texts) >= max_tweets:
+                return texts
+    return texts
+
+def corpus_timestamps(tweet_dir, max_tweets=None):
+    """
+    Returns the created_at strings of the tweets of a reduced corpus
+    """
+    timestamps = []
+    for filename in sorted(os.listdir(tweet_dir)):
+        for tweet in corpus_store.read_rows(tweet_dir, filename, True):
+            timestamps.append(tweet[corpus_store.CREATED_AT])
+            if max_tweets is not None and len(timestamps) >= max_tweets:
+                return timestamps
+    return timestamps
+
+def reference_clean_tweet(tweet_text):
+    """
+    TermCounter.clean_tweet() as it was before the fast path: stop word list
+    scan and character by character punctuation removal
+    """
+    stop_words = list(term_counter.stop_words)
+    tokenized_text = term_counter.tknzr.tokenize(tweet_text)
+    filtered_text = [gram for gram in tokenized_text if (gram != 'rt')
+                    and ('http' not in gram) and ('//t.co' not in gram)
+                    and (gram not in stop_words)]
+    text = ' '.join(filtered_text)
+    text_chars_noPunct = [char for char in text if char not in term_counter.exclude]
+    text_noPunct = "".join(text_chars_noPunct)
+    return text_noPunct.strip().split()
+
+def bench_clean_tweet(tweet_dir, max_tweets=100000):
+    """
+    Compares reference_clean_tweet() and TermCounter.clean_tweet() on the
+    tweets of a corpus. Exits with an error if any output differs
+
+    OUTPUT
+    ------
+    tweets_per_second, dict (implementation -> float)
+    """
+    texts = corpus_texts(tweet_dir, max_tweets)
+    tc = term_counter.TermCounter("", "")
+    results = {}
+    tweets_per_second = {}
+    start = time.time()
+    results['reference'] = [reference_clean_tweet(text) for text in texts]
+    tweets_per_second['reference'] = len(texts)/max(time.time()-start, 1e-9)
+    start = time.time()
+    results['clean_tweet'] = [tc.clean_tweet(text) for text in texts]
+    tweets_per_second['clean_tweet'] = len(texts)/max(time.time()-start, 1e-9)
+    mismatches = [k for k in range(len(texts)) if results['clean_tweet'][k] != results['reference'][k]]
+    if mismatches:
+        print "clean_tweet differs from the reference on "+str(len(mismatches))+" tweets, eg. "+repr(texts[mismatches[0]])
+        sys.exit(1)
+    print str(len(texts))+" tweets, identical output"
+    for key in ['reference', 'clean_tweet']:
+        print "\t"+key+": "+str(int(tweets_per_second[key]))+" tweets/s ("+str(round(tweets_per_second[key]/tweets_per_second['reference'], 2))+"x)"
+    return tweets_per_second
+
+def bench_parse_timestamp(tweet_dir, max_tweets=100000):
+    """
+    Compares dateutil with time_analyzer.parse_timestamp() on the timestamps
+    of a corpus. Exits with an error if any epoch differs
+
+    OUTPUT
+    ------
+    timestamps_per_second, dict (implementation -> float)
+    """
+    timestamps = corpus_timestamps(tweet_dir, max_tweets)
+    results = {}
+    timestamps_per_second = {}
+    start = time.time()
+    results['dateutil'] = []
+    for timestamp in timestamps:
+        try:
+            results['dateutil'].append(calendar.timegm(parser.parse(timestamp).utctimetuple()))
+        except:
+            results['dateutil'].append(None)
+    timestamps_per_second['dateutil'] = len(timestamps)/max(time.time()-start, 1e-9)
+    start = time.time()
+    results['parse_timestamp'] = []
+    for timestamp in timestamps:
+        try:
+            results['parse_timestamp'].append(time_analyzer.parse_timestamp(timestamp))
+        except:
+            results['parse_timestamp'].append(None)
+    timestamps_per_second['parse_timestamp'] = len(timestamps)/max(time.time()-start, 1e-9)
+    mismatches = [k for k in range(len(timestamps)) if results['parse_timestamp'][k] != results['dateutil'][k]]
+    if mismatches:
+        print "parse_timestamp differs from dateutil on "+str(len(mismatches))+" timestamps, eg. "+repr(timestamps[mismatches[0]])
+        sys.exit(1)
+    print str(len(timestamps))+" timestamps, identical output"
+    for key in ['dateutil', 'parse_timestamp']:
+        print "\t"+key+": "+str(int(timestamps_per_second[key]))+" timestamps/s ("+str(round(timestamps_per_second[key]/timestamps_per_second['dateutil'], 2))+"x)"
+    return timestamps_per_second
+
+def csv_reduced_rows(path, min_length):
+    """
+    Returns the rows of a reduced tweet file as csv.reader reads them, with
+    their text decoded, leaving out the rows of less than min_length columns
+    """
+    rows = []
+    with corpus_io.open_stream(path) as f:
+        for row in csv.reader(f, delimiter='\t'):
+            if len(row) < min_length:
+                continue
+            try:
+                row[corpus_io.TEXT] = row[corpus_io.TEXT].decode('utf-8')
+            except UnicodeDecodeError:
+                continue
+            rows.append(row)
+    return rows
+
+def bench_read_reduced(tweet_dir):
+    """
+    Compares csv.reader (with UTF-8 decoding of the text) with
+    corpus_io.ReducedReader on the tweet files of a reduced corpus, one file
+    at a time: with full rows, and with the rows of the REDUCED_COLUMNS the
+    analyzers read. Exits with an error if any row differs
+
+    OUTPUT
+    ------
+    tweets_per_second, dict (implementation -> float)
+    """
+    readers = {'ReducedReader (full rows)': corpus_io.ReducedReader(full_rows=True),
+               'ReducedReader (columns)': corpus_io.ReducedReader()}
+    columns = corpus_io.REDUCED_COLUMNS
+    seconds = dict([(key, 0.0) for key in ['csv.reader']+readers.keys()])
+    n_rows = 0
+    # Timed without the cyclic garbage collector, as timeit does, so that the
+    # rows kept for the comparison do not slow down the reader timed next
+    gc.disable()
+    for filename in sorted(os.listdir(tweet_dir)):
+        start = time.time()
+        reference = csv_reduced_rows(tweet_dir+'/'+filename, readers['ReducedReader (columns)'].min_length)
+        seconds['csv.reader'] += time.time()-start
+        for key, reader in sorted(readers.items()):
+            start = time.time()
+            rows = list(reader.rows(tweet_dir+'/'+filename))
+            seconds[key] += time.time()-start
+            if not reader.full_rows:
+                reference_rows = [dict([(column, row[column]) for column in columns]) for row in reference]
+            else:
+                reference_rows = reference
+            if rows != reference_rows:
+                print key+" differs from csv.reader on "+filename
+                sys.exit(1)
+            rows = reference_rows = None
+        n_rows += len(reference)
+    gc.enable()
+    tweets_per_second = dict([(key, n_rows/max(seconds[key], 1e-9)) for key in seconds])
+    print str(n_rows)+" tweets ("+str(readers['ReducedReader (columns)'].n_malformed)+" malformed lines), identical output"
+    for key in ['csv.reader']+sorted(readers.keys()):
+        print "\t"+key+": "+str(int(tweets_per_second[key]))+" tweets/s ("+str(round(tweets_per_second[key]/tweets_per_second['csv.reader'], 2))+"x)"
+    return tweets_per_second
+
+def bench_read_json(tweet_dir):
+    """
+    Compares json.loads() of every line with corpus_io.JsonReader (decoder:
+    corpus_io.json_decoder) projecting the fields of
+    NetworkAnalyzer.json_fields, on the tweet files of a full corpus. Exits
+    with an error if any field differs
+
+    OUTPUT
+    ------
+    tweets_per_second, dict (implementation -> float)
+    """
+    fields = network_analyzer.NetworkAnalyzer.json_fields
+    reference_reader = corpus_io.JsonReader(fields)
+    results = {}
+    tweets_per_second = {}
+    start = time.time()
+    results['json.loads'] = []
+    for filename in sorted(os.listdir(tweet_dir)):
+        with corpus_io.open_stream(tweet_dir+'/'+filename) as f:
+            for line in f:
+                try:
+                    tweet = json.loads(line)
+                except ValueError:
+                    continue
+                if isinstance(tweet, dict) and 'created_at' in tweet:
+                    results['json.loads'].append(reference_reader.project(tweet))
+    tweets_per_second['json.loads'] = len(results['json.loads'])/max(time.time()-start, 1e-9)
+    reader = corpus_io.JsonReader(fields)
+    start = time.time()
+    results['JsonReader'] = []
+    for filename in sorted(os.listdir(tweet_dir)):
+        results['JsonReader'].extend(reader.rows(tweet_dir+'/'+filename))
+    tweets_per_second['JsonReader'] = len(results['JsonReader'])/max(time.time()-start, 1e-9)
+    if results['JsonReader'] != results['json.loads']:
+        print "JsonReader differs from json.loads"
+        sys.exit(1)
+    print str(len(results['JsonReader']))+" tweets ("+str(reader.n_malformed)+" malformed lines), identical output, decoder: "+corpus_io.json_decoder.__name__
+    for key in ['json.loads', 'JsonReader']:
+        print "\t"+key+": "+str(int(tweets_per_second[key]))+" tweets/s ("+str(round(tweets_per_second[key]/tweets_per_second['json.loads'], 2))+"x)"
+    return tweets_per_second
+
+def uncompressed_name(filename):
+    """
+    Returns the name of a tweet file without its compression extension
+    """
+    for extension in corpus_io.decompressors.keys()+['.gz']:
+        if filename.endswith(extension):
+            return filename[:-len(extension)]
+    return filename
+
+def output_lines(working_dir):
+    """
+    Returns the sorted lines of each output file of an analysis (relative
+    path -> list of strings), leaving out the checkpoints
+    """
+    outputs = {}
+    for root, dirs, files in os.walk(working_dir):
+        if '.checkpoint' in dirs:
+            dirs.remove('.checkpoint')
+        for filename in files:
+            with open(root+'/'+filename, 'rb') as f:
+                outputs[os.path.relpath(root+'/'+filename, working_dir)] = sorted(f)
+    return outputs
+
+def bench_compression(tweet_dir):
+    """
+    Copies a corpus plain and with each compression of corpus_io.compressions
+    next to it (on the same filesystem), and times the analysis engine
+    (edge lists and daily timeline) end to end on each copy. Exits with an
+    error if any output differs. Files still in the page cache hide the
+    cost of reading them: the gain of compression on a shared filesystem
+    shows on corpora larger than memory (or after dropping the caches)
+
+    OUTPUT
+    ------
+    seconds, dict (compression -> float)
+    """
+    tweet_dir = os.path.abspath(tweet_dir)
+    temp_dir = tempfile.mkdtemp(prefix='.benchmark-', dir=os.path.dirname(tweet_dir))
+    compressions = [None]+sorted(corpus_io.compressions.keys())
+    seconds = {}
+    sizes = {}
+    outputs = {}
+    try:
+        for compression in compressions:
+            name = str(compression or 'plain')
+            # Copies keep the name of the corpus, which says if it is reduced
+            corpus_dir = temp_dir+'/'+name+'/'+os.path.basename(tweet_dir)
+            working_dir = temp_dir+'/'+name+'/results'
+            os.makedirs(corpus_dir)
+            for filename in sorted(os.listdir(tweet_dir)):
+                with corpus_io.open_stream(tweet_dir+'/'+filename) as f:
+                    with corpus_io.open_output(corpus_dir+'/'+uncompressed_name(filename), compression) as output:
+                        while True:
+                            block = f.read(2**20)
+                            if not block:
+                                break
+                            output.write(block)
+            sizes[name] = sum([os.path.getsize(corpus_dir+'/'+filename) for filename in os.listdir(corpus_dir)])
+            start = time.time()
+            engine = analysis_engine.AnalysisEngine(corpus_dir)
+            engine.register(analysis_engine.EdgeConsumer(network_analyzer.NetworkAnalyzer(corpus_dir, working_dir)))
+            engine.register(analysis_engine.TimelineConsumer(time_analyzer.TimeAnalyzer(corpus_dir, working_dir)))
+            engine.run()
+            seconds[name] = time.time()-start
+            outputs[name] = output_lines(working_dir)
+    finally:
+        shutil.rmtree(temp_dir)
+    for name in seconds:
+        if outputs[name] != outputs['plain']:
+            print "Outputs of the "+name+" corpus differ from the plain one"
+            sys.exit(1)
+    print "Identical output"
+    for compression in compressions:
+        name = str(compression or 'plain')
+        print "\t"+name+": "+str(round(seconds[name], 2))+" s ("+str(round(seconds['plain']/seconds[name], 2))+"x), "+str(round(sizes[name]/2.0**20, 1))+" MB ("+str(round(float(sizes[name])/sizes['plain'], 3))+" of plain)"
+    return seconds
+
+if __name__ == '__main__':
+    benchmarks = {'clean_tweet': bench_clean_tweet, 'parse_timestamp': bench_parse_timestamp, 'read_reduced': bench_read_reduced, 'read_json': bench_read_json,
+                  'compression': bench_compression}
+    if len(sys.argv) < 3 or sys.argv[1] not in benchmarks:
+        print "Usage: python benchmark.py ["+"|".join(sorted(benchmarks.keys()))+"] tweet_dir"
+        sys.exit()
+    benchmarks[sys.argv[1]](sys.argv[2])
@@ -0,0 +1,129 @@
+"""Centrality (centrality.py)
+Weighted PageRank, HITS and eigenvector centrality of large directed graphs
+given as integer edge arrays, by sparse power iteration: every product of the
+adjacency matrix with a vector is one np.bincount over the edges
+
+Contributors:
+Devin Gaffney & Ryan J. Gallagher
+Network Science Institute, Northeastern University, 2017
+"""
+import numpy as np
+
+def multiply(n_nodes, sources, targets, weights, x):
+    """
+    Returns A^T x, ie. for each node the weighted sum of x over the sources of
+    its in-edges
+    """
+    return np.bincount(targets, weights=weights*x[sources], minlength=n_nodes)
+
+def report(name, n_iterations, error, converged):
+    if converged:
+        print name+" converged after "+str(n_iterations)+" iterations (error "+str(error)+")"
+    else:
+        print name+" did not converge after "+str(n_iterations)+" iterations (error "+str(error)+")"
+
+def pagerank(n_nodes, sources, targets, weights, alpha=0.85, tol=1e-6, max_iter=100):
+    """
+    Weighted PageRank, as networkx.pagerank: each node passes alpha of its
+    score along its out-edges in proportion to their weights, nodes without
+    out-edges spread theirs over all nodes, and every node gets (1-alpha)/n
+
+    INPUT
+    -----
+    sources, targets: np.ndarray (int)
+        Node ids of the edges
+    weights: np.ndarray
+        Weight of each edge
+    tol: float
+        Iteration stops when the scores change by less than n_nodes*tol (L1)
+
+    OUTPUT
+    ------
+    scores, np.ndarray (float)
+        Score of each node id, summing to 1
+    n_iterations: int
+    converged: boolean
+    """
+    weights = np.asarray(weights, dtype=np.float64)
+    out_strength = np.bincount(sources, weights=weights, minlength=n_nodes)
+    dangling = out_strength == 0
+    # Weight of each edge as a share of its source's out-strength
+    shares = weights/out_strength[sources]
+    x = np.ones(n_nodes)/n_nodes
+    error = 0.0
+    for n_iterations in range(1, max_iter+1):
+        x_last = x
+        x = alpha*(multiply(n_nodes, sources, targets, shares, x_last)+x_last[dangling].sum()/n_nodes)+(1.0-alpha)/n_nodes
+        error = np.abs(x-x_last).sum()
+        if error < n_nodes*tol:
+            report("PageRank", n_iterations, error, True)
+            return x, n_iterations, True
+    report("PageRank", max_iter, error, False)
+    return x, max_iter, False
+
+def hits(n_nodes, sources, targets, weights, tol=1e-8, max_iter=100):
+    """
+    Weighted HITS hub and authority scores, as networkx.hits: authorities are
+    pointed to by good hubs (A^T h) and hubs point to good authorities (A a)
+
+    OUTPUT
+    ------
+    hubs, authorities: np.ndarray (float)
+        Scores of each node id, each summing to 1
+    n_iterations: int
+    converged: boolean
+    """
+    weights = np.asarray(weights, dtype=np.float64)
+    hubs = np.ones(n_nodes)/n_nodes
+    error = 0.0
+    for n_iterations in range(1, max_iter+1):
+        hubs_last = hubs
+        authorities = multiply(n_nodes, sources, targets, weights, hubs_last)
+        hubs = np.bincount(sources, weights=weights*authorities[targets], minlength=n_nodes)
+        hubs = hubs/max(hubs.max(), 1e-300)
+        authorities = authorities/max(authorities.max(), 1e-300)
+        error = np.abs(hubs-hubs_last).sum()
+        if error < tol:
+            break
+    else:
+        report("HITS", max_iter, error, False)
+        return normalized(hubs), normalized(authorities), max_iter, False
+    report("HITS", n_iterations, error, True)
+    return normalized(hubs), normalized(authorities), n_iterations, True
+
+def eigenvector(n_nodes, sources, targets, weights, tol=1e-6, max_iter=100):
+    """
+    Weighted eigenvector centrality (of in-edges), as
+    networkx.eigenvector_centrality: power iteration of (I + A^T) x, which
+    has the same leading eigenvector as A^T but does not oscillate on
+    bipartite graphs
+
+    OUTPUT
+    ------
+    scores, np.ndarray (float)
+        Score of each node id, with unit (L2) norm
+    n_iterations: int
+    converged: boolean
+    """
+    weights = np.asarray(weights, dtype=np.float64)
+    x = np.ones(n_nodes)/n_nodes
+    error = 0.0
+    for n_iterations in range(1, max_iter+1):
+        x_last = x
+        x = x_last+multiply(n_nodes, sources, targets, weights, x_last)
+        norm = np.sqrt((x**2).sum())
+        if norm == 0:
+            norm = 1.0
+        x = x/norm
+        error = np.abs(x-x_last).sum()
+        if error < n_nodes*tol:
+            report("Eigenvector centrality", n_iterations, error, True)
+            return x, n_iterations, True
+    report("Eigenvector centrality", max_iter, error, False)
+    return x, max_iter, False
+
+def normalized(x):
+    total = x.sum()
+    if total == 0:
+        return x
+    return x/total
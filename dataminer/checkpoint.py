@@ -0,0 +1,167 @@
+"""Checkpoint (checkpoint.py)
+Manifest of the tweet files an output directory was computed from: the size,
+mtime and md5 of each file with its partial results (as written by
+parallel.py), and the merged total of those partials. Reruns only process new
+or changed files and merge them into the cached total, and an interrupted run
+resumes from the files it had finished
+
+Contributors:
+Devin Gaffney & Ryan J. Gallagher
+Network Science Institute, Northeastern University, 2017
+"""
+import os
+import json
+import shutil
+import hashlib
+import parallel
+import ranked_writer
+
+def file_md5(path, block_size=2**20):
+    md5 = hashlib.md5()
+    with open(path, 'rb') as f:
+        while True:
+            block = f.read(block_size)
+            if not block:
+                break
+            md5.update(block)
+    return md5.hexdigest()
+
+class Manifest:
+    """
+    Per-file partial results of one analysis, kept in
+    <output_dir>/.checkpoint/<name>
+
+    Example:
+        import checkpoint
+        manifest = checkpoint.Manifest(working_dir+'/term_counts', 'terms', {'max_n': 1})
+        counts = manifest.run(term_counter, tweet_files, 'get_terms_from_file', (1,))
+
+    Parameters
+    ----------
+    output_dir: string
+        Output directory of the analysis
+
+    name: string
+        Name of the analysis, as several can share an output directory
+
+    params: dict, defaults to None
+        Parameters the partials depend on (JSON serializable). Cached
+        partials made with other parameters are discarded
+
+    Attributes
+    ----------
+    files: dict (filename -> dict)
+        size, mtime, md5 and partial (file name in partials/) of each
+        processed tweet file
+
+    total: dict
+        md5 of each file (filename -> md5) merged into total.partial
+    """
+    def __init__(self, output_dir, name, params=None):
+        self.path = output_dir+'/.checkpoint/'+name
+        self.params = json.loads(json.dumps(params or {}))
+        self.files = {}
+        self.total = None
+        self.pending = {}
+        manifest = None
+        if os.path.exists(self.path+'/manifest.json'):
+            with open(self.path+'/manifest.json', 'rb') as f:
+                manifest = json.load(f)
+        if manifest is not None and manifest['params'] == self.params:
+            self.files = dict([(filename.encode('utf-8'), entry) for filename, entry in manifest['files'].iteritems()])
+            self.total = manifest['total']
+            if self.total is not None:
+                self.total['files'] = dict([(filename.encode('utf-8'), md5) for filename, md5 in self.total['files'].iteritems()])
+        else:
+            shutil.rmtree(self.path, ignore_errors=True)
+        try:
+            os.makedirs(self.path+'/partials')
+        except:
+            pass
+
+    def run(self, analyzer, filenames, method_name, method_args=(), n_workers=1):
+        """
+        Runs analyzer.<method_name>(filename, *method_args) for the files of
+        filenames that are new or changed since the last run (in n_workers
+        processes with parallel.py if more than one), saving each partial as
+        soon as it is done, and returns the merged partials of all filenames
+        """
+        stale = self.refresh(analyzer.tweet_dir, filenames)
+        if n_workers > 1 and len(stale) > 1:
+            results = parallel.map_files(analyzer.__class__, (analyzer.tweet_dir, analyzer.working_dir), method_name,
+                                         stale, method_args, n_workers, with_filenames=True)
+            for filename, partial in results:
+                self.save_partial(filename, partial)
+        else:
+            for filename in stale:
+                print filename
+                self.save_partial(filename, getattr(analyzer, method_name)(filename, *method_args))
+        return self.merged(filenames)
+
+    def refresh(self, tweet_dir, filenames):
+        """
+        Drops the entries of files that were removed or changed and returns
+        the files to process. A file whose size and mtime are unchanged is
+        taken to be unchanged; otherwise its md5 decides (eg. a file that was
+        only touched keeps its partial)
+        """
+        for filename in self.files.keys():
+            if filename not in filenames:
+                self.drop(filename)
+        stale = []
+        for filename in filenames:
+            stat = os.stat(tweet_dir+'/'+filename)
+            entry = self.files.get(filename)
+            if entry is not None and entry['size'] == stat.st_size and entry['mtime'] == stat.st_mtime:
+                continue
+            md5 = file_md5(tweet_dir+'/'+filename)
+            if entry is not None and entry['size'] == stat.st_size and entry['md5'] == md5:
+                entry['mtime'] = stat.st_mtime
+                continue
+            if entry is not None:
+                self.drop(filename)
+            self.pending[filename] = {'size': stat.st_size, 'mtime': stat.st_mtime, 'md5': md5}
+            stale.append(filename)
+        self.write()
+        if stale:
+            print str(len(stale))+" of "+str(len(filenames))+" files are new or changed"
+        return stale
+
+    def drop(self, filename):
+        entry = self.files.pop(filename)
+        if os.path.exists(self.path+'/partials/'+entry['partial']):
+            os.remove(self.path+'/partials/'+entry['partial'])
+
+    def save_partial(self, filename, partial):
+        entry = self.pending.pop(filename)
+        entry['partial'] = hashlib.md5(filename).hexdigest()+'.partial'
+        parallel.dump_partial(partial, self.path+'/partials/'+entry['partial'])
+        self.files[filename] = entry
+        self.write()
+
+    def merged(self, filenames):
+        """
+        Returns the merged partials of filenames: the cached total if every
+        file in it is unchanged, plus the partials of the files it lacks
+        """
+        total = {}
+        merged_files = {}
+        if self.total is not None and os.path.exists(self.path+'/total.partial') and \
+           all([filename in self.files and self.files[filename]['md5'] == md5
+                for filename, md5 in self.total['files'].iteritems()]):
+            total = parallel.load_partial(self.path+'/total.partial')
+            merged_files = self.total['files']
+        missing = [filename for filename in filenames if filename not in merged_files]
+        for filename in missing:
+            total = parallel.merge_partials(total, parallel.load_partial(self.path+'/partials/'+self.files[filename]['partial']))
+            merged_files[filename] = self.files[filename]['md5']
+        if missing or self.total is None:
+            parallel.dump_partial(total, self.path+'/total.partial.tmp')
+            os.rename(self.path+'/total.partial.tmp', self.path+'/total.partial')
+            self.total = {'files': merged_files}
+            self.write()
+        return total
+
+    def write(self):
+        with ranked_writer.atomic_open(self.path+'/manifest.json') as f:
+            json.dump({'params': self.params, 'files': self.files, 'total': self.total}, f)
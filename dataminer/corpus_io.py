@@ -0,0 +1,537 @@
+"""Corpus IO (corpus_io.py)
+Reads the files of a corpus as streams of lines, decompressing compressed
+files (.lz4, .zst, .xz, .gz) on the fly, writes compressed extraction files,
+and parses them into rows of only the fields an
+analysis needs: columns of reduced (tab-separated) tweets, split as bytes and
+decoded only where needed, and fields of full (JSON) tweets, decoded in
+batches with the fastest JSON decoder installed
+
+Contributors:
+Devin Gaffney & Ryan J. Gallagher
+Network Science Institute, Northeastern University, 2017
+"""
+import os
+import csv
+import gzip
+import operator
+import subprocess
+from itertools import islice, izip, repeat
+try:
+    import ujson as json_decoder
+except ImportError:
+    try:
+        import simplejson as json_decoder
+    except ImportError:
+        import json as json_decoder
+try:
+    from backports import lzma
+except ImportError:
+    lzma = None
+
+# Columns of the reduced (tab-separated) files used by the analyzers
+CREATED_AT = 2
+TEXT = 9
+SCREEN_NAME = -1
+REDUCED_COLUMNS = (CREATED_AT, TEXT, SCREEN_NAME)
+
+# Key of the raw line in the rows of JsonReader with keep_lines=True
+LINE = '_line'
+
+# Bytes of lines read at a time
+BUFFER_SIZE = 2**20
+# Bytes of lines parsed at a time by ReducedReader, small enough for the
+# values of a buffer to stay in the CPU cache as its columns are sliced
+PARSE_SIZE = 2**18
+
+# File extension and compression command of the compressions extraction
+# files can be written with (see open_output()), and decompression command of
+# each extension
+compressions = {'lz4': ('.lz4', ["lz4", "-q", "-c"]),
+                'zstd': ('.zst', ["zstd", "-q", "-c"])}
+decompressors = {'.lz4': ["lz4", "-dc"],
+                 '.zst': ["zstd", "-dc"],
+                 '.xz': ["xzcat"]}
+
+def open_stream(path, buffer_size=BUFFER_SIZE):
+    """
+    Opens a file of a corpus for reading lines: .lz4 and .zst files are
+    decompressed by lz4 and zstd, .xz files with lzma if installed (with
+    xzcat otherwise), .gz files with gzip, other files are read as they are
+    """
+    extension = os.path.splitext(path)[1]
+    if extension == '.xz' and lzma is not None:
+        return lzma.LZMAFile(path, 'rb')
+    if extension in decompressors:
+        return CommandStream(decompressors[extension]+[path])
+    if extension == '.gz':
+        return gzip.open(path, 'rb')
+    return open(path, 'rb', buffer_size)
+
+def compressed_name(path, compression=None):
+    """
+    Returns the name of a file written with open_output(path, compression)
+    """
+    if compression is None:
+        return path
+    return path+compressions[compression][0]
+
+def open_output(path, compression=None):
+    """
+    Opens the file compressed_name(path, compression) for writing: lines
+    written to it are compressed by lz4 or zstd (see compressions), or
+    written as they are if compression is None
+    """
+    if compression is None:
+        return open(path, 'wb')
+    if compression not in compressions:
+        raise ValueError("Unknown compression '"+str(compression)+"', expected one of "+", ".join(sorted(compressions)))
+    return CommandWriter(compressions[compression][1], compressed_name(path, compression))
+
+class CommandStream:
+    """
+    Lines of the standard output of a command (eg. a decompressor), as a file
+    object. Closing it before the end stops the command; a command that fails
+    raises an IOError when closed
+    """
+    def __init__(self, command):
+        self.command = command
+        self.process = subprocess.Popen(command, stdout=subprocess.PIPE, bufsize=-1)
+
+    def __iter__(self):
+        return iter(self.process.stdout)
+
+    def read(self, size=-1):
+        return self.process.stdout.read(size)
+
+    def readlines(self, sizehint=0):
+        return self.process.stdout.readlines(sizehint)
+
+    def close(self):
+        if self.process.stdout.closed:
+            return
+        stopped_early = self.process.poll() is None
+        if stopped_early:
+            self.process.kill()
+        self.process.stdout.close()
+        status = self.process.wait()
+        if status != 0 and not stopped_early:
+            raise IOError(" ".join(self.command)+" exited with status "+str(status))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+class CommandWriter:
+    """
+    File object whose writes go through a command (eg. a compressor) into a
+    file. A command that fails raises an IOError when closed
+    """
+    def __init__(self, command, path):
+        self.command = command
+        self.path = path
+        with open(path, 'wb') as output:
+            self.process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=output, bufsize=-1)
+
+    def write(self, data):
+        self.process.stdin.write(data)
+
+    def close(self):
+        if self.process.stdin.closed:
+            return
+        self.process.stdin.close()
+        status = self.process.wait()
+        if status != 0:
+            raise IOError(" ".join(self.command)+" exited with status "+str(status))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+count_tabs = operator.methodcaller('count', '\t')
+
+def split_reduced_line(line):
+    """
+    Returns all the columns of a line of a reduced file, as
+    csv.reader(delimiter='\t') would: lines with a quoted column are parsed
+    by csv, the others split on tabs
+    """
+    if line.startswith('"') or '\t"' in line:
+        for row in csv.reader([line], delimiter='\t'):
+            return row
+        return []
+    return line.rstrip('\r\n').split('\t')
+
+class ReducedReader:
+    """
+    Reads reduced (tab-separated) tweet files into rows, as csv.reader would
+    but faster: the lines of a buffer are split as bytes all at once, only the
+    requested columns are kept, and only the decoded columns are decoded from
+    UTF-8. Lines with a quoted column (which csv parses differently) or with
+    an unusual number of columns are found with string searches and parsed
+    one by one, so a few of them do not slow down the rest of the buffer
+
+    Example:
+        import corpus_io
+        reader = corpus_io.ReducedReader()
+        for row in reader.rows(tweet_dir+'/'+filename):
+            row[corpus_io.TEXT], row[corpus_io.SCREEN_NAME]
+        reader.n_malformed
+
+    Parameters
+    ----------
+    columns: tuple of ints, defaults to REDUCED_COLUMNS
+        Indices of the columns used (negative ones count from the end). Rows
+        are dicts (column -> value) of these columns, like the rows of
+        corpus_store.CorpusStore
+
+    decoded: tuple of ints, defaults to (TEXT,)
+        Columns decoded to unicode; the others are kept as bytes
+
+    full_rows: boolean, defaults to False
+        If True, rows are lists of all the columns of the line (eg. to write
+        them out), as csv.reader returns them
+
+    buffer_size: int, defaults to PARSE_SIZE
+        Bytes of lines parsed at a time
+
+    Attributes
+    ----------
+    n_rows: int
+        Rows read
+
+    n_malformed: int
+        Lines without all the columns, or whose decoded columns are not
+        UTF-8. Blank lines are skipped without being counted
+    """
+    def __init__(self, columns=REDUCED_COLUMNS, decoded=(TEXT,), full_rows=False, buffer_size=PARSE_SIZE):
+        self.columns = columns
+        self.decoded = decoded
+        self.full_rows = full_rows
+        self.buffer_size = buffer_size
+        # Splits of lines split one by one (-1: all of them) and columns a
+        # row must have
+        if full_rows or min(columns) < 0:
+            self.max_split = -1
+        else:
+            self.max_split = max(columns)+1
+        self.min_length = max(max(columns)+1, -min(columns))
+        self.n_rows = 0
+        self.n_malformed = 0
+
+    def rows(self, path):
+        """
+        Yields the rows of a tweet file (see open_stream())
+        """
+        with open_stream(path) as f:
+            while True:
+                lines = f.readlines(self.buffer_size)
+                if not lines:
+                    break
+                for row in self.parse(lines):
+                    yield row
+
+    def parse(self, lines):
+        """
+        Returns the rows of a list of lines. Lines with the usual number of
+        columns and no quoted column are split all at once, as one string;
+        the others (see special_lines()) are split one by one with
+        parse_lines(), and their rows put back in order
+        """
+        text = ''.join(lines)
+        widths = map(count_tabs, lines)
+        n_tabs = max(set(widths), key=widths.count)
+        if n_tabs+1 < self.min_length:
+            return self.parse_lines(lines)
+        special = self.special_lines(text, lines, widths, n_tabs)
+        if not special:
+            rows = self.parse_run(text, len(lines), n_tabs+1)
+            if rows is None:
+                return self.parse_lines(lines)
+            return rows
+        if len(special) == len(lines):
+            return self.parse_lines(lines)
+        # Text of the other lines, in order
+        pieces = []
+        previous = 0
+        for k in special:
+            pieces.append(''.join(lines[previous:k]))
+            previous = k+1
+        pieces.append(''.join(lines[previous:]))
+        regular_rows = self.parse_run(''.join(pieces), len(lines)-len(special), n_tabs+1, keep_failed=True)
+        if regular_rows is None:
+            return self.parse_lines(lines)
+        rows = []
+        previous = 0
+        for n_special, k in enumerate(special):
+            # Lines before k that are not special
+            end = k-n_special
+            rows.extend(regular_rows[previous:end])
+            previous = end
+            rows.extend(self.parse_lines(lines[k:k+1]))
+        rows.extend(regular_rows[previous:])
+        if None in regular_rows:
+            rows = [row for row in rows if row is not None]
+        return rows
+
+    def special_lines(self, text, lines, widths, n_tabs):
+        """
+        Returns the sorted indices of the lines that have n_tabs tabs but a
+        quoted column, or another number of tabs. Quotes are found with one
+        search of text (the joined lines), so that the cost is in the number
+        of quoted lines rather than of lines
+        """
+        special = set()
+        if widths.count(n_tabs) != len(widths):
+            for width in set(widths):
+                if width == n_tabs:
+                    continue
+                k = widths.index(width)
+                while True:
+                    special.add(k)
+                    try:
+                        k = widths.index(width, k+1)
+                    except ValueError:
+                        break
+        # Quotes opening a column follow a tab, or a newline (replaced by a
+        # tab so that both are found in one search)
+        flat = text.replace('\n', '\t')
+        if text.startswith('"'):
+            special.add(0)
+        offset = flat.find('\t"')
+        line = 0
+        previous = 0
+        while offset != -1:
+            # Line of the quote, counting the newlines before it
+            line += text.count('\n', previous, offset+1)
+            previous = offset+1
+            special.add(line)
+            offset = flat.find('\t"', offset+1)
+        return sorted(special)
+
+    def parse_run(self, text, n_lines, n_columns, keep_failed=False):
+        """
+        Returns the rows of the text of n_lines lines that all have n_columns
+        unquoted columns (None if the text does not split into as many
+        values). Rows whose decoded columns are not UTF-8 are counted as
+        malformed, and left out (or None if keep_failed)
+        """
+        if not text.endswith('\n'):
+            text += '\n'
+        if '\r' in text:
+            text = text.replace('\r\n', '\n')
+        values = text.replace('\n', '\t').split('\t')
+        values.pop()
+        if len(values) != n_lines*n_columns:
+            return None
+        failed = set()
+        if self.full_rows:
+            positions = range(n_columns)
+        else:
+            positions = [column % n_columns for column in self.columns]
+        columns = dict([(position, values[position::n_columns]) for position in positions])
+        for column in self.decoded:
+            position = column % n_columns
+            try:
+                # Texts have no newlines, so the column is decoded as one string
+                columns[position] = '\n'.join(columns[position]).decode('utf-8').split(u'\n')
+            except UnicodeDecodeError:
+                columns[position] = self.decode_values(columns[position], failed)
+        if self.full_rows:
+            if self.decoded:
+                for position in set([column % n_columns for column in self.decoded]):
+                    values[position::n_columns] = columns[position]
+            rows = [values[k:k+n_columns] for k in xrange(0, len(values), n_columns)]
+        else:
+            values = [columns[position] for position in positions]
+            # Rows of up to three columns are built as dict displays, the
+            # others column by column
+            if len(values) == 1:
+                c0, = self.columns
+                rows = [{c0: v0} for v0 in values[0]]
+            elif len(values) == 2:
+                c0, c1 = self.columns
+                rows = [{c0: v0, c1: v1} for v0, v1 in izip(*values)]
+            elif len(values) == 3:
+                c0, c1, c2 = self.columns
+                rows = [{c0: v0, c1: v1, c2: v2} for v0, v1, v2 in izip(*values)]
+            else:
+                rows = [{self.columns[0]: v0} for v0 in values[0]]
+                for column, column_values in zip(self.columns[1:], values[1:]):
+                    map(operator.setitem, rows, repeat(column, n_lines), column_values)
+        if failed:
+            for k in failed:
+                rows[k] = None
+            self.n_malformed += len(failed)
+            if not keep_failed:
+                rows = [row for row in rows if row is not None]
+        self.n_rows += n_lines-len(failed)
+        return rows
+
+    def decode_values(self, values, failed):
+        """
+        Decodes values one by one, adding the indices of those that are not
+        UTF-8 to failed
+        """
+        decoded = []
+        for k, value in enumerate(values):
+            try:
+                decoded.append(value.decode('utf-8'))
+            except UnicodeDecodeError:
+                decoded.append(None)
+                failed.add(k)
+        return decoded
+
+    def parse_lines(self, lines):
+        """
+        Returns the rows of a list of lines, splitting them one by one
+        """
+        decoded, max_split, min_length = self.decoded, self.max_split, self.min_length
+        rows = []
+        append = rows.append
+        for line in lines:
+            if line.startswith('"') or '\t"' in line:
+                try:
+                    row = split_reduced_line(line)
+                except csv.Error:
+                    self.n_malformed += 1
+                    continue
+            else:
+                row = line.rstrip('\r\n').split('\t', max_split)
+            if len(row) < min_length:
+                if row != ['']:
+                    self.n_malformed += 1
+                continue
+            try:
+                for column in decoded:
+                    row[column] = row[column].decode('utf-8')
+            except UnicodeDecodeError:
+                self.n_malformed += 1
+                continue
+            if not self.full_rows:
+                row = dict([(column, row[column]) for column in self.columns])
+            append(row)
+        self.n_rows += len(rows)
+        return rows
+
+def tweet_text(row):
+    """
+    Returns the full text of a row of JsonReader: the text of extended (long)
+    tweets if they have one, their text field otherwise
+    """
+    return row.get('extended_tweet.full_text') or row['text']
+
+class JsonReader:
+    """
+    Reads full (JSON) tweet files into rows of selected fields
+
+    Example:
+        import corpus_io
+        reader = corpus_io.JsonReader(['created_at', 'user.screen_name'])
+        for row in reader.rows(tweet_dir+'/'+filename):
+            row['user.screen_name']
+        reader.n_malformed
+
+    Parameters
+    ----------
+    fields: list of strings, defaults to None
+        Dotted paths of the fields kept (eg. "user.screen_name"). Missing
+        fields are None. Whole tweets are kept if None
+
+    batch_size: int, defaults to 10000
+        Lines decoded at a time
+
+    keep_lines: boolean, defaults to False
+        If True, rows also keep their raw JSON line under LINE
+
+    Attributes
+    ----------
+    n_lines: int
+        Lines read
+
+    n_malformed: int
+        Lines that are not JSON objects
+
+    n_skipped: int
+        JSON objects that are not tweets (eg. delete notices, without
+        created_at)
+    """
+    def __init__(self, fields=None, batch_size=10000, keep_lines=False):
+        self.fields = fields
+        if fields is not None:
+            self.paths = [(field, field.split('.')) for field in fields]
+        self.batch_size = batch_size
+        self.keep_lines = keep_lines
+        self.n_lines = 0
+        self.n_malformed = 0
+        self.n_skipped = 0
+
+    def rows(self, path):
+        """
+        Yields the rows of a tweet file (see open_stream())
+        """
+        for batch in self.batches(path):
+            for row in batch:
+                yield row
+
+    def batches(self, path):
+        """
+        Yields the rows of a tweet file as lists of at most batch_size
+        """
+        stream = open_stream(path)
+        try:
+            while True:
+                lines = list(islice(stream, self.batch_size))
+                if not lines:
+                    break
+                self.n_lines += len(lines)
+                yield self.decode(lines)
+        finally:
+            stream.close()
+
+    def decode(self, lines):
+        """
+        Returns the rows of a list of JSON lines, counting the malformed ones
+        (blank lines are skipped)
+        """
+        loads = json_decoder.loads
+        project = self.project
+        rows = []
+        for line in lines:
+            try:
+                tweet = loads(line)
+            except ValueError:
+                if line.strip():
+                    self.n_malformed += 1
+                continue
+            if not isinstance(tweet, dict):
+                self.n_malformed += 1
+                continue
+            if 'created_at' not in tweet:
+                self.n_skipped += 1
+                continue
+            row = project(tweet)
+            if self.keep_lines:
+                row[LINE] = line
+            rows.append(row)
+        return rows
+
+    def project(self, tweet):
+        """
+        Returns the row of the selected fields of a decoded tweet
+        """
+        if self.fields is None:
+            return tweet
+        row = {}
+        for field, keys in self.paths:
+            value = tweet
+            for key in keys:
+                if not isinstance(value, dict):
+                    value = None
+                    break
+                value = value.get(key)
+            row[field] = value
+        return row
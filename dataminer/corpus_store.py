@@ -0,0 +1,231 @@
+"""Corpus Store (corpus_store.py)
+Converts a directory of extracted (reduced) tweets into a compact columnar
+store that the analyzers memory-map instead of re-parsing the tab-separated
+files, and reads the rows of a tweet file from either
+
+    python corpus_store.py /home/dgaffney/hashtag_extractions/#Ferguson_2015-08-09_2017-08-09_reduced
+
+Layout of the store directory (<tweet_dir>.columnar):
+    files.tsv           one line per tweet file: file, size, mtime, first row,
+                        end row (rows of the file are [first row, end row))
+    created_at.int64    tweet timestamps, seconds since the epoch (UTC)
+    screen_name.int32   screen names, as indices into screen_names.txt
+    screen_names.txt    distinct screen names, one per line
+    text_offsets.int64  start of the text of each row in text.bytes, plus the
+                        end of the last one
+    text.bytes          UTF-8 text of all rows, back to back
+
+Contributors:
+Devin Gaffney & Ryan J. Gallagher
+Network Science Institute, Northeastern University, 2017
+"""
+import os
+import sys
+import calendar
+from dateutil import parser
+import numpy as np
+import corpus_io
+
+# Columns of the reduced (summarized CSV) files used by the analyzers
+CREATED_AT = corpus_io.CREATED_AT
+TEXT = corpus_io.TEXT
+SCREEN_NAME = corpus_io.SCREEN_NAME
+
+# created_at of rows whose timestamp could not be parsed
+NULL_TIME = np.iinfo(np.int64).min
+
+def store_path(tweet_dir):
+    return tweet_dir.rstrip('/')+'.columnar'
+
+def build_corpus_store(tweet_dir):
+    """
+    Writes the columnar store of a directory of reduced tweet files. Rows
+    without a text and screen name column, or whose text is not UTF-8, are
+    left out, as the analyzers count them as null rows
+
+    OUTPUT
+    ------
+    path, string
+        Directory of the store
+    """
+    if 'reduced' not in tweet_dir:
+        print "The columnar store can only be built from reduced (CSV) tweets"
+        sys.exit()
+    path = store_path(tweet_dir)
+    if not os.path.isdir(path):
+        os.makedirs(path)
+    name2id = {}
+    n_rows = 0
+    text_offset = 0
+    null_rows = 0
+    created_at_file = open(path+'/created_at.int64', 'wb')
+    screen_name_file = open(path+'/screen_name.int32', 'wb')
+    offsets_file = open(path+'/text_offsets.int64', 'wb')
+    text_file = open(path+'/text.bytes', 'wb')
+    files_file = open(path+'/files.tsv.tmp', 'wb')
+    for filename in sorted(os.listdir(tweet_dir)):
+        print filename
+        first_row = n_rows
+        created_at = []
+        screen_names = []
+        offsets = []
+        reader = corpus_io.ReducedReader()
+        for tweet in reader.rows(tweet_dir+'/'+filename):
+            try:
+                created_at.append(calendar.timegm(parser.parse(tweet[CREATED_AT]).utctimetuple()))
+            except:
+                created_at.append(NULL_TIME)
+            screen_name = tweet[SCREEN_NAME]
+            if screen_name not in name2id:
+                name2id[screen_name] = len(name2id)
+            screen_names.append(name2id[screen_name])
+            offsets.append(text_offset)
+            text = tweet[TEXT].encode('utf-8')
+            text_file.write(text)
+            text_offset += len(text)
+            n_rows += 1
+        null_rows += reader.n_malformed
+        np.array(created_at, dtype=np.int64).tofile(created_at_file)
+        np.array(screen_names, dtype=np.int32).tofile(screen_name_file)
+        np.array(offsets, dtype=np.int64).tofile(offsets_file)
+        stat = os.stat(tweet_dir+'/'+filename)
+        files_file.write(filename+'\t'+str(stat.st_size)+'\t'+str(int(stat.st_mtime))+'\t'+str(first_row)+'\t'+str(n_rows)+'\n')
+    np.array([text_offset], dtype=np.int64).tofile(offsets_file)
+    for f in [created_at_file, screen_name_file, offsets_file, text_file]:
+        f.close()
+    with open(path+'/screen_names.txt', 'wb') as f:
+        for screen_name, k in sorted(name2id.items(), key=lambda item: item[1]):
+            f.write(screen_name+'\n')
+    # files.tsv is written last, so that a half-built store is never used
+    files_file.close()
+    os.rename(path+'/files.tsv.tmp', path+'/files.tsv')
+    print str(n_rows)+" rows stored, "+str(null_rows)+" null rows left out"
+    return path
+
+def open_corpus_store(tweet_dir):
+    """
+    Returns the CorpusStore of a directory of tweets, or None if there is no
+    store or if the tweet files changed since it was built
+    """
+    path = store_path(tweet_dir)
+    if not os.path.exists(path+'/files.tsv'):
+        return None
+    store = CorpusStore(path)
+    for filename in os.listdir(tweet_dir):
+        stat = os.stat(tweet_dir+'/'+filename)
+        if store.file_stats.get(filename) != (stat.st_size, int(stat.st_mtime)):
+            print "Columnar store '"+path+"' is out of date, reading the tweet files"
+            return None
+    return store
+
+def read_rows(tweet_dir, filename, reduced_data, store=None, fields=None, keep_lines=False,
+              columns=corpus_io.REDUCED_COLUMNS):
+    """
+    Yields the rows of a tweet file: rows of the store when one is given,
+    rows (dicts) of the given columns of a reduced file (see
+    corpus_io.ReducedReader), or rows of the given fields of a full (JSON)
+    file (see corpus_io.JsonReader). If keep_lines, rows keep all the columns
+    of reduced files, and the raw JSON line of full ones
+    """
+    if store is not None:
+        for tweet in store.rows(filename):
+            yield tweet
+        return
+    if reduced_data is True:
+        reader = corpus_io.ReducedReader(columns, [column for column in columns if column == TEXT], full_rows=keep_lines)
+    else:
+        reader = corpus_io.JsonReader(fields, keep_lines=keep_lines)
+    for tweet in reader.rows(tweet_dir+'/'+filename):
+        yield tweet
+    if reader.n_malformed > 0:
+        print str(reader.n_malformed)+" malformed lines in "+filename
+
+class CorpusStore:
+    """
+    Memory-mapped columns of a corpus built by build_corpus_store()
+
+    Example:
+        import corpus_store
+        store = corpus_store.CorpusStore(corpus_store.store_path(tweet_dir))
+        start, end = store.file_rows[filename]
+        store.created_at[start:end]
+
+    Parameters
+    ----------
+    path: string
+        Directory of the store
+
+    Attributes
+    ----------
+    created_at: np.memmap (int64)
+        Seconds since the epoch of each row, NULL_TIME if unparseable
+
+    screen_name_ids: np.memmap (int32)
+        Index into screen_names of each row
+
+    screen_names: list of strings
+        Distinct screen names
+
+    text_offsets: np.memmap (int64)
+        Start of each row's text in text_bytes (n_rows+1 entries)
+
+    text_bytes: np.memmap (uint8)
+        UTF-8 text of all rows
+
+    file_rows: dict (file -> (first row, end row))
+
+    file_stats: dict (file -> (size, mtime))
+        Size and modification time of each tweet file when the store was built
+    """
+    def __init__(self, path):
+        self.path = path
+        self.file_rows = {}
+        self.file_stats = {}
+        with open(path+'/files.tsv', 'rb') as f:
+            for line in f:
+                filename, size, mtime, first_row, end_row = line.rstrip('\n').split('\t')
+                self.file_rows[filename] = (int(first_row), int(end_row))
+                self.file_stats[filename] = (int(size), int(mtime))
+        with open(path+'/screen_names.txt', 'rb') as f:
+            self.screen_names = [line.rstrip('\n') for line in f]
+        self.created_at = self.memmap('created_at.int64', np.int64)
+        self.screen_name_ids = self.memmap('screen_name.int32', np.int32)
+        self.text_offsets = self.memmap('text_offsets.int64', np.int64)
+        self.text_bytes = self.memmap('text.bytes', np.uint8)
+        self.n_rows = len(self.created_at)
+
+    def memmap(self, filename, dtype):
+        # np.memmap refuses empty files
+        if os.path.getsize(self.path+'/'+filename) == 0:
+            return np.zeros(0, dtype=dtype)
+        return np.memmap(self.path+'/'+filename, dtype=dtype, mode='r')
+
+    def text(self, row):
+        return self.text_bytes[self.text_offsets[row]:self.text_offsets[row+1]].tostring()
+
+    def rows(self, filename):
+        """
+        Yields the rows of a tweet file as dicts keyed by the columns of the
+        reduced files (CREATED_AT, TEXT, SCREEN_NAME), so that they can be used
+        in place of corpus_io.ReducedReader rows. created_at is an int (None if
+        unparseable) rather than the original string
+        """
+        first_row, end_row = self.file_rows[filename]
+        created_at = self.created_at[first_row:end_row].tolist()
+        screen_name_ids = self.screen_name_ids[first_row:end_row].tolist()
+        offsets = self.text_offsets[first_row:end_row+1].tolist()
+        text_bytes = self.text_bytes
+        screen_names = self.screen_names
+        for k in xrange(end_row-first_row):
+            timestamp = created_at[k]
+            if timestamp == NULL_TIME:
+                timestamp = None
+            yield {CREATED_AT: timestamp,
+                   TEXT: text_bytes[offsets[k]:offsets[k+1]].tostring().decode('utf-8'),
+                   SCREEN_NAME: screen_names[screen_name_ids[k]]}
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print "Usage: python corpus_store.py tweet_dir"
+        sys.exit()
+    build_corpus_store(sys.argv[1])
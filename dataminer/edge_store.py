@@ -0,0 +1,217 @@
+"""Edge Store (edge_store.py)
+Compact weighted directed graph: screen names interned to dense integer ids,
+edges buffered as parallel int arrays and deduplicated (and weighted) with a
+sort/unique pass into sorted arrays of packed (source, target) keys
+
+Contributors:
+Devin Gaffney & Ryan J. Gallagher
+Network Science Institute, Northeastern University, 2017
+"""
+import csv
+from array import array
+import numpy as np
+
+def read_edge_list(filename):
+    """
+    Returns the EdgeStore of an edge list CSV file (source, target, weight),
+    as written by NetworkAnalyzer.write_edge_list()
+    """
+    edges = EdgeStore()
+    with open(filename, 'rb') as f:
+        for row in csv.reader(f, delimiter=','):
+            edges.add(row[0], row[1], int(row[2]))
+    return edges
+
+class EdgeStore:
+    """
+    Weighted edges between named nodes
+
+    Example:
+        import edge_store
+        edges = edge_store.EdgeStore()
+        edges.add('user1', 'user2')
+        edges.n_nodes(), edges.n_edges(), edges.in_degree()
+        indptr, targets, weights = edges.csr()
+
+    Parameters
+    ----------
+    buffer_size: int, defaults to 1000000
+        Number of edges buffered before they are folded into keys and weights
+
+    Attributes
+    ----------
+    node2id: dict (name -> id)
+
+    nodes: list of strings
+        Name of each id
+
+    keys, weights: np.ndarray (int64)
+        Distinct edges, packed as source << 32 | target, in increasing order
+        (ie. sorted by source, then target), and their weights
+    """
+    def __init__(self, buffer_size=1000000):
+        self.buffer_size = buffer_size
+        self.node2id = {}
+        self.nodes = []
+        self.keys = np.zeros(0, dtype=np.int64)
+        self.weights = np.zeros(0, dtype=np.int64)
+        self.sources = array('l')
+        self.targets = array('l')
+        self.buffer_weights = array('l')
+
+    def __getstate__(self):
+        # Pickled (eg. as a partial of parallel.py) without the buffers
+        self.flush()
+        return self.__dict__
+
+    def __len__(self):
+        return self.n_edges()
+
+    def node_id(self, name):
+        node_id = self.node2id.get(name)
+        if node_id is None:
+            node_id = self.node2id[name] = len(self.nodes)
+            self.nodes.append(name)
+        return node_id
+
+    def add(self, source, target, weight=1):
+        """
+        Adds weight to the edge from source to target (names)
+        """
+        self.sources.append(self.node_id(source))
+        self.targets.append(self.node_id(target))
+        self.buffer_weights.append(weight)
+        if len(self.sources) >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        """
+        Folds the buffered edges into keys and weights
+        """
+        if len(self.sources) == 0:
+            return
+        keys = (np.frombuffer(self.sources, dtype=np.int64) << 32) | np.frombuffer(self.targets, dtype=np.int64)
+        weights = np.frombuffer(self.buffer_weights, dtype=np.int64)
+        self.sources = array('l')
+        self.targets = array('l')
+        self.buffer_weights = array('l')
+        self.add_keys(keys, weights)
+
+    def add_keys(self, keys, weights):
+        """
+        Adds the weights of (unsorted, repeated) packed keys: the new keys are
+        deduplicated on their own, then merged into the sorted keys in linear
+        time rather than sorting everything again
+        """
+        keys, inverse = np.unique(keys, return_inverse=True)
+        totals = np.zeros(len(keys), dtype=np.int64)
+        np.add.at(totals, inverse, weights)
+        positions = np.searchsorted(self.keys, keys)
+        found = positions < len(self.keys)
+        found[found] = self.keys[positions[found]] == keys[found]
+        self.weights[positions[found]] += totals[found]
+        self.keys = np.insert(self.keys, positions[~found], keys[~found])
+        self.weights = np.insert(self.weights, positions[~found], totals[~found])
+
+    def update(self, other):
+        """
+        Adds the edges of another EdgeStore, or of a dict of (source, target)
+        -> weight, remapping node ids
+        """
+        if not isinstance(other, EdgeStore):
+            for (source, target), weight in other.iteritems():
+                self.add(source, target, weight)
+            return
+        other.flush()
+        self.flush()
+        mapping = np.array([self.node_id(name) for name in other.nodes], dtype=np.int64)
+        sources, targets = other.edge_arrays()
+        self.add_keys((mapping[sources] << 32) | mapping[targets], other.weights)
+
+    merge = update
+
+    def subtract(self, other):
+        """
+        Removes the weights of the edges of another EdgeStore (eg. the time
+        bucket leaving a sliding window) and drops the edges left without
+        weight. Names stay interned
+        """
+        other.flush()
+        self.flush()
+        mapping = np.array([self.node_id(name) for name in other.nodes], dtype=np.int64)
+        sources, targets = other.edge_arrays()
+        self.add_keys((mapping[sources] << 32) | mapping[targets], -other.weights)
+        kept = self.weights != 0
+        self.keys = self.keys[kept]
+        self.weights = self.weights[kept]
+
+    def edge_arrays(self):
+        """
+        Returns the source and target ids of the distinct edges
+        """
+        self.flush()
+        return self.keys >> 32, self.keys & 0xffffffff
+
+    def n_nodes(self):
+        return len(self.nodes)
+
+    def n_edges(self):
+        self.flush()
+        return len(self.keys)
+
+    def in_degree(self):
+        """
+        Returns the number of distinct edges into each node id
+        """
+        sources, targets = self.edge_arrays()
+        return np.bincount(targets, minlength=self.n_nodes())
+
+    def out_degree(self):
+        sources, targets = self.edge_arrays()
+        return np.bincount(sources, minlength=self.n_nodes())
+
+    def csr(self):
+        """
+        Returns the adjacency of the graph in compressed sparse row form:
+        the targets (and weights) of the edges from node i are
+        targets[indptr[i]:indptr[i+1]]
+        """
+        sources, targets = self.edge_arrays()
+        indptr = np.zeros(self.n_nodes()+1, dtype=np.int64)
+        np.cumsum(np.bincount(sources, minlength=self.n_nodes()), out=indptr[1:])
+        return indptr, targets, self.weights
+
+    def name_ranks(self):
+        """
+        Returns the rank of each node id's name in sorted order, so that ties
+        can be broken by name with integer sorts
+        """
+        ranks = np.empty(self.n_nodes(), dtype=np.int64)
+        ranks[sorted(range(self.n_nodes()), key=self.nodes.__getitem__)] = np.arange(self.n_nodes())
+        return ranks
+
+    def ranked_edges(self, chunk_size=100000):
+        """
+        Yields (source, target, weight) from the highest weight to the lowest,
+        ties by (source, target) names, high to low
+        """
+        sources, targets = self.edge_arrays()
+        ranks = self.name_ranks()
+        order = np.lexsort((ranks[targets], ranks[sources], self.weights))[::-1]
+        for start in xrange(0, len(order), chunk_size):
+            chunk = order[start:start+chunk_size]
+            for source, target, weight in zip(sources[chunk].tolist(), targets[chunk].tolist(), self.weights[chunk].tolist()):
+                yield self.nodes[source], self.nodes[target], weight
+
+    def ranked_nodes(self, values):
+        """
+        Yields (name, value) for the nodes with a non-zero value (eg. of
+        in_degree()), from the highest value to the lowest, ties by name, high
+        to low
+        """
+        values = np.asarray(values)
+        ranks = self.name_ranks()
+        order = np.lexsort((ranks, values))[::-1]
+        order = order[values[order] != 0]
+        for node_id, value in zip(order.tolist(), values[order].tolist()):
+            yield self.nodes[node_id], value
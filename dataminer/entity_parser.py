@@ -0,0 +1,56 @@
+"""Entity Parser (entity_parser.py)
+Extracts the hashtags, mentions and urls of a tweet's text in a single parse,
+shared by the analyzers that need any of them
+
+Contributors:
+Devin Gaffney & Ryan J. Gallagher
+Network Science Institute, Northeastern University, 2017
+"""
+from collections import namedtuple
+from ttp import ttp
+
+Entities = namedtuple('Entities', ['hashtags', 'mentions', 'urls'])
+
+class EntityParser:
+    """
+    Parses tweet text with a single, reused ttp parser
+
+    Example:
+        import entity_parser
+        entities = entity_parser.parse_entities(u'RT @bob: #Ferguson http://t.co/x')
+        entities.hashtags, entities.mentions, entities.urls
+
+    Attributes
+    ----------
+    parser: ttp.Parser
+        Parser reused for every text. ttp resets its state at the start of
+        each parse, so one instance gives the same results as a new parser per
+        call
+    """
+    def __init__(self):
+        self.parser = ttp.Parser()
+
+    def parse(self, text):
+        """
+        Returns the ttp ParseResult of a text
+        """
+        return self.parser.parse(text)
+
+    def entities(self, text):
+        """
+        Returns the hashtags, mentions and urls of a text together, from one
+        parse
+
+        OUTPUT
+        ------
+        entities, Entities (hashtags, mentions, urls)
+            Lists of strings, as in the tags, users and urls of a ParseResult
+        """
+        result = self.parser.parse(text)
+        return Entities(result.tags, result.users, result.urls)
+
+# Parser shared by the analyzers of a process
+default_parser = EntityParser()
+
+def parse_entities(text):
+    return default_parser.entities(text)
@@ -9,9 +9,15 @@ Devin Gaffney & Ryan J. Gallagher
 Network Science Institute, Northeastern University, 2017
 """
 import os
+import sys
 import csv
 import json
+import subprocess
+from multiprocessing import Pool
 from datetime import datetime
+import multi_matcher
+import hashtag_index
+import corpus_io
 
 class Extractor:
     """
@@ -25,12 +31,15 @@ class Extractor:
     Parameters
     ----------
     hashtag_set: list (iterable?) of strings (hashtag->keyword)
-        Keywords to search for in Gardenhose tweets
+        Keywords to search for in Gardenhose tweets. Hashtags (starting with
+        '#') match whole, case-insensitive hashtags, so that #ff does not
+        match #ffvi; other keywords match anywhere in the tweet
 
     hashtag_operator: string, "AND" or "OR"
         Specifies type of keyword search. "AND" queries search for tweets
         where all keywords appear. "OR" queries search individually for each
-        keyword in tweets
+        keyword in tweets. All the keywords of an "OR" query are searched in the
+        same pass over the archive, each into its own corpus directory
 
     start_time: string, "YYYY-MM-DD" (extend possibility for to the hour?)
         Start date of the search
@@ -51,6 +60,28 @@ class Extractor:
     working_directory: string
         Working directory in which to make folder containing matched tweets
 
+    n_workers: int, defaults to 1
+        Number of daily files extracted at the same time. Each worker runs its
+        own decompression, so on a many-core machine this should be close to
+        the number of cores
+
+    max_retries: int, defaults to 2
+        Number of times a daily file whose extraction failed (non-zero exit
+        status of the decompression pipeline) is tried again
+
+    index_dir: string, defaults to None
+        Directory of a hashtag index built with hashtag_index.py over the same
+        data path. When given, days on which the query hashtags never appear
+        are skipped and only the indexed rows of the other days are matched.
+        Days missing from (or changed since) the index are scanned in full,
+        and an index of the other data_fullness is not used
+
+    compression: string, "lz4", "zstd" or None, defaults to None
+        Compression of the extracted files (eg. tweets.2015-08-01.csv.lz4),
+        which the analyzers read transparently (see corpus_io.py). lz4
+        decompresses faster than a shared filesystem delivers the plain
+        files; zstd makes smaller files
+
     Attributes
     ----------
     full_data_path: string
@@ -67,10 +98,18 @@ class Extractor:
 
     end_datetime: datetime
         Datetime object of end date string
+
+    extracted_files: dict (corpus path -> dict (file -> row count))
+        Number of matched rows written for each successfully extracted file,
+        per corpus directory
+
+    failed_files: list
+        Files that still failed after max_retries retries
     """
     def __init__(self,hashtag_set, hashtag_operator='OR', start_time='2011-07-01',
                  end_time='2016-12-01', data_fullness='reduced',
-                 corpus_dir='hashtag_extractions', working_directory=None):
+                 corpus_dir='hashtag_extractions', working_directory=None,
+                 n_workers=1, max_retries=2, index_dir=None, compression=None):
         # TODO: more integrity checks of passed paramters (all wrapped in funcs)
         # Initialize parameters of search
         self.hashtag_set = hashtag_set
@@ -78,23 +117,35 @@ class Extractor:
         self.end_time = end_time
         self.data_fullness = data_fullness
         self.hashtag_operator = hashtag_operator
+        self.corpus_dir = corpus_dir
+        self.n_workers = n_workers
+        self.max_retries = max_retries
+        self.index_dir = index_dir
+        self.compression = compression
+        self.extracted_files = {}
+        self.failed_files = []
         self.current_user = os.popen('whoami').read().split('\n')[0]
         self.full_data_path = '/net/twitter/gardenhose-data/json'
         self.reduced_data_path = '/net/twitter/gardenhose-data/summarized'
         if working_directory is None:
-            self.working_directory="/home/"+self.current_user()
+            self.working_directory="/home/"+self.current_user
+        else:
+            self.working_directory = working_directory
         # Validate start and end date
         # TODO: wrap in function
         try:
             self.start_datetime = datetime.strptime(start_time, '%Y-%m-%d')
             self.end_datetime = datetime.strptime(end_time, '%Y-%m-%d')
         except ValueError:
-            date_string = 'Start date = {}, End date = {}'.format(start_date, end_date)
+            date_string = 'Start date = {}, End date = {}'.format(start_time, end_time)
             print('Invalid time range, cannot parse time:\n' + date_string)
             sys.exit()
-        if (end_time-start_time).days < 0:
-            date_string = 'Start date = {}, End date = {}'.format(start_date, end_date)
-            print('Invalid time range, end date before start date:\n' + date_string))
+        if (self.end_datetime-self.start_datetime).days < 0:
+            date_string = 'Start date = {}, End date = {}'.format(start_time, end_time)
+            print('Invalid time range, end date before start date:\n' + date_string)
+            sys.exit()
+        if compression is not None and compression not in corpus_io.compressions:
+            print('Compression must be None or one of: ' + ', '.join(sorted(corpus_io.compressions)))
             sys.exit()
 
         # Extract tweets based on hashtag operator
@@ -102,9 +153,8 @@ class Extractor:
             print "Extracting "+str.join(",", hashtag_set)
             self.extract(hashtag_set)
         elif hashtag_operator == "OR":
-            for hashtag in hashtag_set:
-                print "Extracting "+hashtag
-            self.extract([hashtag])
+            print "Extracting "+str.join(", ", hashtag_set)
+            self.extract_queries([[hashtag] for hashtag in hashtag_set])
         else:
             print('Hashtag operator must be "AND" or "OR"')
             sys.exit()
@@ -121,43 +171,229 @@ class Extractor:
             search) or an array of several hashtags (in the case we are doing an
             "AND" search)
         """
+        self.extract_queries([search_hashtags])
+
+    def extract_queries(self, queries):
+        """
+        Extracts several queries in one pass over the archive: each daily file
+        is decompressed once and every line is matched against all the
+        queries' hashtags at once, then written to the corpus directory of each
+        query whose hashtags it contains
+
+        INPUT
+        -----
+        queries: list of lists
+            Each query is a list of hashtags that must all appear in a tweet,
+            as search_hashtags in extract()
+        """
         # Get the relevant files depending on data fullness
-        if data_fullness == 'reduced':
+        if self.data_fullness == 'reduced':
             files = self.restricted_to_timeline(self.ls(self.reduced_data_path))
         else:
             files = self.restricted_to_timeline(self.ls(self.full_data_path))
         # Make directory to place tweets
         #TODO: also write a flat file at this point specifying what is being requested/when/who requested it
-        full_corpus_path = self.full_corpus_dir(search_hashtags)
-        os.mkdirs(full_corpus_path)
-        # Search tweets in each file for matches
-        for file in files:
-            self.extract_file(file, search_hashtags, full_corpus_path)
+        full_corpus_paths = []
+        for search_hashtags in queries:
+            full_corpus_path = self.full_corpus_dir(search_hashtags)
+            if not os.path.isdir(full_corpus_path):
+                os.makedirs(full_corpus_path)
+            full_corpus_paths.append(full_corpus_path)
+            self.extracted_files[full_corpus_path] = {}
+        # Use the index to skip days without the hashtags and to only match
+        # the rows that have them
+        candidates = self.indexed_candidates(files, queries)
+        skipped = [file for file in files if candidates.get(file) == []]
+        if skipped:
+            print "Skipping "+str(len(skipped))+" of "+str(len(files))+" files without matches in the index"
+        # Search tweets in each file for matches, retrying the failed ones
+        self.query_matcher(queries)
+        jobs = [(self, file, queries, full_corpus_paths, candidates.get(file)) for file in files if file not in skipped]
+        for attempt in range(self.max_retries+1):
+            if attempt > 0:
+                print "Retrying "+str(len(jobs))+" failed files (attempt "+str(attempt+1)+")"
+            failed = []
+            for (file, status, rows) in self.run_jobs(jobs):
+                if status == 0:
+                    for full_corpus_path, query_rows in zip(full_corpus_paths, rows):
+                        self.extracted_files[full_corpus_path][file] = query_rows
+                else:
+                    print "\t"+file+" failed with exit status "+str(status)
+                    failed.append((self, file, queries, full_corpus_paths, candidates.get(file)))
+            jobs = failed
+            if not jobs:
+                break
+        self.failed_files.extend([job[1] for job in jobs])
+        for full_corpus_path in full_corpus_paths:
+            file_rows = self.extracted_files[full_corpus_path]
+            print str(sum(file_rows.values()))+" rows extracted into "+full_corpus_path+" from "+str(len(file_rows))+" files"
+        print str(len(jobs))+" files failed"
 
-    def extract_file(self, file, search_hashtags, full_corpus_path):
+    def run_jobs(self, jobs):
+        """
+        Runs extract_file() for each job, in a pool of n_workers processes if
+        n_workers > 1. Yields (file, exit status, row count) as files finish
         """
-        Searches a single file for matches to the given hashtags
+        if self.n_workers > 1 and len(jobs) > 1:
+            pool = Pool(processes=min(self.n_workers, len(jobs)))
+            try:
+                for result in pool.imap_unordered(extract_job, jobs):
+                    yield result
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            for job in jobs:
+                yield extract_job(job)
+
+    def extract_file(self, file, queries, full_corpus_paths, candidate_lines=None):
+        """
+        Searches a single file for matches to the given queries
 
         INPUT
         -----
         file, string
             File to search through for matches to hashtags
-        search_hashtags, list
-            As in extract()
-        full_corpus_path, string
-            Full file path to the directory where matched tweet files are placed
+        queries, list of lists
+            As in extract_queries()
+        full_corpus_paths, list of strings
+            Full file path to the directory where matched tweet files are
+            placed, for each query
+        candidate_lines, sorted list of ints, defaults to None
+            Line numbers of the decompressed file that can match according to
+            the index. All lines are matched if None
+
+        OUTPUT
+        ------
+        status, int
+            Exit status of the decompression (0 on success, -1 if compressing
+            the output failed)
+        rows, list of ints
+            Number of matched rows written, for each query
         """
-        #TODO: awk does not capture totally unique hashtags but instead captures substrings of hashtags - eg. searching for #ff will also extract #ffvi #ffix and etc
         print "\t"+file
         if self.data_fullness == 'reduced':
-            os.popen("lz4 -dc "+self.reduced_data_path+"/"+file+" | awk '/"+str.join("/ && /", search_hashtags)+"/' > "+full_corpus_path+str.replace(file, ".lz4", ".csv"))
+            command = ["lz4", "-dc", self.reduced_data_path+"/"+file]
+            output_name = str.replace(file, ".lz4", ".csv")
         elif self.data_fullness == 'full':
-            os.popen("xzcat "+self.full_data_path+"/"+file+" | awk '/"+str.join("/ && /", search_hashtags)+"/' > "+full_corpus_path+str.replace(file, ".xz", ".json"))
+            command = ["xzcat", self.full_data_path+"/"+file]
+            output_name = str.replace(file, ".xz", ".json")
+        matcher = self.query_matcher(queries)
+        output_files = [corpus_io.compressed_name(full_corpus_path+"/"+output_name, self.compression)
+                        for full_corpus_path in full_corpus_paths]
+        # A day extracted earlier with another compression would be read twice
+        for full_corpus_path in full_corpus_paths:
+            for compression in [None]+sorted(corpus_io.compressions):
+                other_file = corpus_io.compressed_name(full_corpus_path+"/"+output_name, compression)
+                if compression != self.compression and os.path.exists(other_file):
+                    os.remove(other_file)
+        outputs = [corpus_io.open_output(full_corpus_path+"/"+output_name, self.compression)
+                   for full_corpus_path in full_corpus_paths]
+        rows = [0]*len(queries)
+        if candidate_lines is not None:
+            candidates = set(candidate_lines)
+            last_candidate = candidate_lines[-1]
+        stopped_early = False
+        finished = False
+        process = subprocess.Popen(command, stdout=subprocess.PIPE, bufsize=-1)
+        try:
+            for line_number, line in enumerate(process.stdout):
+                if candidate_lines is not None:
+                    if line_number > last_candidate:
+                        stopped_early = True
+                        break
+                    if line_number not in candidates:
+                        continue
+                for k in matcher.match(line):
+                    outputs[k].write(line)
+                    rows[k] += 1
+            finished = True
+        finally:
+            if stopped_early:
+                # No more candidates, the rest of the file is not needed
+                process.kill()
+            process.stdout.close()
+            status = process.wait()
+            if stopped_early:
+                status = 0
+            for output in outputs:
+                try:
+                    output.close()
+                except IOError, e:
+                    # The compressor failed, the file is incomplete
+                    print "\t"+file+": "+str(e)
+                    if status == 0:
+                        status = -1
+            if status != 0 or not finished:
+                # Don't leave a truncated day in the corpus
+                for output_file in output_files:
+                    if os.path.exists(output_file):
+                        os.remove(output_file)
+        return status, rows
 
 
     # --------------------------------------------------------------------------
     # ---------------------------- Helper functions ----------------------------
     # --------------------------------------------------------------------------
+    def query_matcher(self, queries):
+        """
+        Builds (once) the matcher of the hashtags of all queries
+
+        OUTPUT
+        ------
+        matcher, multi_matcher.QueryMatcher
+        """
+        if getattr(self, 'matcher_queries', None) != queries:
+            self.matcher = multi_matcher.QueryMatcher(queries, self.data_fullness)
+            self.matcher_queries = queries
+        return self.matcher
+
+    def indexed_candidates(self, files, queries):
+        """
+        Looks up the query hashtags in the index (if there is one and every
+        query has a hashtag)
+
+        OUTPUT
+        ------
+        candidates, dict (file -> sorted list of ints)
+            Line numbers that contain all the hashtags of at least one query,
+            for each indexed file. Files that are not in the dict have to be
+            scanned in full
+        """
+        candidates = {}
+        if self.index_dir is None:
+            return candidates
+        query_hashtags = [[multi_matcher.normalize_hashtag(term) for term in search_hashtags if term.startswith('#')]
+                          for search_hashtags in queries]
+        if not all(query_hashtags):
+            print "Not using the index, every query needs at least one hashtag"
+            return candidates
+        if self.data_fullness == 'reduced':
+            index = hashtag_index.HashtagIndex(self.index_dir, self.reduced_data_path, self.data_fullness)
+        else:
+            index = hashtag_index.HashtagIndex(self.index_dir, self.full_data_path, self.data_fullness)
+        if index.index_fullness != self.data_fullness:
+            print "Not using the index, it was built from "+str(index.index_fullness)+" data, not "+self.data_fullness
+            return candidates
+        hashtag2days = index.days(set([hashtag for hashtags in query_hashtags for hashtag in hashtags]))
+        for file in files:
+            if not index.is_indexed(file):
+                continue
+            day_queries = [hashtags for hashtags in query_hashtags
+                           if all([file in hashtag2days[hashtag] for hashtag in hashtags])]
+            if not day_queries:
+                candidates[file] = []
+                continue
+            hashtag2lines = index.lines(file, set([hashtag for hashtags in day_queries for hashtag in hashtags]))
+            lines = set()
+            for hashtags in day_queries:
+                query_lines = set(hashtag2lines[hashtags[0]])
+                for hashtag in hashtags[1:]:
+                    query_lines &= set(hashtag2lines[hashtag])
+                lines |= query_lines
+            candidates[file] = sorted(lines)
+        return candidates
+
     def full_corpus_dir(self, search_hashtags):
         """
         Makes the directory for files of matched tweets
@@ -172,7 +408,7 @@ class Extractor:
         # Construct name of directory where to place tweets
         corpus_name = hashtag_str+'-'+self.start_time+'-'+self.end_time+'-'+self.data_fullness
         # Construct the path to the directory where tweets will be placed
-        full_corpus_path = working_directory+'/'+self.corpus_dir'/'+corpus_name
+        full_corpus_path = self.working_directory+'/'+self.corpus_dir+'/'+corpus_name
         # Make the directory
         return full_corpus_path
 
@@ -190,8 +426,8 @@ class Extractor:
         for file in files:
             if ".lz4" in file or ".xz" in file:
                 file_time = datetime.strptime(file.split(".")[-2], '%Y-%m-%d')
-            if self.start_datetime <= file_time and file_time <= self.end_datetime:
-                ranged_files.append(file)
+                if self.start_datetime <= file_time and file_time <= self.end_datetime:
+                    ranged_files.append(file)
         return ranged_files
 
     def ls(self, path):
@@ -199,3 +435,22 @@ class Extractor:
         Returns a sorted list of files in a directory
         """
         return sorted(os.listdir(path))
+
+def extract_job(job):
+    """
+    Runs Extractor.extract_file() for a (extractor, file, queries,
+    full_corpus_paths, candidate_lines) job. Module level so that it can be
+    sent to pool workers
+
+    OUTPUT
+    ------
+    (file, status, rows), tuple
+        File name, exit status and row count as returned by extract_file()
+    """
+    extractor, file, queries, full_corpus_paths, candidate_lines = job
+    try:
+        status, rows = extractor.extract_file(file, queries, full_corpus_paths, candidate_lines)
+    except (IOError, OSError), e:
+        print "\t"+file+": "+str(e)
+        status, rows = -1, [0]*len(queries)
+    return file, status, rows
@@ -1,23 +1,53 @@
+import analysis_engine
+import batch_runner
 import network_analyzer
 import term_counter
 import time_analyzer
+import tweet_cache
 filename = "#AltonSterling_2015-08-09_2017-08-09_reduced"
 def run(filename):
-    tc = term_counter.TermCounter("/home/dgaffney/hashtag_extractions/"+filename, "/home/dgaffney/hashtag_results/"+filename)
-    tc.get_ranked_terms()
-    tc.tweets_matching_tokens()
-    tc.tweets_matching_tokens(20, ["mentions"], True)
+    # Tokens and entities of repeated (retweeted) texts are shared by all
+    # the analyses
+    cache = tweet_cache.TweetCache()
+    tc = term_counter.TermCounter("/home/dgaffney/hashtag_extractions/"+filename, "/home/dgaffney/hashtag_results/"+filename, cache)
+    na = network_analyzer.NetworkAnalyzer("/home/dgaffney/hashtag_extractions/"+filename, "/home/dgaffney/hashtag_results/"+filename, cache)
+    ta = time_analyzer.TimeAnalyzer("/home/dgaffney/hashtag_extractions/"+filename, "/home/dgaffney/hashtag_results/"+filename)
+    # Term counts, edge list and timeline share one read of the corpus, the
+    # top term tweets (which need the term counts) share a second one
+    engine = analysis_engine.AnalysisEngine("/home/dgaffney/hashtag_extractions/"+filename)
+    terms = engine.register(analysis_engine.TermConsumer(tc))
+    engine.register(analysis_engine.TopTermTweetConsumer(tc, after=[terms]))
+    engine.register(analysis_engine.TopTermTweetConsumer(tc, 20, ["mentions"], True, after=[terms]))
+    engine.register(analysis_engine.EdgeConsumer(na))
+    engine.register(analysis_engine.TimelineConsumer(ta))
+    engine.run()
+    print cache.summary()
     tc.get_counts()
+    na.get_ranked_in_degree()
+    na.get_ranked_centrality()
+
+def run_incremental(filename):
+    # Only the tweet files added or changed since the last run are read, the
+    # others come from the checkpoints in the output directories
+    tc = term_counter.TermCounter("/home/dgaffney/hashtag_extractions/"+filename, "/home/dgaffney/hashtag_results/"+filename)
     na = network_analyzer.NetworkAnalyzer("/home/dgaffney/hashtag_extractions/"+filename, "/home/dgaffney/hashtag_results/"+filename)
-    na.get_edge_list()
-    na.graph_from_edge_list()
+    ta = time_analyzer.TimeAnalyzer("/home/dgaffney/hashtag_extractions/"+filename, "/home/dgaffney/hashtag_results/"+filename)
+    tc.get_ranked_terms(incremental=True)
+    na.get_edge_list(incremental=True)
+    ta.write_timelines(incremental=True)
     na.get_ranked_in_degree()
 
+def run_batch(n_workers=16):
+    # All the corpora on one pool, largest first, with one summary table
+    runner = batch_runner.BatchRunner(["/home/dgaffney/hashtag_extractions/#*_reduced"], "/home/dgaffney/hashtag_results", n_workers)
+    runner.run()
+
 def run_short(filename):
     tc = term_counter.TermCounter("/home/dgaffney/hashtag_extractions/"+filename, "/home/dgaffney/hashtag_results/"+filename)
     print tc.get_counts()
     na = network_analyzer.NetworkAnalyzer("/home/dgaffney/hashtag_extractions/"+filename, "/home/dgaffney/hashtag_results/"+filename)
-    print na.basic_stats()
+    # Diameter bounds are tightened for at most a minute per corpus
+    print na.basic_stats(time_budget=60)
 
 
 filename = "#AllMenCan_2014-02-01_2016-02-01_reduced"
@@ -0,0 +1,194 @@
+"""Graph Stats (graph_stats.py)
+Statistics of large undirected graphs given as integer edge arrays, without
+building a networkx graph: connected components with a vectorized union-find,
+breadth first search over CSR adjacency, and lower/upper bounds of the
+diameter (double sweep, then iFUB) with an optional time budget
+
+Contributors:
+Devin Gaffney & Ryan J. Gallagher
+Network Science Institute, Northeastern University, 2017
+"""
+import time
+import numpy as np
+
+def undirected_edges(sources, targets):
+    """
+    Returns the distinct undirected edges of directed edge arrays, as arrays
+    (u, v) with u <= v. Self-loops are kept, as in networkx
+    """
+    sources = np.asarray(sources, dtype=np.int64)
+    targets = np.asarray(targets, dtype=np.int64)
+    u = np.minimum(sources, targets)
+    v = np.maximum(sources, targets)
+    keys = np.unique((u << 32) | v)
+    return keys >> 32, keys & 0xffffffff
+
+def connected_components(n_nodes, u, v):
+    """
+    Union-find over all edges at once: every edge hooks the root of its larger
+    endpoint onto the root of the smaller one, then paths are compressed by
+    pointer jumping, until no edge joins two roots
+
+    OUTPUT
+    ------
+    labels, np.ndarray (int64)
+        Component of each node, labeled by its smallest node id
+    """
+    parent = np.arange(n_nodes, dtype=np.int64)
+    while True:
+        root_u = parent[u]
+        root_v = parent[v]
+        low = np.minimum(root_u, root_v)
+        high = np.maximum(root_u, root_v)
+        joins = low != high
+        if not joins.any():
+            return parent
+        np.minimum.at(parent, high[joins], low[joins])
+        while True:
+            grandparent = parent[parent]
+            if (grandparent == parent).all():
+                break
+            parent = grandparent
+
+def undirected_csr(n_nodes, u, v):
+    """
+    Returns the (indptr, neighbors) adjacency of undirected edges, without
+    self-loops
+    """
+    loops = u == v
+    ends = np.concatenate([u[~loops], v[~loops]])
+    starts = np.concatenate([v[~loops], u[~loops]])
+    order = np.argsort(ends, kind='mergesort')
+    indptr = np.zeros(n_nodes+1, dtype=np.int64)
+    np.cumsum(np.bincount(ends, minlength=n_nodes), out=indptr[1:])
+    return indptr, starts[order]
+
+def bfs(indptr, neighbors, source):
+    """
+    Returns the distance of every node from source (-1 if unreachable),
+    expanding a whole frontier at a time
+    """
+    distances = np.empty(len(indptr)-1, dtype=np.int64)
+    distances.fill(-1)
+    distances[source] = 0
+    frontier = np.array([source], dtype=np.int64)
+    level = 0
+    while len(frontier):
+        level += 1
+        starts = indptr[frontier]
+        lengths = indptr[frontier+1]-starts
+        total = lengths.sum()
+        if total == 0:
+            break
+        # Positions of all neighbors of the frontier in neighbors
+        offsets = np.repeat(starts-np.cumsum(lengths)+lengths, lengths)+np.arange(total)
+        reached = neighbors[offsets]
+        reached = np.unique(reached[distances[reached] == -1])
+        distances[reached] = level
+        frontier = reached
+    return distances
+
+def diameter_bounds(indptr, neighbors, nodes, time_budget=None):
+    """
+    Lower and upper bounds of the diameter of a connected component. A double
+    sweep from the highest degree node gives a lower bound and a central
+    node; iFUB then computes the eccentricities of the nodes farthest from
+    that node, level by level, until the bounds meet or the time budget runs
+    out
+
+    INPUT
+    -----
+    nodes: np.ndarray
+        Node ids of the component
+    time_budget: float, defaults to None
+        Seconds after which the current bounds are returned (no limit if None)
+
+    OUTPUT
+    ------
+    lower, upper: ints
+        Equal when the diameter is exact
+    """
+    if len(nodes) <= 1:
+        return 0, 0
+    started = time.time()
+    degrees = indptr[nodes+1]-indptr[nodes]
+    # Double sweep
+    start = nodes[np.argmax(degrees)]
+    distances = bfs(indptr, neighbors, start)
+    upper = 2*int(distances.max())
+    far = np.argmax(distances)
+    distances = bfs(indptr, neighbors, far)
+    lower = int(distances.max())
+    upper = min(upper, 2*lower)
+    # Middle of the path between the ends of the second sweep
+    other_end = np.argmax(distances)
+    from_other_end = bfs(indptr, neighbors, other_end)
+    middle = np.where((distances == lower//2) & (from_other_end == lower-lower//2))[0]
+    center = middle[0] if len(middle) else start
+    # iFUB from the center
+    levels = bfs(indptr, neighbors, center)
+    eccentricity = int(levels.max())
+    upper = min(upper, 2*eccentricity)
+    level = eccentricity
+    while upper > lower and level > 0:
+        if time_budget is not None and time.time()-started > time_budget:
+            break
+        for node in np.where(levels == level)[0]:
+            lower = max(lower, bfs_eccentricity(indptr, neighbors, node))
+            if time_budget is not None and time.time()-started > time_budget:
+                break
+        else:
+            # Nodes at lower levels have eccentricity <= 2*(level-1)
+            upper = min(upper, max(lower, 2*(level-1)))
+            level -= 1
+            continue
+        break
+    return lower, max(lower, upper)
+
+def bfs_eccentricity(indptr, neighbors, source):
+    return int(bfs(indptr, neighbors, source).max())
+
+def compact_nodes(sources, targets):
+    """
+    Relabels the node ids of edge arrays to [0, n_nodes), dropping the nodes
+    without edges (eg. users who left a sliding window)
+
+    OUTPUT
+    ------
+    nodes, np.ndarray
+        Original id of each new id
+    sources, targets: np.ndarray
+        Edges with the new ids
+    """
+    nodes, inverse = np.unique(np.concatenate([sources, targets]), return_inverse=True)
+    return nodes, inverse[:len(sources)], inverse[len(sources):]
+
+def graph_stats(n_nodes, sources, targets, time_budget=None):
+    """
+    Returns the basic statistics of the undirected graph of directed edge
+    arrays (node ids in [0, n_nodes))
+
+    OUTPUT
+    ------
+    stats, dict
+        node_count, edge_count (undirected), component_count, lcc_node_count,
+        lcc_edge_count, lcc_diameter_lower and lcc_diameter_upper (bounds of
+        the diameter of the largest connected component)
+    """
+    if n_nodes == 0:
+        return {'node_count': 0, 'edge_count': 0, 'component_count': 0, 'lcc_node_count': 0,
+                'lcc_edge_count': 0, 'lcc_diameter_lower': 0, 'lcc_diameter_upper': 0}
+    u, v = undirected_edges(sources, targets)
+    labels = connected_components(n_nodes, u, v)
+    sizes = np.bincount(labels, minlength=n_nodes)
+    lcc_label = int(np.argmax(sizes))
+    lcc_nodes = np.where(labels == lcc_label)[0]
+    indptr, neighbors = undirected_csr(n_nodes, u, v)
+    lower, upper = diameter_bounds(indptr, neighbors, lcc_nodes, time_budget)
+    return {'node_count': n_nodes,
+            'edge_count': len(u),
+            'component_count': int((sizes > 0).sum()),
+            'lcc_node_count': len(lcc_nodes),
+            'lcc_edge_count': int((labels[u] == lcc_label).sum()),
+            'lcc_diameter_lower': lower,
+            'lcc_diameter_upper': upper}
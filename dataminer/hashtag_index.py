@@ -0,0 +1,516 @@
+"""Hashtag Index (hashtag_index.py)
+Builds and reads a persistent inverted index of the hashtags in the Gardenhose
+archive, so that extractions can skip the days on which a hashtag never
+appears and only look at the matching rows of the other days
+
+    python hashtag_index.py /net/twitter/gardenhose-data/summarized /home/dgaffney/hashtag_index reduced 16
+
+Layout of the index directory:
+    days.tsv            format of the archive ("data_fullness<TAB>reduced" or
+                        full), then one line per indexed daily file: file,
+                        size, mtime
+    days/<file>.idx     postings of that day: for each hashtag, the (0-based)
+                        line numbers of the decompressed file it appears on
+    hashtags/<xx>.idx   for each hashtag, the indices (in days.tsv) of the days
+                        it appears on, sharded on the first byte of the md5 of
+                        the hashtag. New or changed days are merged into the
+                        shards of their hashtags, the other shards are left as
+                        they are
+Postings are sorted, delta-encoded and written as varints, each record being
+varint(len(hashtag)) hashtag varint(count) varint(len(postings)) postings
+
+Contributors:
+Devin Gaffney & Ryan J. Gallagher
+Network Science Institute, Northeastern University, 2017
+"""
+import os
+import sys
+import hashlib
+import subprocess
+from array import array
+from multiprocessing import Pool
+from collections import defaultdict
+import multi_matcher
+
+# (hashtag, day) postings of new days held in memory before they are spilled
+# to the pending files of their shards
+MERGE_SIZE = 2000000
+
+class HashtagIndex:
+    """
+    Inverted index of hashtags -> days -> line numbers over the daily files of
+    the archive
+
+    Example:
+        import hashtag_index
+        index = hashtag_index.HashtagIndex('/home/dgaffney/hashtag_index',
+                                           '/net/twitter/gardenhose-data/summarized')
+        index.build(n_workers=16)
+        index.days(['#ferguson'])
+
+    Parameters
+    ----------
+    index_dir: string
+        Directory holding the index files
+
+    data_path: string, defaults to None
+        Directory of the daily archive files. Only needed to build the index
+
+    data_fullness: string, "reduced" or "full"
+        Format of the archive files, as in Extractor. Hashtags are tokenized as
+        multi_matcher.QueryMatcher does, so that index hits and extraction
+        matches agree
+
+    Attributes
+    ----------
+    index_fullness: string
+        Format of the archive the index was built from (None if there is no
+        index, or if it predates days.tsv recording it). An index is only
+        used for extractions of the same format
+    day_files: list of strings
+        Indexed daily files, in the order of their indices in days.tsv
+
+    day_stats: dict (file -> (size, mtime))
+        Size and modification time of each file when it was indexed
+    """
+    def __init__(self, index_dir, data_path=None, data_fullness='reduced'):
+        self.index_dir = index_dir
+        self.data_path = data_path
+        self.data_fullness = data_fullness
+        self.index_fullness = None
+        self.day_files = []
+        self.day_stats = {}
+        if os.path.exists(self.index_dir+'/days.tsv'):
+            with open(self.index_dir+'/days.tsv', 'rb') as f:
+                for line in f:
+                    fields = line.rstrip('\n').split('\t')
+                    if fields[0] == 'data_fullness':
+                        self.index_fullness = fields[1]
+                        continue
+                    file, size, mtime = fields
+                    self.day_files.append(file)
+                    self.day_stats[file] = (int(size), int(mtime))
+
+    def build(self, files=None, n_workers=1, rebuild=False):
+        """
+        Indexes the daily files that are new or changed since they were last
+        indexed, and merges their hashtags into the hashtag -> days map
+
+        INPUT
+        -----
+        files: list of strings, defaults to None
+            Daily files to index, all the archive files in data_path if None
+        n_workers: int
+            Number of files indexed at the same time
+        rebuild: boolean, defaults to False
+            If True, every file is indexed again and the files of days and
+            shards that are not rewritten are removed. Indexes of another
+            format (or of an unknown one) are always rebuilt
+        """
+        if files is None:
+            files = sorted([file for file in os.listdir(self.data_path) if ".lz4" in file or ".xz" in file])
+        for directory in [self.index_dir+'/days', self.index_dir+'/hashtags']:
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+        if self.day_files and self.index_fullness != self.data_fullness:
+            print "Rebuilding the index, it was built from "+str(self.index_fullness)+" data"
+            rebuild = True
+        if rebuild:
+            # The index is empty until it is rebuilt, rather than pointing to
+            # days of the old one
+            if os.path.exists(self.index_dir+'/days.tsv'):
+                os.remove(self.index_dir+'/days.tsv')
+            self.day_files = []
+            self.day_stats = {}
+        self.index_fullness = self.data_fullness
+        stats = {}
+        for file in files:
+            stat = os.stat(self.data_path+'/'+file)
+            stats[file] = (stat.st_size, int(stat.st_mtime))
+        jobs = [(self, file) for file in files if self.day_stats.get(file) != stats[file]]
+        # Hashtags of the changed days, whose old days are taken out of the map
+        old_keys = dict([(file, read_keys(self.day_index_file(file), decode=False))
+                         for index, file in jobs if file in self.day_stats])
+        print "Indexing "+str(len(jobs))+" of "+str(len(files))+" files"
+        if n_workers > 1 and len(jobs) > 1:
+            pool = Pool(processes=min(n_workers, len(jobs)))
+            results = pool.imap_unordered(index_job, jobs)
+        else:
+            pool = None
+            results = (index_job(job) for job in jobs)
+        indexed = set()
+        for (file, status) in results:
+            if status == 0:
+                indexed.add(file)
+            else:
+                print "\t"+file+" failed with exit status "+str(status)
+        if pool is not None:
+            pool.close()
+            pool.join()
+        # New days are numbered in the order of files, whichever finished first
+        for file in files:
+            if file in indexed:
+                if file not in self.day_stats:
+                    self.day_files.append(file)
+                self.day_stats[file] = stats[file]
+        # days.tsv is written last: until then, the new days in the shards are
+        # out of its range and the changed ones are not taken as indexed
+        self.merge_hashtag_days([file for file in self.day_files if file in indexed],
+                                dict([(file, keys) for file, keys in old_keys.items() if file in indexed]),
+                                rebuild)
+        self.write_days()
+        if rebuild:
+            day_index_files = set([os.path.basename(self.day_index_file(file)) for file in self.day_files])
+            for filename in os.listdir(self.index_dir+'/days'):
+                if filename not in day_index_files:
+                    os.remove(self.index_dir+'/days/'+filename)
+
+    def index_file(self, file):
+        """
+        Decompresses one daily file and writes the postings of its hashtags
+
+        OUTPUT
+        ------
+        status, int
+            Exit status of the decompression (0 on success)
+        """
+        print "\t"+file
+        if self.data_fullness == 'reduced':
+            command = ["lz4", "-dc", self.data_path+"/"+file]
+        else:
+            command = ["xzcat", self.data_path+"/"+file]
+        hashtag_lines = defaultdict(list)
+        process = subprocess.Popen(command, stdout=subprocess.PIPE, bufsize=-1)
+        try:
+            for line_number, line in enumerate(process.stdout):
+                if '#' not in line:
+                    continue
+                for hashtag in multi_matcher.line_hashtags(line, self.data_fullness):
+                    hashtag_lines[hashtag].append(line_number)
+        finally:
+            process.stdout.close()
+            status = process.wait()
+        if status == 0:
+            write_postings(self.day_index_file(file), hashtag_lines)
+        return status
+
+    def days(self, hashtags):
+        """
+        Returns the indexed daily files each hashtag appears on
+
+        OUTPUT
+        ------
+        hashtag2days, dict (normalized hashtag -> set of files)
+        """
+        hashtags = [multi_matcher.normalize_hashtag(hashtag) for hashtag in hashtags]
+        shards = defaultdict(list)
+        for hashtag in hashtags:
+            shards[self.hashtag_shard(hashtag)].append(hashtag)
+        hashtag2days = dict([(hashtag, set()) for hashtag in hashtags])
+        for shard, shard_hashtags in shards.items():
+            for hashtag, day_indices in read_postings(self.shard_file(shard), shard_hashtags).items():
+                hashtag2days[hashtag] = set([self.day_files[k] for k in day_indices if k < len(self.day_files)])
+        return hashtag2days
+
+    def lines(self, file, hashtags):
+        """
+        Returns the line numbers of a daily file each hashtag appears on
+
+        OUTPUT
+        ------
+        hashtag2lines, dict (normalized hashtag -> list of line numbers)
+        """
+        hashtags = [multi_matcher.normalize_hashtag(hashtag) for hashtag in hashtags]
+        hashtag2lines = dict([(hashtag, []) for hashtag in hashtags])
+        hashtag2lines.update(read_postings(self.day_index_file(file), hashtags))
+        return hashtag2lines
+
+    def is_indexed(self, file):
+        """
+        True if the file was indexed, and has not changed since (when
+        data_path is given)
+        """
+        if file not in self.day_stats:
+            return False
+        if self.data_path is None:
+            return True
+        stat = os.stat(self.data_path+'/'+file)
+        return self.day_stats[file] == (stat.st_size, int(stat.st_mtime))
+
+    # --------------------------------------------------------------------------
+    # ---------------------------- Helper functions ----------------------------
+    # --------------------------------------------------------------------------
+    def day_index_file(self, file):
+        return self.index_dir+'/days/'+file+'.idx'
+
+    def shard_file(self, shard):
+        return self.index_dir+'/hashtags/'+shard+'.idx'
+
+    def hashtag_shard(self, hashtag):
+        if isinstance(hashtag, unicode):
+            hashtag = hashtag.encode('utf-8')
+        return hashlib.md5(hashtag).hexdigest()[:2]
+
+    def write_days(self):
+        with open(self.index_dir+'/days.tsv.tmp', 'wb') as f:
+            f.write('data_fullness\t'+self.data_fullness+'\n')
+            for file in self.day_files:
+                size, mtime = self.day_stats[file]
+                f.write(file+'\t'+str(size)+'\t'+str(mtime)+'\n')
+        os.rename(self.index_dir+'/days.tsv.tmp', self.index_dir+'/days.tsv')
+
+    def merge_hashtag_days(self, files, old_keys={}, rebuild=False):
+        """
+        Merges indexed days into the hashtag -> days map. Only the shards of
+        their hashtags (old and new) are rewritten; postings of more than
+        MERGE_SIZE (hashtag, day) pairs are spilled to a pending file per
+        shard in the meantime
+
+        INPUT
+        -----
+        files: list of strings
+            Newly indexed days
+        old_keys: dict (file -> list of strings), defaults to {}
+            Hashtags (UTF-8) the days of files that were indexed before had
+            then, which the day is taken out of
+        rebuild: boolean, defaults to False
+            If True, the shards are written from files alone, and the shard
+            files that are not rewritten are removed
+        """
+        # Pending postings of an interrupted merge are indexed again
+        for filename in os.listdir(self.index_dir+'/hashtags'):
+            if filename.endswith('.pending'):
+                os.remove(self.index_dir+'/hashtags/'+filename)
+        day_indices = dict([(file, k) for k, file in enumerate(self.day_files)])
+        removed = defaultdict(lambda: defaultdict(set))
+        for file, keys in old_keys.items():
+            for key in keys:
+                removed[self.hashtag_shard(key)][key].add(day_indices[file])
+        added = defaultdict(lambda: defaultdict(lambda: array('l')))
+        spilled = set()
+        n_pending = 0
+        for file in sorted(files, key=day_indices.get):
+            for key in read_keys(self.day_index_file(file), decode=False):
+                added[self.hashtag_shard(key)][key].append(day_indices[file])
+                n_pending += 1
+            if n_pending >= MERGE_SIZE:
+                spilled |= self.spill_pending(added)
+                added.clear()
+                n_pending = 0
+        shards = set(added.keys()) | set(removed.keys()) | spilled
+        for shard in sorted(shards):
+            updates = added.pop(shard, {})
+            if shard in spilled:
+                updates = read_pending(self.shard_file(shard)+'.pending', updates)
+            merge_shard(self.shard_file(shard), updates, removed.get(shard, {}), rebuild)
+        if rebuild:
+            shard_files = set([os.path.basename(self.shard_file(shard)) for shard in shards])
+            for filename in os.listdir(self.index_dir+'/hashtags'):
+                if filename not in shard_files:
+                    os.remove(self.index_dir+'/hashtags/'+filename)
+
+    def spill_pending(self, added):
+        """
+        Appends the postings of each shard in added to its pending file
+
+        OUTPUT
+        ------
+        shards, set of strings
+            Shards written to
+        """
+        for shard, key2numbers in added.items():
+            with open(self.shard_file(shard)+'.pending', 'ab') as f:
+                out = bytearray()
+                for key, numbers in key2numbers.iteritems():
+                    encode_record(key, numbers, out)
+                f.write(out)
+        return set(added.keys())
+
+def index_job(job):
+    """
+    Runs HashtagIndex.index_file() for a (index, file) job. Module level so
+    that it can be sent to pool workers
+    """
+    index, file = job
+    try:
+        status = index.index_file(file)
+    except (IOError, OSError), e:
+        print "\t"+file+": "+str(e)
+        status = -1
+    return file, status
+
+# ------------------------------------------------------------------------------
+# ------------------------------ Postings files --------------------------------
+# ------------------------------------------------------------------------------
+def encode_varint(number, out):
+    while number >= 0x80:
+        out.append((number & 0x7f) | 0x80)
+        number >>= 7
+    out.append(number)
+
+def decode_varint(buf, pos):
+    number = 0
+    shift = 0
+    while True:
+        byte = buf[pos]
+        pos += 1
+        number |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return number, pos
+        shift += 7
+
+def encode_record(key_bytes, numbers, out):
+    """
+    Appends the record of a key (UTF-8) and its (sorted) ints to out
+    """
+    postings = bytearray()
+    previous = 0
+    for number in numbers:
+        encode_varint(number-previous, postings)
+        previous = number
+    encode_varint(len(key_bytes), out)
+    out.extend(key_bytes)
+    encode_varint(len(numbers), out)
+    encode_varint(len(postings), out)
+    out.extend(postings)
+
+def iter_records(buf):
+    """
+    Yields the (key (UTF-8), start, postings start, end) of each record of the
+    contents of a postings file, without decoding the postings
+    """
+    pos = 0
+    while pos < len(buf):
+        start = pos
+        key_length, pos = decode_varint(buf, pos)
+        key = str(buf[pos:pos+key_length])
+        pos += key_length
+        count, pos = decode_varint(buf, pos)
+        postings_length, pos = decode_varint(buf, pos)
+        yield key, start, pos, pos+postings_length
+        pos += postings_length
+
+def decode_postings(buf, pos, end):
+    numbers = []
+    number = 0
+    while pos < end:
+        delta, pos = decode_varint(buf, pos)
+        number += delta
+        numbers.append(number)
+    return numbers
+
+def read_file(filename):
+    with open(filename, 'rb') as f:
+        return bytearray(f.read())
+
+def write_postings(filename, key2numbers):
+    """
+    Writes sorted, delta-encoded lists of ints for each (unicode) key
+    """
+    out = bytearray()
+    for key in sorted(key2numbers.keys()):
+        encode_record(key.encode('utf-8'), sorted(key2numbers[key]), out)
+    with open(filename+'.tmp', 'wb') as f:
+        f.write(out)
+    os.rename(filename+'.tmp', filename)
+
+def read_pending(filename, key2numbers):
+    """
+    Adds the postings of a pending file (see HashtagIndex.spill_pending()) to
+    key2numbers (UTF-8 key -> array of ints), and removes the file
+    """
+    buf = read_file(filename)
+    for key, start, pos, end in iter_records(buf):
+        if key not in key2numbers:
+            key2numbers[key] = array('l')
+        key2numbers[key].extend(decode_postings(buf, pos, end))
+    os.remove(filename)
+    return key2numbers
+
+def merge_shard(filename, added, removed, rebuild=False):
+    """
+    Rewrites a postings file with the ints of added (UTF-8 key -> ints) added
+    to, and those of removed (UTF-8 key -> set of ints) taken out of, their
+    keys. Records of other keys are copied without being decoded, keys left
+    without ints are dropped, and a file left without keys is removed. The
+    file is written to a temporary file that is renamed into place
+
+    INPUT
+    -----
+    rebuild: boolean, defaults to False
+        If True, the old contents of the file are ignored
+    """
+    records = []
+    merged = set()
+    if not rebuild and os.path.exists(filename):
+        buf = read_file(filename)
+        for key, start, pos, end in iter_records(buf):
+            merged.add(key)
+            if key in added or key in removed:
+                numbers = decode_postings(buf, pos, end)
+                if key in removed:
+                    numbers = [number for number in numbers if number not in removed[key]]
+                if key in added:
+                    numbers = sorted(set(numbers) | set(added[key]))
+                if numbers:
+                    record = bytearray()
+                    encode_record(key, numbers, record)
+                    records.append((key, record))
+            else:
+                records.append((key, buf[start:end]))
+    for key, numbers in added.iteritems():
+        if key not in merged and numbers:
+            record = bytearray()
+            encode_record(key, sorted(set(numbers)), record)
+            records.append((key, record))
+    if not records:
+        if os.path.exists(filename):
+            os.remove(filename)
+        return
+    records.sort(key=lambda record: record[0])
+    with open(filename+'.tmp', 'wb') as f:
+        for key, record in records:
+            f.write(record)
+    os.rename(filename+'.tmp', filename)
+
+def read_postings(filename, keys=None):
+    """
+    Reads the lists of ints written by write_postings(), only decoding the
+    postings of the given keys (all keys if None)
+
+    OUTPUT
+    ------
+    key2numbers, dict (unicode key -> list of ints)
+    """
+    key2numbers = {}
+    if not os.path.exists(filename):
+        return key2numbers
+    if keys is not None:
+        keys = set([key.encode('utf-8') for key in keys])
+    buf = read_file(filename)
+    for key, start, pos, end in iter_records(buf):
+        if keys is None or key in keys:
+            key2numbers[key.decode('utf-8')] = decode_postings(buf, pos, end)
+    return key2numbers
+
+def read_keys(filename, decode=True):
+    """
+    Returns the keys of a file written by write_postings(), without decoding
+    their postings: unicode keys, or UTF-8 ones if not decode
+    """
+    keys = [key for key, start, pos, end in iter_records(read_file(filename))]
+    if decode:
+        keys = [key.decode('utf-8') for key in keys]
+    return keys
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3:
+        print "Usage: python hashtag_index.py data_path index_dir [reduced|full] [n_workers]"
+        sys.exit()
+    data_fullness = 'reduced'
+    n_workers = 1
+    if len(sys.argv) > 3:
+        data_fullness = sys.argv[3]
+    if len(sys.argv) > 4:
+        n_workers = int(sys.argv[4])
+    HashtagIndex(sys.argv[2], sys.argv[1], data_fullness).build(n_workers=n_workers)
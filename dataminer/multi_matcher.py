@@ -0,0 +1,265 @@
+"""Multi Matcher (multi_matcher.py)
+Aho-Corasick automaton for finding which of many keywords/hashtags appear in a
+line of text in a single scan, however many keywords there are, and matching of
+extraction queries on exact hashtag tokens
+
+Contributors:
+Devin Gaffney & Ryan J. Gallagher
+Network Science Institute, Northeastern University, 2017
+"""
+import re
+import csv
+import json
+from collections import deque
+import corpus_io
+
+# Hashtag tokens in tweet text: '#' followed by word characters, so that #ff
+# is a different token from #ffvi
+hashtag_re = re.compile(r'#(\w+)', re.UNICODE)
+
+def normalize_hashtag(hashtag):
+    """
+    Returns the case-folded hashtag without its leading '#', as a unicode
+    string (byte strings are decoded as UTF-8)
+    """
+    if not isinstance(hashtag, unicode):
+        hashtag = hashtag.decode('utf-8')
+    return hashtag.lstrip('#').lower()
+
+def hashtag_tokens(text):
+    """
+    Returns the set of case-folded hashtags (without '#') in a unicode string
+    """
+    return set([tag.lower() for tag in hashtag_re.findall(text)])
+
+def json_hashtags(tweet):
+    """
+    Returns the set of case-folded hashtags in the entities of a decoded
+    tweet, including the entities of extended (long) tweets
+    """
+    hashtags = set()
+    for container in [tweet, tweet.get('extended_tweet') or {}]:
+        for hashtag in (container.get('entities') or {}).get('hashtags', []):
+            hashtags.add(hashtag['text'].lower())
+    return hashtags
+
+def line_hashtags(line, data_fullness='reduced'):
+    """
+    Returns the set of case-folded hashtags of a line of the archive: the
+    hashtag tokens of the text column of a reduced TSV row (not of its URLs,
+    screen names or other columns), or the entities of a full JSON tweet
+    """
+    if data_fullness == 'full':
+        try:
+            return json_hashtags(json.loads(line))
+        except (ValueError, AttributeError, KeyError, TypeError):
+            return set()
+    try:
+        row = corpus_io.split_reduced_line(line)
+    except csv.Error:
+        return set()
+    if len(row) <= corpus_io.TEXT:
+        return set()
+    return hashtag_tokens(row[corpus_io.TEXT].decode('utf-8', 'replace'))
+
+def ascii_prefix(text):
+    """
+    Returns the characters of a unicode string before its first non-ASCII one
+    """
+    for k, char in enumerate(text):
+        if ord(char) > 127:
+            return text[:k]
+    return text
+
+class AhoCorasick:
+    """
+    Multi-pattern substring matcher
+
+    Example:
+        import multi_matcher
+        matcher = multi_matcher.AhoCorasick(['#Ferguson', '#BlackLivesMatter'])
+        matcher.search('RT #Ferguson and #BlackLivesMatter')
+        # -> set(['#Ferguson', '#BlackLivesMatter'])
+
+    Parameters
+    ----------
+    patterns: list (iterable) of strings, defaults to None
+        Patterns to match. Each pattern is its own value in search() results.
+        More patterns (with other values) can be added with add() before the
+        first search
+
+    Attributes
+    ----------
+    goto: list of dicts (character -> state)
+        Trie of the patterns, indexed by state
+
+    fail: list of ints
+        Failure link of each state, the state of the longest proper suffix of
+        that state's prefix that is also in the trie
+
+    output: list of sets
+        Values of the patterns ending at each state, including the ones
+        reached through failure links
+    """
+    def __init__(self, patterns=None):
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [set()]
+        self.built = False
+        self.first_chars = None
+        if patterns is not None:
+            for pattern in patterns:
+                self.add(pattern)
+
+    def add(self, pattern, value=None):
+        """
+        Adds a pattern to the trie. value is what search() reports when the
+        pattern is found, the pattern itself by default
+        """
+        if value is None:
+            value = pattern
+        if len(pattern) == 0:
+            return
+        state = 0
+        for char in pattern:
+            if char not in self.goto[state]:
+                self.goto.append({})
+                self.fail.append(0)
+                self.output.append(set())
+                self.goto[state][char] = len(self.goto)-1
+            state = self.goto[state][char]
+        self.output[state].add(value)
+        self.built = False
+
+    def build(self):
+        """
+        Computes the failure links breadth first, merging the outputs of each
+        state's failure state into its own
+        """
+        queue = deque()
+        for char, state in self.goto[0].items():
+            self.fail[state] = 0
+            queue.append(state)
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self.goto[state].items():
+                queue.append(next_state)
+                fail_state = self.fail[state]
+                while fail_state and char not in self.goto[fail_state]:
+                    fail_state = self.fail[fail_state]
+                self.fail[next_state] = self.goto[fail_state].get(char, 0)
+                self.output[next_state] |= self.output[self.fail[next_state]]
+        # From the root, skip straight to the next character that can start a
+        # pattern (eg. the next '#' when all patterns are hashtags)
+        if self.goto[0]:
+            self.first_chars = re.compile('['+''.join([re.escape(char) for char in self.goto[0]])+']')
+        self.built = True
+
+    def search(self, text):
+        """
+        Returns the set of values of all patterns occurring in text
+        """
+        if not self.built:
+            self.build()
+        found = set()
+        if len(self.goto[0]) == 0:
+            return found
+        goto = self.goto
+        fail = self.fail
+        output = self.output
+        first_chars = self.first_chars
+        state = 0
+        i = 0
+        n = len(text)
+        while i < n:
+            if state == 0:
+                match = first_chars.search(text, i)
+                if match is None:
+                    break
+                i = match.start()
+            char = text[i]
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if output[state]:
+                found |= output[state]
+            i += 1
+        return found
+
+class QueryMatcher:
+    """
+    Matches lines of the Gardenhose archive against several extraction
+    queries at once. Terms starting with '#' match exact, case-folded hashtag
+    tokens; other terms match as (case-sensitive) substrings of the line. A
+    line matches a query when it contains all of the query's terms
+
+    Example:
+        import multi_matcher
+        matcher = multi_matcher.QueryMatcher([['#ff'], ['#Ferguson', '#Justice']])
+        matcher.match(line)
+        # -> [1] for a line with #ferguson and #JUSTICE, but [] for #ffvi
+
+    Parameters
+    ----------
+    queries: list of lists of strings
+        Hashtags/keywords of each query
+
+    data_fullness: string, "reduced" or "full"
+        Format of the lines. Hashtags are read from the tokens of the text
+        column for "reduced" lines, and from the tweet entities for "full"
+        (JSON) lines
+
+    Attributes
+    ----------
+    query_terms: list of (set, set) tuples
+        Normalized hashtags and keywords of each query
+
+    hashtag_automaton: AhoCorasick
+        Prefilter on '#hashtag' substrings of the case-folded line, so that
+        only candidate lines are tokenized or decoded as JSON. JSON lines
+        escape non-ASCII characters (as \\uXXXX), so for "full" lines only
+        the part of a hashtag before its first non-ASCII character is looked
+        for
+
+    keyword_automaton: AhoCorasick
+        Matcher of the non-hashtag keywords
+    """
+    def __init__(self, queries, data_fullness='reduced'):
+        self.data_fullness = data_fullness
+        self.query_terms = []
+        self.hashtag_automaton = AhoCorasick()
+        self.keyword_automaton = AhoCorasick()
+        for query in queries:
+            hashtags = set()
+            keywords = set()
+            for term in query:
+                if term.startswith('#'):
+                    hashtag = normalize_hashtag(term)
+                    hashtags.add(hashtag)
+                    if data_fullness == 'full':
+                        self.hashtag_automaton.add(u'#'+ascii_prefix(hashtag), hashtag)
+                    else:
+                        self.hashtag_automaton.add(u'#'+hashtag, hashtag)
+                else:
+                    keywords.add(term)
+                    self.keyword_automaton.add(term)
+            self.query_terms.append((hashtags, keywords))
+        self.hashtag_automaton.build()
+        self.keyword_automaton.build()
+        self.has_hashtags = len(self.hashtag_automaton.goto[0]) > 0
+
+    def match(self, line):
+        """
+        Returns the indices of the queries matched by a line (byte string)
+        """
+        keywords = self.keyword_automaton.search(line)
+        hashtags = set()
+        if self.has_hashtags:
+            hashtags = self.hashtag_automaton.search(line.decode('utf-8', 'replace').lower())
+        if hashtags:
+            # Only keep the candidates that are whole hashtag tokens
+            hashtags &= line_hashtags(line, self.data_fullness)
+        if not hashtags and not keywords:
+            return []
+        return [k for k, (query_hashtags, query_keywords) in enumerate(self.query_terms)
+                if query_hashtags <= hashtags and query_keywords <= keywords]
@@ -7,13 +7,32 @@ Devin Gaffney & Ryan J. Gallagher
 Network Science Institute, Northeastern University, 2017
 """
 import os
+import re
+import sys
 import csv
 import json
-import term_counter
-from ttp import ttp
-#import networkx as nx
+import heapq
+import corpus_store
+import corpus_io
+import tweet_cache
+import parallel
+import edge_store
+import graph_stats
+import centrality
+import time_analyzer
+import ranked_writer
+import checkpoint
+import numpy as np
 from collections import Counter
-import networkx as nx
+
+# Interaction layers built from each tweet. The mention layer is written to
+# edge-list.csv, the others to edge-list-<layer>.csv
+layers = ["mention", "retweet", "quote", "reply"]
+# Reduced (CSV) rows only have the text, so retweets, replies and quotes are
+# read from it: "RT @user: ...", "@user ..." and links to a user's status
+retweet_re = re.compile(r'^RT @(\w{1,20})', re.UNICODE)
+reply_re = re.compile(r'^@(\w{1,20})', re.UNICODE)
+quote_re = re.compile(r'twitter\.com/(\w{1,20})/status(?:es)?/\d+', re.UNICODE)
 
 class NetworkAnalyzer:
     """
@@ -32,6 +51,10 @@ class NetworkAnalyzer:
         Directory to build a directory of output files containing ranked lists
         of terms. If None, uses the user's current working directory
 
+    cache: tweet_cache.TweetCache, defaults to None
+        Cache of the entities of each text, which can be shared with a
+        TermCounter. A new one is made if None
+
     Attributes
     ----------
     reduced_data: boolean
@@ -42,146 +65,438 @@ class NetworkAnalyzer:
 
     n_edges, int
 
-    edge2weight, dict (source/target tuple -> weight)
+    layers, dict (layer -> edge_store.EdgeStore)
+        Weighted edges (source/target screen names -> weight) of each
+        interaction: mention, retweet, quote and reply
+
+    edges, edge_store.EdgeStore
+        The mention layer, which the statistics and rankings are computed on
+
+    in_degrees, np.ndarray
+        In-degree of each node id of edges, set by get_ranked_in_degree()
+
+    store: corpus_store.CorpusStore
+        Columnar store of the tweets, read instead of the tweet files when it
+        exists and is up to date (None otherwise)
     """
 
-    def __init__(self, tweet_dir, working_dir=None):
+    # Fields of full (JSON) tweets read by the analyses (see corpus_io.py)
+    json_fields = ['created_at', 'user.screen_name', 'entities.user_mentions', 'extended_tweet.entities.user_mentions',
+                   'retweeted_status.user.screen_name', 'quoted_status.user.screen_name', 'in_reply_to_screen_name']
+    # Columns of reduced tweets read by the analyses
+    reduced_columns = (corpus_io.CREATED_AT, corpus_io.TEXT, corpus_io.SCREEN_NAME)
+
+    def __init__(self, tweet_dir, working_dir=None, cache=None):
         self.tweet_dir = tweet_dir
+        if cache is None:
+            self.cache = tweet_cache.TweetCache()
+        else:
+            self.cache = cache
         self.n_nodes = 0
         self.n_edges = 0
-        self.edge2weight = Counter()
-        self.node2in_deg = Counter()
+        self.layers = self.new_layers()
+        self.edges = self.layers["mention"]
+        self.in_degrees = None
         if working_dir is None:
             self.working_dir = os.getcwd()
         else:
             self.working_dir = working_dir
         if 'reduced' in self.tweet_dir:
             self.reduced_data = True
+            self.store = corpus_store.open_corpus_store(self.tweet_dir)
         else:
             self.reduced_data = False
+            self.store = None
+
+    def get_edge_list(self, n_workers=1, incremental=False):
+        """
+        Builds the interaction networks (mention, retweet, quote and reply
+        layers, from a single read of each row) of all tweet files and writes
+        their edge lists
 
-    def get_edge_list(self):
+        INPUT
+        -----
+        n_workers: int
+            Number of processes reading tweet files at the same time. With
+            more than one, the per-file edges are merged by parallel.py
+        incremental: boolean, defaults to False
+            If True, the edges of each file are kept with a manifest of the
+            tweet files in network_stats/.checkpoint (see checkpoint.py), and
+            only new or changed files are read
+        """
         # List out tweet files
         tweet_files = os.listdir(self.tweet_dir)
         # Get edges from each tweet file
-        for filename in tweet_files:
-            print filename
-            file_edges = self.get_edges_from_file(filename)
-            self.edge2weight.update(file_edges)
-        # Get size of network (nodes and edges)
+        if incremental:
+            manifest = checkpoint.Manifest(self.working_dir+'/network_stats', 'edges',
+                                           {'layers': layers, 'reduced_data': self.reduced_data})
+            file_layers = manifest.run(self, tweet_files, 'get_edges_from_file', (), n_workers)
+            for layer in file_layers.keys():
+                self.layers[layer].update(file_layers[layer])
+        elif n_workers > 1:
+            file_layers = parallel.map_reduce(NetworkAnalyzer, (self.tweet_dir, self.working_dir),
+                                              'get_edges_from_file', tweet_files, (), n_workers)
+            for layer in file_layers.keys():
+                self.layers[layer].update(file_layers[layer])
+        else:
+            for filename in tweet_files:
+                print filename
+                file_layers = self.get_edges_from_file(filename)
+                for layer in file_layers.keys():
+                    self.layers[layer].update(file_layers[layer])
+            print self.cache.summary()
+        # Get size of network (nodes and edges) and output the edge list
+        self.write_edges()
+
+    def write_edges(self):
+        """
+        Gets the size of the mention network and writes the edge list of
+        every layer into the network_stats output directory
+        """
         self.get_network_size()
-        # Output the edge list
         output_dir = self.working_dir+'/network_stats'
         try:
             os.makedirs(output_dir)
         except:
             print "File '"+output_dir+"' exists"
-        self.write_edge_list(self.edge2weight, output_dir+'/edge-list.csv')
+        for layer in layers:
+            if layer == "mention":
+                self.write_edge_list(self.layers[layer], output_dir+'/edge-list.csv')
+            else:
+                self.write_edge_list(self.layers[layer], output_dir+'/edge-list-'+layer+'.csv')
+
+    def basic_stats(self, time_budget=None):
+        """
+        Returns the size, components and diameter of the (undirected) mention
+        network: the edges in memory if get_edge_list() was run, otherwise the
+        edge list written earlier. See graph_stats.py
 
-    def basic_stats(self):
+        INPUT
+        -----
+        time_budget: float, defaults to None
+            Seconds spent tightening the bounds of the diameter of the largest
+            connected component (no limit if None)
+
+        OUTPUT
+        ------
+        stats, dict
+            node_count, edge_count, component_count, lcc_node_count,
+            lcc_edge_count, lcc_diameter_lower, lcc_diameter_upper,
+            lcc_diameter ("NA" unless the bounds meet) and diameter ("NA"
+            unless the network is connected)
+        """
+        edges = self.loaded_edges()
+        sources, targets = edges.edge_arrays()
+        stats = graph_stats.graph_stats(edges.n_nodes(), sources, targets, time_budget)
+        stats['lcc_diameter'] = "NA"
+        if stats['lcc_diameter_lower'] == stats['lcc_diameter_upper']:
+            stats['lcc_diameter'] = stats['lcc_diameter_lower']
+        stats['diameter'] = "NA"
+        if stats['component_count'] == 1:
+            stats['diameter'] = stats['lcc_diameter']
+        return stats
+
+    def get_ranked_centrality(self, measures=["pagerank", "hits", "eigenvector"], tol=None, max_iter=100):
+        """
+        Ranks users by weighted centralities of the mention network (the edges
+        in memory if get_edge_list() was run, otherwise the edge list written
+        earlier), computed by sparse power iteration (see centrality.py)
+
+        INPUT
+        -----
+        measures: list of strings
+            Any of "pagerank", "hits" (hubs and authorities) and "eigenvector"
+        tol: float, defaults to None
+            Convergence tolerance of the power iterations. Pagerank and
+            eigenvector scale it by the number of nodes and HITS does not, so
+            each measure keeps its own default (see centrality.py) unless
+            one is given
+        max_iter: int
+            Maximum number of iterations of each measure
+
+        OUTPUT
+        ------
+        Makes ranked-pagerank.csv, ranked-hubs.csv, ranked-authorities.csv
+        and ranked-eigenvector.csv in the network_stats output directory
+        """
+        edges = self.loaded_edges()
+        if edges.n_edges() == 0:
+            print 'Need an edge list to get the ranked centralities'
+            sys.exit()
+        n_nodes = edges.n_nodes()
+        sources, targets = edges.edge_arrays()
+        options = {'max_iter': max_iter}
+        if tol is not None:
+            options['tol'] = tol
+        scores = {}
+        if "pagerank" in measures:
+            scores['pagerank'] = centrality.pagerank(n_nodes, sources, targets, edges.weights, **options)[0]
+        if "hits" in measures:
+            scores['hubs'], scores['authorities'] = centrality.hits(n_nodes, sources, targets, edges.weights, **options)[:2]
+        if "eigenvector" in measures:
+            scores['eigenvector'] = centrality.eigenvector(n_nodes, sources, targets, edges.weights, **options)[0]
         output_dir = self.working_dir+'/network_stats'
-        G=nx.read_weighted_edgelist(output_dir+'/edge-list.csv', delimiter=",")
-        graphs = list(nx.connected_component_subgraphs(G))
-        lcc = sorted(graphs, key=lambda graph: len(graph.nodes()), reverse=True)[0]
         try:
-            diameter = nx.diameter(G)
+            os.makedirs(output_dir)
         except:
-            diameter = "NA"
-        return {'node_count': len(G.nodes()), 'edge_count': len(G.edges()), 'component_count': len(graphs), 'lcc_node_count': len(lcc.nodes()), 'lcc_edge_count': len(lcc.edges()), 'diameter': diameter, 'lcc_diameter': nx.diameter(lcc)}
+            print "File '"+output_dir+"' exists"
+        for measure in scores.keys():
+            self.write_ranked_nodes(scores[measure], output_dir+'/ranked-'+measure+'.csv', edges)
+
+    def loaded_edges(self):
+        """
+        Returns the edges in memory, or those of the edge list written by an
+        earlier run if there are none
+        """
+        if self.edges.n_edges() == 0 and os.path.exists(self.working_dir+'/network_stats/edge-list.csv'):
+            return edge_store.read_edge_list(self.working_dir+'/network_stats/edge-list.csv')
+        return self.edges
+
+    def new_layers(self):
+        return dict([(layer, edge_store.EdgeStore()) for layer in layers])
 
     def get_edges_from_file(self, filename):
-        edge2weight = Counter()
-        with open(self.tweet_dir+'/'+filename, 'rb') as f:
-            # Open the file differently based on CSV or JSON
+        edges = self.new_layers()
+        # Read through each line of the file and update the edges
+        for tweet in corpus_store.read_rows(self.tweet_dir, filename, self.reduced_data, self.store, self.json_fields,
+                                             columns=self.reduced_columns):
+            self.update_edges(tweet, edges)
+        return edges
+
+    def update_edges(self, tweet, edges):
+        """
+        Adds the edges of a single row of a tweet file to each layer made by
+        new_layers(): from the user to every user they mention, and to the
+        user they retweet, quote or reply to
+
+        For reduced data, mentions are parsed from the text and retweets,
+        replies and quotes recognized in it (see retweet_re, reply_re and
+        quote_re). For full data, they come from the user_mentions entities
+        and the retweeted_status, quoted_status and in_reply_to_screen_name
+        fields
+        """
+        if self.reduced_data is True:
+            user = tweet[-1]
+            text = tweet[9]
+            mentions = self.cache.entities(text).mentions
+            retweeted = retweet_re.match(text)
+            if retweeted is not None:
+                edges["retweet"].add(user, retweeted.group(1))
+            else:
+                replied = reply_re.match(text)
+                if replied is not None:
+                    edges["reply"].add(user, replied.group(1))
+            for quoted in quote_re.findall(text):
+                edges["quote"].add(user, quoted)
+        else:
+            user = tweet['user.screen_name']
+            user_mentions = tweet['extended_tweet.entities.user_mentions'] or tweet['entities.user_mentions'] or []
+            mentions = [mention['screen_name'] for mention in user_mentions]
+            if tweet['retweeted_status.user.screen_name']:
+                edges["retweet"].add(user, tweet['retweeted_status.user.screen_name'])
+            if tweet['quoted_status.user.screen_name']:
+                edges["quote"].add(user, tweet['quoted_status.user.screen_name'])
+            if tweet['in_reply_to_screen_name']:
+                edges["reply"].add(user, tweet['in_reply_to_screen_name'])
+        # Make edges of user with all mentions
+        for mention in mentions:
+            edges["mention"].add(user, mention)
+
+    def get_snapshots(self, granularity="day", window=1, layer="mention", top_n=100, time_budget=0, n_workers=1):
+        """
+        Builds the network of each time bucket and of every sliding window of
+        consecutive buckets. The window moves one bucket at a time and is kept
+        incrementally: the incoming bucket's edges are added to it and the
+        outgoing bucket's subtracted, instead of rebuilding it from the tweets
+        of all its buckets. Components are recomputed for each window (see
+        graph_stats.py), since union-find cannot undo edges
+
+        INPUT
+        -----
+        granularity: string, defaults to "day"
+            Bucket size: "minute", "hour", "day" or "week" (see
+            time_analyzer.bucket_id())
+        window: int, defaults to 1
+            Buckets per window (1 for plain snapshots, eg. 7 days for a
+            sliding week)
+        layer: string, defaults to "mention"
+            Interaction layer of the snapshots (see update_edges())
+        top_n: int, defaults to 100
+            Users ranked by in-degree in each window (all if None)
+        time_budget: float, defaults to 0
+            Seconds spent tightening the diameter bounds of each window's
+            largest component (0 keeps the double sweep bounds)
+        n_workers: int
+            Number of processes reading tweet files at the same time
+
+        OUTPUT
+        ------
+        Makes, in the network_stats output directory (suffixed with the
+        granularity, and the window if larger than 1):
+            edge-list-<granularity>.csv: bucket, source, target, weight
+            snapshots-<suffix>.csv: window start, window end, node_count,
+                edge_count, component_count, lcc_node_count, lcc_edge_count,
+                lcc_diameter_lower, lcc_diameter_upper
+            ranked-indegree-<suffix>.csv: window start, rank, user, in-degree
+        Returns the stats dict of each window, in time order
+        """
+        time_analyzer.bucket_id(0, granularity)
+        tweet_files = os.listdir(self.tweet_dir)
+        if n_workers > 1:
+            buckets = parallel.map_reduce(NetworkAnalyzer, (self.tweet_dir, self.working_dir),
+                                          'get_bucket_edges_from_file', tweet_files, (granularity, layer), n_workers)
+        else:
+            buckets = {}
+            for filename in tweet_files:
+                print filename
+                buckets = parallel.merge_partials(buckets, self.get_bucket_edges_from_file(filename, granularity, layer))
+        output_dir = self.working_dir+'/network_stats'
+        try:
+            os.makedirs(output_dir)
+        except:
+            print "File '"+output_dir+"' exists"
+        suffix = "-"+granularity
+        if window > 1:
+            suffix += "-"+str(window)
+        with ranked_writer.atomic_open(output_dir+'/edge-list-'+granularity+'.csv') as f:
+            csvwriter = csv.writer(f, delimiter=',')
+            for bucket in sorted(buckets.keys()):
+                label = time_analyzer.bucket_label(bucket, granularity)
+                for (source,target,weight) in buckets[bucket].ranked_edges():
+                    csvwriter.writerow([label,source,target,weight])
+        all_stats = []
+        if not buckets:
+            return all_stats
+        columns = ['node_count', 'edge_count', 'component_count', 'lcc_node_count', 'lcc_edge_count',
+                   'lcc_diameter_lower', 'lcc_diameter_upper']
+        first = min(buckets.keys())
+        last = max(buckets.keys())
+        window_edges = edge_store.EdgeStore()
+        with ranked_writer.atomic_open(output_dir+'/snapshots'+suffix+'.csv') as stats_file, \
+             ranked_writer.atomic_open(output_dir+'/ranked-indegree'+suffix+'.csv') as ranked_file:
+            stats_writer = csv.writer(stats_file, delimiter=',')
+            indegree_writer = csv.writer(ranked_file, delimiter=',')
+            for bucket in xrange(first, last+1):
+                if bucket in buckets:
+                    window_edges.update(buckets[bucket])
+                if bucket-window in buckets:
+                    window_edges.subtract(buckets[bucket-window])
+                # Only full windows, unless the corpus is shorter than one
+                if bucket < first+window-1 and bucket < last:
+                    continue
+                start = time_analyzer.bucket_label(max(first, bucket-window+1), granularity)
+                end = time_analyzer.bucket_label(bucket, granularity)
+                stats = self.window_stats(window_edges, time_budget)
+                stats_writer.writerow([start, end]+[stats[column] for column in columns])
+                for k,(node,value) in enumerate(self.top_in_degrees(window_edges, top_n)):
+                    indegree_writer.writerow([start,k,node,value])
+                stats['start'] = start
+                stats['end'] = end
+                all_stats.append(stats)
+        return all_stats
+
+    def get_bucket_edges_from_file(self, filename, granularity, layer):
+        """
+        Returns the edges of one layer of a tweet file per time bucket, as a
+        dict of bucket index (time_analyzer.bucket_id()) -> EdgeStore. Rows
+        without a readable timestamp are skipped
+        """
+        bucket2layers = {}
+        for tweet in corpus_store.read_rows(self.tweet_dir, filename, self.reduced_data, self.store, self.json_fields,
+                                             columns=self.reduced_columns):
             if self.reduced_data is True:
-                tweet_file = self.a_most_dirty_hand(csv.reader(f, delimiter='\t'))
+                created_at = tweet[2]
             else:
-                tweet_file = f
-            # Read through each line of the file and update Counters
-            null_rows = 0
-            for tweet in tweet_file:
-                # try:
-                if self.reduced_data is True:
-                    user = tweet[-1]
-                    text = unicode(tweet[9], 'utf-8')
-                else:
-                    tweet = json.loads(line)
-                    user = 5#TODO: fill in
-                    text = unicode(tweet['text'], 'utf-8')
-                mentions = term_counter.TermCounter("", "").mentions(text)
-                # Make edges of user with all mentions
-                for mention in mentions:
-                    edge2weight.update([(user, mention)])
-                # except:
-                #     print "Null row."
-                #     null_rows += 1
-        return edge2weight
+                created_at = tweet['created_at']
+            try:
+                bucket = time_analyzer.bucket_id(time_analyzer.parse_timestamp(created_at), granularity)
+            except (ValueError, OverflowError, TypeError, AttributeError):
+                continue
+            if bucket not in bucket2layers:
+                bucket2layers[bucket] = self.new_layers()
+            self.update_edges(tweet, bucket2layers[bucket])
+        return dict([(bucket, bucket_layers[layer]) for bucket, bucket_layers in bucket2layers.iteritems()])
+
+    def window_stats(self, edges, time_budget=0):
+        """
+        Returns graph_stats.graph_stats() of the nodes with edges in an
+        EdgeStore
+        """
+        sources, targets = edges.edge_arrays()
+        nodes, sources, targets = graph_stats.compact_nodes(sources, targets)
+        return graph_stats.graph_stats(len(nodes), sources, targets, time_budget)
+
+    def top_in_degrees(self, edges, top_n=None):
+        """
+        Returns (name, in-degree) of the top_n nodes of an EdgeStore by
+        in-degree (all with a non-zero one if None), ties by name, high to low
+        """
+        in_degrees = edges.in_degree()
+        node_ids = np.nonzero(in_degrees)[0]
+        ranked = zip(in_degrees[node_ids].tolist(), [edges.nodes[node_id] for node_id in node_ids.tolist()])
+        if top_n is None:
+            ranked.sort(reverse=True)
+        else:
+            ranked = heapq.nlargest(top_n, ranked)
+        return [(node, value) for value, node in ranked]
 
     def get_network_size(self):
-        if len(self.edge2weight.keys()) == 0:
+        if self.edges.n_edges() == 0:
             print 'Need an edge list to get network size'
             return
 
-        self.n_edges = len(self.edge2weight.keys())
-        nodes = set()
-        for edge in self.edge2weight.keys():
-            nodes.update(edge)
-        self.n_nodes = len(nodes)
+        self.n_edges = self.edges.n_edges()
+        self.n_nodes = self.edges.n_nodes()
 
     def get_ranked_in_degree(self):
-        if len(self.edge2weight.keys()) == 0:
+        if self.edges.n_edges() == 0:
             print 'Need an edge list to get the ranked in-degrees'
             sys.exit()
 
         # Get in-degree for each node
-        for edge in self.edge2weight:
-            self.node2in_deg.update([edge[1]])
+        self.in_degrees = self.edges.in_degree()
         # Output the ranked list by in-degree
         output_dir = self.working_dir+'/network_stats'
         try:
             os.makedirs(output_dir)
         except:
             print "File '"+output_dir+"' exists"
-        self.write_ranked_list(self.node2in_deg, output_dir+'/ranked-indegree.csv')
+        self.write_ranked_nodes(self.in_degrees, output_dir+'/ranked-indegree.csv')
 
 
     # --------------------------------------------------------------------------
     # ---------------------------- Helper functions ----------------------------
     # --------------------------------------------------------------------------
-    def write_ranked_list(self, key2value, filename):
+    def write_ranked_list(self, key2value, filename, top_k=None):
         """
         Expects a dict where values are counts
-        Writes file (CSV file) of terms, counts, and rank
+        Writes file (CSV file) of terms, counts, and rank, sorting lists
+        larger than memory in runs on disk (see ranked_writer.py); only the
+        top_k keys are written if given
         """
-        # Dict -> sorted list of (value, key) pairs in high->low order
-        values_keys = [(key2value[key], key) for key in key2value]
-        values_keys.sort(reverse = True)
-        # Write ranks, keys, and values, to file
-        with open(filename, 'w') as f:
-            csvwriter = csv.writer(f, delimiter=',')
-            for k,(value,key) in enumerate(values_keys):
-                csvwriter.writerow([k,key,value])
+        ranked_writer.write_ranked_list(key2value, filename, top_k)
 
-    def write_edge_list(self, edge2weight, filename):
+    def write_ranked_nodes(self, values, filename, edges=None):
         """
-        Expects a dict where values are weights of tuple edges
-        Writes file (CSV file) of source, target, weight
+        Expects an array of values (eg. degrees) per node id of edges (an
+        edge_store.EdgeStore, self.edges by default)
+        Writes file (CSV file) of rank, node, and value, for the nodes with a
+        non-zero value
         """
-        # Dict -> sorted list of (value, key) pairs in high->low order
-        weight_edges = [(edge2weight[edge], edge) for edge in edge2weight]
-        weight_edges.sort(reverse = True)
-        # Write ranks, keys, and values, to file
-        with open(filename, 'w') as f:
+        if edges is None:
+            edges = self.edges
+        with ranked_writer.atomic_open(filename) as f:
             csvwriter = csv.writer(f, delimiter=',')
-            for (weight,edge) in weight_edges:
-                csvwriter.writerow([edge[0],edge[1],weight])
+            for k,(node,value) in enumerate(edges.ranked_nodes(values)):
+                csvwriter.writerow([k,node,value])
 
-    def a_most_dirty_hand(self, csv_reader):
-        while True:
-            try:
-                yield next(csv_reader)
-            except csv.Error:
-                # error handling what you want.
-                pass
-            continue
-        return
+    def write_edge_list(self, edges, filename):
+        """
+        Expects an edge_store.EdgeStore
+        Writes file (CSV file) of source, target, weight, from the highest
+        weight to the lowest
+        """
+        with ranked_writer.atomic_open(filename) as f:
+            csvwriter = csv.writer(f, delimiter=',')
+            for (source,target,weight) in edges.ranked_edges():
+                csvwriter.writerow([source,target,weight])
@@ -0,0 +1,238 @@
+"""N-gram Counter (ngram_counter.py)
+Counts the n-grams of tokenized tweets with tokens interned to integer ids and
+each n-gram packed into one int64 key, counted in sorted numpy arrays. The
+n-grams are only turned back into strings when the ranked lists are written
+
+Contributors:
+Devin Gaffney & Ryan J. Gallagher
+Network Science Institute, Northeastern University, 2017
+"""
+from array import array
+from itertools import chain
+from collections import Counter
+import numpy as np
+import ranked_writer
+
+class Vocabulary:
+    """
+    Interns tokens to consecutive integer ids
+
+    Attributes
+    ----------
+    token2id: dict (token -> id)
+
+    tokens: list of strings
+        Token of each id
+    """
+    def __init__(self):
+        self.token2id = {}
+        self.tokens = []
+
+    def __len__(self):
+        return len(self.tokens)
+
+    def ids(self, tokens):
+        """
+        Returns the ids of a list of tokens, adding the new ones
+        """
+        token2id = self.token2id
+        ids = []
+        for token in tokens:
+            token_id = token2id.get(token)
+            if token_id is None:
+                token_id = token2id[token] = len(self.tokens)
+                self.tokens.append(token)
+            ids.append(token_id)
+        return ids
+
+class NgramCounter:
+    """
+    Counts of the n-grams (for a single n) of lists of tokens
+
+    Each n-gram is packed into an int64 key of n fields of 63/n bits (31 bits
+    for bigrams, 21 for trigrams). Keys are buffered in a compact array and
+    folded into sorted arrays of distinct keys and counts every buffer_size
+    n-grams. N-grams containing a token id too large for the fields (eg. with
+    more than 2**21 distinct tokens, for trigrams) are counted as tuples of ids
+    instead
+
+    Example:
+        import ngram_counter
+        vocabulary = ngram_counter.Vocabulary()
+        bigrams = ngram_counter.NgramCounter(2, vocabulary)
+        bigrams.count_tokens([u'black', u'lives', u'matter'])
+        for count, bigram in bigrams.ranked():
+            ...
+
+    Parameters
+    ----------
+    n: int
+        Number of tokens of the counted n-grams
+    vocabulary: Vocabulary, defaults to None
+        Token ids, which can be shared by the counters of several n. A new one
+        is made if None
+    buffer_size: int, defaults to 1000000
+        Number of keys buffered before they are folded into the counts
+
+    Attributes
+    ----------
+    keys, counts: np.ndarray (int64)
+        Distinct packed n-grams, in increasing order, and their counts
+
+    wide: Counter (tuple of ids -> count)
+        Counts of the n-grams that do not fit in a packed key
+    """
+    def __init__(self, n, vocabulary=None, buffer_size=1000000):
+        self.n = n
+        if vocabulary is None:
+            self.vocabulary = Vocabulary()
+        else:
+            self.vocabulary = vocabulary
+        self.buffer_size = buffer_size
+        self.bits = 63//n
+        self.limit = 1 << self.bits
+        self.keys = np.zeros(0, dtype=np.int64)
+        self.counts = np.zeros(0, dtype=np.int64)
+        self.wide = Counter()
+        self.buffer = array('l')
+
+    def __getstate__(self):
+        # Pickled (eg. as a partial of parallel.py) without the buffer
+        self.flush()
+        return self.__dict__
+
+    def __len__(self):
+        self.flush()
+        return len(self.keys)+len(self.wide)
+
+    def count_tokens(self, tokens):
+        self.add(self.vocabulary.ids(tokens))
+
+    def add(self, ids):
+        """
+        Counts the n-grams of a list of token ids (of this counter's
+        vocabulary)
+        """
+        n = self.n
+        bits = self.bits
+        limit = self.limit
+        buffer = self.buffer
+        for k in xrange(len(ids)-n+1):
+            gram = ids[k:k+n]
+            if max(gram) < limit:
+                key = 0
+                for token_id in gram:
+                    key = (key << bits) | token_id
+                buffer.append(key)
+            else:
+                self.wide[tuple(gram)] += 1
+        if len(buffer) >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        """
+        Folds the buffered keys into keys and counts
+        """
+        if len(self.buffer) == 0:
+            return
+        keys, counts = np.unique(np.frombuffer(self.buffer, dtype=np.int64), return_counts=True)
+        self.buffer = array('l')
+        self.add_counts(keys, counts)
+
+    def add_counts(self, keys, counts):
+        if len(self.keys) == 0:
+            self.keys = keys.astype(np.int64)
+            self.counts = counts.astype(np.int64)
+            return
+        keys, inverse = np.unique(np.concatenate([self.keys, keys]), return_inverse=True)
+        totals = np.zeros(len(keys), dtype=np.int64)
+        np.add.at(totals, inverse, np.concatenate([self.counts, counts]))
+        self.keys = keys
+        self.counts = totals
+
+    def unpack(self, keys):
+        """
+        Returns the len(keys) x n array of the token ids of packed keys
+        """
+        ids = np.empty((len(keys), self.n), dtype=np.int64)
+        for k in range(self.n):
+            ids[:, self.n-1-k] = (keys >> (k*self.bits)) & (self.limit-1)
+        return ids
+
+    def pack(self, ids):
+        keys = np.zeros(len(ids), dtype=np.int64)
+        for k in range(self.n):
+            keys = (keys << self.bits) | ids[:, k]
+        return keys
+
+    def update(self, other):
+        """
+        Adds the counts of another NgramCounter of the same n, remapping its
+        token ids if it has a different vocabulary
+        """
+        other.flush()
+        self.flush()
+        if other.vocabulary is self.vocabulary:
+            self.add_counts(other.keys, other.counts)
+            self.wide.update(other.wide)
+            return
+        mapping = np.array(self.vocabulary.ids(other.vocabulary.tokens), dtype=np.int64)
+        ids = mapping[other.unpack(other.keys)]
+        counts = other.counts
+        if other.wide:
+            wide_grams = other.wide.keys()
+            ids = np.concatenate([ids, mapping[np.array(wide_grams, dtype=np.int64)]])
+            counts = np.concatenate([counts, np.array([other.wide[gram] for gram in wide_grams], dtype=np.int64)])
+        # Remapped ids can be too large for a packed key, and the other way
+        fits = (ids < self.limit).all(axis=1)
+        self.add_counts(self.pack(ids[fits]), counts[fits])
+        for gram, count in zip(ids[~fits].tolist(), counts[~fits].tolist()):
+            self.wide[tuple(gram)] += count
+
+    merge = update
+
+    def packed_items(self, keys, counts, chunk_size=100000):
+        # Unpacks keys a chunk at a time, yielding (list of ids, count)
+        for start in xrange(0, len(keys), chunk_size):
+            ids = self.unpack(keys[start:start+chunk_size]).tolist()
+            for gram, count in zip(ids, counts[start:start+chunk_size].tolist()):
+                yield gram, count
+
+    def decode(self, ids):
+        tokens = self.vocabulary.tokens
+        return u' '.join([tokens[token_id] for token_id in ids])
+
+    def iteritems(self):
+        """
+        Yields (n-gram, count), with the n-grams as space separated strings
+        """
+        self.flush()
+        for ids, count in self.packed_items(self.keys, self.counts):
+            yield self.decode(ids), count
+        for ids, count in self.wide.iteritems():
+            yield self.decode(ids), count
+
+    def ranked(self, run_size=ranked_writer.RUN_SIZE, temp_dir=None):
+        """
+        Yields (count, n-gram) from the highest count to the lowest, ties by
+        n-gram (high to low) as in ranked_writer.write_ranked_list(), so that
+        the order does not depend on the token ids. The n-grams of one count
+        are decoded when it is reached, and sorted as
+        ranked_writer.sorted_descending() does (in runs spilled to temp_dir
+        when there are more than run_size)
+        """
+        self.flush()
+        order = np.argsort(-self.counts, kind='mergesort')
+        keys = self.keys[order]
+        negated_counts = -self.counts[order]
+        wide_counts = {}
+        for ids, count in self.wide.iteritems():
+            wide_counts.setdefault(count, []).append(ids)
+        counts = sorted(set(self.counts.tolist()) | set(wide_counts.keys()), reverse=True)
+        for count in counts:
+            start = np.searchsorted(negated_counts, -count, 'left')
+            end = np.searchsorted(negated_counts, -count, 'right')
+            ngrams = chain((self.decode(ids) for ids, _ in self.packed_items(keys[start:end], negated_counts[start:end])),
+                           (self.decode(ids) for ids in wide_counts.pop(count, [])))
+            for ngram in ranked_writer.sorted_descending(ngrams, run_size, temp_dir):
+                yield count, ngram
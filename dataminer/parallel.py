@@ -0,0 +1,184 @@
+"""Parallel (parallel.py)
+Map-reduce of the per-file counts of an analyzer over a pool of worker
+processes. Each worker counts whole tweet files and writes its partial counts
+to disk (marshal), only the file names go back through the pool's queue, and
+the partials are merged pairwise in the workers (tree reduction) until one
+is left
+
+Contributors:
+Devin Gaffney & Ryan J. Gallagher
+Network Science Institute, Northeastern University, 2017
+"""
+import os
+import shutil
+import marshal
+import cPickle
+import tempfile
+from multiprocessing import Pool
+
+# Analyzer of each worker process, made once by init_worker()
+worker_analyzer = None
+
+def init_worker(analyzer_class, analyzer_args):
+    global worker_analyzer
+    worker_analyzer = analyzer_class(*analyzer_args)
+
+def map_reduce(analyzer_class, analyzer_args, method_name, filenames, method_args=(), n_workers=2, partial_dir=None):
+    """
+    Runs analyzer.<method_name>(filename, *method_args) for every file in a
+    pool of n_workers processes and merges the results
+
+    Example:
+        import parallel
+        counts = parallel.map_reduce(term_counter.TermCounter, (tweet_dir, working_dir),
+                                     'get_terms_from_file', filenames, (max_n,), 16)
+
+    INPUT
+    -----
+    analyzer_class: class
+        Analyzer made in each worker as analyzer_class(*analyzer_args)
+    method_name: string
+        Method returning a Counter, or a dict of Counters, for one file
+    partial_dir: string, defaults to None
+        Directory in which the partials are written (a new temporary
+        directory, removed afterwards, if None)
+
+    OUTPUT
+    ------
+    counts, dict
+        Sum of the per-file results, as plain dicts (key -> count), or a dict
+        of them if the method returns a dict of Counters
+    """
+    temp_dir = tempfile.mkdtemp(prefix='partials-', dir=partial_dir)
+    pool = Pool(processes=n_workers, initializer=init_worker, initargs=(analyzer_class, analyzer_args))
+    try:
+        jobs = [(method_name, filename, method_args, temp_dir+'/'+str(k)+'.partial')
+                for k, filename in enumerate(filenames)]
+        paths = pool.map(map_job, jobs, chunksize=1)
+        level = 0
+        while len(paths) > 1:
+            level += 1
+            pairs = [(paths[k], paths[k+1], temp_dir+'/'+str(level)+'-'+str(k)+'.partial')
+                     for k in range(0, len(paths)-1, 2)]
+            merged = pool.map(merge_job, pairs, chunksize=1)
+            if len(paths) % 2 == 1:
+                merged.append(paths[-1])
+            paths = merged
+        if paths:
+            counts = load_partial(paths[0])
+        else:
+            counts = {}
+    finally:
+        pool.close()
+        pool.join()
+        shutil.rmtree(temp_dir, ignore_errors=True)
+    return counts
+
+def map_files(analyzer_class, analyzer_args, method_name, filenames, method_args=(), n_workers=2, partial_dir=None, with_filenames=False):
+    """
+    Runs analyzer.<method_name>(filename, *method_args) for every file in a
+    pool of n_workers processes, like map_reduce(), but yields the result of
+    each file (as a plain dict, see load_partial()) as soon as it is ready
+    instead of merging them, so that the caller can fold them into a bounded
+    summary. Yields (filename, result) pairs if with_filenames is True
+    """
+    temp_dir = tempfile.mkdtemp(prefix='partials-', dir=partial_dir)
+    pool = Pool(processes=n_workers, initializer=init_worker, initargs=(analyzer_class, analyzer_args))
+    try:
+        jobs = [(method_name, filename, method_args, temp_dir+'/'+str(k)+'.partial')
+                for k, filename in enumerate(filenames)]
+        path2filename = dict([(path, filename) for method_name, filename, method_args, path in jobs])
+        for path in pool.imap_unordered(map_job, jobs):
+            counts = load_partial(path)
+            os.remove(path)
+            if with_filenames:
+                yield path2filename[path], counts
+            else:
+                yield counts
+    finally:
+        pool.close()
+        pool.join()
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+def map_job(job):
+    method_name, filename, method_args, path = job
+    print filename
+    result = getattr(worker_analyzer, method_name)(filename, *method_args)
+    dump_partial(result, path)
+    return path
+
+def merge_job(job):
+    path_a, path_b, path = job
+    merged = merge_partials(load_partial(path_a), load_partial(path_b))
+    dump_partial(merged, path)
+    os.remove(path_a)
+    os.remove(path_b)
+    return path
+
+# ------------------------------------------------------------------------------
+# --------------------------------- Partials -----------------------------------
+# ------------------------------------------------------------------------------
+def is_nested(counts):
+    # Dict of Counters (or of objects with their own merge(), such as
+    # ngram_counter.NgramCounter) rather than a dict of counts
+    value = counts.itervalues().next()
+    return isinstance(value, dict) or hasattr(value, 'merge')
+
+def dump_partial(counts, path):
+    """
+    Writes a Counter, or a dict of Counters, as marshalled plain dicts.
+    Objects with their own merge() (eg. edge_store.EdgeStore), and dicts
+    holding them, are pickled instead
+    """
+    pickled = False
+    if hasattr(counts, 'merge'):
+        pickled = True
+    elif counts and is_nested(counts):
+        pickled = any([hasattr(value, 'merge') for value in counts.itervalues()])
+        counts = dict([(key, value if hasattr(value, 'merge') else dict(value)) for key, value in counts.iteritems()])
+    else:
+        counts = dict(counts)
+    with open(path, 'wb') as f:
+        if pickled:
+            f.write('P')
+            cPickle.dump(counts, f, cPickle.HIGHEST_PROTOCOL)
+        else:
+            f.write('M')
+            marshal.dump(counts, f)
+
+def load_partial(path):
+    with open(path, 'rb') as f:
+        if f.read(1) == 'P':
+            return cPickle.load(f)
+        return marshal.load(f)
+
+def add_counts(total, counts):
+    """
+    Adds the counts of one dict into another, in place
+    """
+    for key, value in counts.iteritems():
+        total[key] = total.get(key, 0)+value
+    return total
+
+def merge_partials(a, b):
+    """
+    Sums two partials (dicts of counts, or dicts of dicts of counts or of
+    mergeable objects), adding the smaller into the larger
+    """
+    if not a:
+        return b
+    if not b:
+        return a
+    if hasattr(a, 'merge'):
+        a.merge(b)
+        return a
+    if is_nested(a):
+        for key, counts in b.iteritems():
+            if key in a:
+                a[key] = merge_partials(a[key], counts)
+            else:
+                a[key] = counts
+        return a
+    if len(a) < len(b):
+        a, b = b, a
+    return add_counts(a, b)
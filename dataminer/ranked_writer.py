@@ -0,0 +1,188 @@
+"""Ranked Writer (ranked_writer.py)
+Writes ranked lists (rank, key, value from the highest value to the lowest)
+of counts too large to sort in memory: sorted runs of a bounded number of
+items are spilled to disk and k-way merged into the output, or only the top k
+are kept with a heap. Outputs are written to a temporary file next to them
+and renamed into place, so that a failed or rerun job never leaves a partial
+or appended list behind
+
+Contributors:
+Devin Gaffney & Ryan J. Gallagher
+Network Science Institute, Northeastern University, 2017
+"""
+import os
+import csv
+import heapq
+import marshal
+import tempfile
+from contextlib import contextmanager
+
+# Items per sorted run, per marshalled chunk of a run, and runs merged at once
+RUN_SIZE = 1000000
+CHUNK_SIZE = 10000
+MAX_RUNS = 64
+# Permissions of the outputs, as open() would give them (mkstemp makes 0600)
+umask = os.umask(0)
+os.umask(umask)
+
+@contextmanager
+def atomic_open(filename, mode='w'):
+    """
+    Opens a temporary file in the directory of filename, which replaces
+    filename once the block finishes without error (and is removed otherwise)
+
+    Example:
+        with ranked_writer.atomic_open(output_dir+'/terms.csv') as f:
+            csv.writer(f).writerows(rows)
+    """
+    directory = os.path.dirname(os.path.abspath(filename))
+    fd, temp_path = tempfile.mkstemp(prefix='.'+os.path.basename(filename)+'-', dir=directory)
+    try:
+        with os.fdopen(fd, mode) as f:
+            yield f
+        os.chmod(temp_path, 0666 & ~umask)
+        os.rename(temp_path, filename)
+    except:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+class Descending(object):
+    """
+    Orders items from high to low in a heap, as heapq.merge() has no reverse
+    in Python 2
+    """
+    __slots__ = ('item',)
+
+    def __init__(self, item):
+        self.item = item
+
+    def __lt__(self, other):
+        return self.item > other.item
+
+    def __eq__(self, other):
+        return self.item == other.item
+
+def write_run(items, temp_dir):
+    """
+    Sorts items from high to low and writes them to a temporary file in
+    chunks. Returns the path of the file
+    """
+    items.sort(reverse=True)
+    fd, path = tempfile.mkstemp(prefix='run-', suffix='.marshal', dir=temp_dir)
+    with os.fdopen(fd, 'wb') as f:
+        for start in xrange(0, len(items), CHUNK_SIZE):
+            marshal.dump(items[start:start+CHUNK_SIZE], f)
+    return path
+
+def merge_runs(paths, temp_dir):
+    """
+    Merges runs written by write_run() into a new one and removes them.
+    Returns the path of the new run
+    """
+    fd, path = tempfile.mkstemp(prefix='run-', suffix='.marshal', dir=temp_dir)
+    with os.fdopen(fd, 'wb') as f:
+        chunk = []
+        for item in merge_descending([read_run(run_path) for run_path in paths]):
+            chunk.append(item)
+            if len(chunk) == CHUNK_SIZE:
+                marshal.dump(chunk, f)
+                chunk = []
+        if chunk:
+            marshal.dump(chunk, f)
+    for run_path in paths:
+        os.remove(run_path)
+    return path
+
+def read_run(path):
+    """
+    Yields the items of a run written by write_run(), one chunk in memory at a
+    time
+    """
+    with open(path, 'rb') as f:
+        while True:
+            try:
+                chunk = marshal.load(f)
+            except EOFError:
+                return
+            for item in chunk:
+                yield item
+
+def merge_descending(runs):
+    """
+    Merges iterables that are each sorted from high to low into one
+    """
+    heap = []
+    for k, run in enumerate(runs):
+        for item in run:
+            heap.append((Descending(item), k, run))
+            break
+    heapq.heapify(heap)
+    while heap:
+        wrapped, k, run = heap[0]
+        yield wrapped.item
+        for item in run:
+            heapq.heapreplace(heap, (Descending(item), k, run))
+            break
+        else:
+            heapq.heappop(heap)
+
+def sorted_descending(items, run_size=RUN_SIZE, temp_dir=None):
+    """
+    Yields items (eg. (value, key) tuples of marshallable types) from high to
+    low, as sorted(items, reverse=True), holding at most run_size of them in
+    memory: when more are given, sorted runs are spilled to temp_dir and
+    merged, MAX_RUNS at a time
+    """
+    run = []
+    paths = []
+    try:
+        for item in items:
+            run.append(item)
+            if len(run) >= run_size:
+                paths.append(write_run(run, temp_dir))
+                run = []
+        run.sort(reverse=True)
+        if not paths:
+            for item in run:
+                yield item
+            return
+        if run:
+            paths.append(write_run(run, temp_dir))
+            run = []
+        while len(paths) > MAX_RUNS:
+            paths = paths[MAX_RUNS:]+[merge_runs(paths[:MAX_RUNS], temp_dir)]
+        for item in merge_descending([read_run(path) for path in paths]):
+            yield item
+    finally:
+        for path in paths:
+            if os.path.exists(path):
+                os.remove(path)
+
+def write_ranked_list(key2value, filename, top_k=None, run_size=RUN_SIZE, format_key=None):
+    """
+    Writes file (CSV file) of rank, key and value, from the highest value to
+    the lowest (ties by key, high to low)
+
+    INPUT
+    -----
+    key2value: dict (eg. a Counter)
+    top_k: int, defaults to None
+        If given, only the top_k keys are written, picked with a heap
+    run_size: int
+        Items sorted in memory at a time (see sorted_descending()); runs are
+        spilled next to filename
+    format_key: function, defaults to None
+        Applied to each key as it is written (eg. to encode it)
+    """
+    values_keys = ((value, key) for key, value in key2value.iteritems())
+    if top_k is not None:
+        ranked = heapq.nlargest(top_k, values_keys)
+    else:
+        ranked = sorted_descending(values_keys, run_size, os.path.dirname(os.path.abspath(filename)))
+    with atomic_open(filename) as f:
+        csvwriter = csv.writer(f, delimiter=',')
+        for k,(value,key) in enumerate(ranked):
+            if format_key is not None:
+                key = format_key(key)
+            csvwriter.writerow([k,key,value])
@@ -0,0 +1,206 @@
+"""Sketches (sketches.py)
+Bounded-memory summaries of term counts for corpora whose exact counts do not
+fit in memory: a Misra-Gries summary of the heavy hitters and a count-min
+sketch for point queries, combined by HeavyHitters. All three are mergeable, so
+they can be fed per-file counts (or each other) in any order
+
+Contributors:
+Devin Gaffney & Ryan J. Gallagher
+Network Science Institute, Northeastern University, 2017
+"""
+import heapq
+import numpy as np
+
+# Mersenne prime of the count-min hash functions
+PRIME = 2**31-1
+
+class MisraGries:
+    """
+    Misra-Gries summary keeping at most size counters. Every key whose true
+    count exceeds delta is kept, and for every kept key
+        count <= true count <= count+delta
+    where delta <= (total weight)/(size+1)
+
+    Example:
+        import sketches
+        summary = sketches.MisraGries(5000)
+        summary.update_counts(file_counts)
+        summary.counts, summary.delta
+
+    Parameters
+    ----------
+    size: int
+        Maximum number of counters kept
+
+    Attributes
+    ----------
+    counts: dict (key -> int)
+        Counters of the kept keys (lower bounds of their true counts)
+
+    delta: int
+        Largest undercount of any key, kept or not
+
+    total: int
+        Total weight of the updates
+    """
+    def __init__(self, size):
+        self.size = size
+        self.counts = {}
+        self.delta = 0
+        self.total = 0
+
+    def update_counts(self, key2count):
+        """
+        Adds a dict of counts (eg. the exact counts of one tweet file) and
+        shrinks the summary back to size counters
+        """
+        counts = self.counts
+        for key, count in key2count.iteritems():
+            counts[key] = counts.get(key, 0)+count
+            self.total += count
+        self.shrink()
+
+    def update(self, key, count=1):
+        self.update_counts({key: count})
+
+    def merge(self, other):
+        """
+        Adds another summary into this one. The undercounts of both add up
+        """
+        counts = self.counts
+        for key, count in other.counts.iteritems():
+            counts[key] = counts.get(key, 0)+count
+        self.total += other.total
+        self.delta += other.delta
+        self.shrink()
+
+    def shrink(self):
+        # Subtract the (size+1)-th largest count from every counter, which
+        # leaves at most size positive ones
+        if len(self.counts) <= self.size:
+            return
+        cut = heapq.nlargest(self.size+1, self.counts.itervalues())[-1]
+        self.counts = dict([(key, count-cut) for key, count in self.counts.iteritems() if count > cut])
+        self.delta += cut
+
+class CountMinSketch:
+    """
+    Count-min sketch of depth rows of width counters. query() never
+    underestimates a count, and overestimates it by more than
+    e/width*(total weight) with probability at most exp(-depth)
+
+    Example:
+        import sketches
+        sketch = sketches.CountMinSketch(2**18, 4)
+        sketch.update_counts(file_counts)
+        sketch.query([u'#ferguson'])
+
+    Parameters
+    ----------
+    width: int
+        Counters per row
+    depth: int
+        Rows (independent hash functions)
+    seed: int
+        Seed of the hash functions. Sketches can only be merged if they share
+        width, depth and seed
+
+    Attributes
+    ----------
+    table: np.ndarray (depth x width, int64)
+    """
+    def __init__(self, width=2**18, depth=4, seed=0):
+        self.width = width
+        self.depth = depth
+        self.seed = seed
+        random = np.random.RandomState(seed)
+        self.a = random.randint(1, PRIME, size=depth).astype(np.int64)
+        self.b = random.randint(0, PRIME, size=depth).astype(np.int64)
+        self.table = np.zeros((depth, width), dtype=np.int64)
+
+    def columns(self, keys):
+        """
+        Returns the depth x len(keys) array of the counters of each key
+        """
+        hashes = np.array([hash(key) for key in keys], dtype=np.int64) % PRIME
+        return ((self.a[:, None]*hashes[None, :]+self.b[:, None]) % PRIME) % self.width
+
+    def update_counts(self, key2count):
+        items = list(key2count.iteritems())
+        if not items:
+            return
+        keys = [key for key, count in items]
+        counts = np.array([count for key, count in items], dtype=np.int64)
+        columns = self.columns(keys)
+        for row in range(self.depth):
+            np.add.at(self.table[row], columns[row], counts)
+
+    def update(self, key, count=1):
+        self.update_counts({key: count})
+
+    def merge(self, other):
+        if (self.width, self.depth, self.seed) != (other.width, other.depth, other.seed):
+            raise ValueError("Count-min sketches of different shapes or seeds cannot be merged")
+        self.table += other.table
+
+    def query(self, keys):
+        """
+        Returns the estimated counts of a list of keys, as a list of ints
+        """
+        if not keys:
+            return []
+        columns = self.columns(keys)
+        estimates = self.table[np.arange(self.depth)[:, None], columns].min(axis=0)
+        return estimates.tolist()
+
+class HeavyHitters:
+    """
+    Top keys of a stream of counts in bounded memory: a Misra-Gries summary
+    picks the keys and gives a lower bound of their counts, a count-min sketch
+    tightens the upper bound
+
+    Example:
+        import sketches
+        hh = sketches.HeavyHitters(5000)
+        for file_counts in ...:
+            hh.update_counts(file_counts)
+        for count, key, error in hh.ranked():
+            ...
+
+    Parameters
+    ----------
+    size: int, defaults to 5000
+        Counters of the Misra-Gries summary, ie. the number of keys ranked
+    width, depth: int, default to 2**18 and 4
+        Shape of the count-min sketch (memory: 8*width*depth bytes)
+    """
+    def __init__(self, size=5000, width=2**18, depth=4):
+        self.summary = MisraGries(size)
+        self.sketch = CountMinSketch(width, depth)
+
+    def update_counts(self, key2count):
+        self.summary.update_counts(key2count)
+        self.sketch.update_counts(key2count)
+
+    def merge(self, other):
+        self.summary.merge(other.summary)
+        self.sketch.merge(other.sketch)
+
+    def ranked(self):
+        """
+        Returns (count, key, error) for each kept key, highest count first (ties
+        by key, high to low, as in the exact ranked lists). count is an upper
+        bound of the true count and error how much it may overestimate it:
+            count-error <= true count <= count
+        When fewer distinct keys than size were seen, the counts are exact and
+        every error is 0
+        """
+        keys = self.summary.counts.keys()
+        estimates = self.sketch.query(keys)
+        ranked = []
+        for key, estimate in zip(keys, estimates):
+            lower = self.summary.counts[key]
+            upper = min(lower+self.summary.delta, estimate)
+            ranked.append((upper, key, upper-lower))
+        ranked.sort(key=lambda row: (row[0], row[1]), reverse=True)
+        return ranked
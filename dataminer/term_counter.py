@@ -13,13 +13,25 @@ import csv
 import json
 from datetime import datetime
 from collections import Counter
+import corpus_store
+import corpus_io
 
 from nltk.corpus import stopwords
-from ttp import ttp
-stop_words = stopwords.words('english')
+import entity_parser
+import tweet_cache
+import parallel
+import sketches
+import ngram_counter
+import multi_matcher
+import ranked_writer
+import checkpoint
+stop_words = frozenset(stopwords.words('english'))
 from string import punctuation
 exclude = set(punctuation)
 exclude.remove('#')
+# Tables for deleting the excluded punctuation from unicode and byte strings
+exclude_table = dict([(ord(char), None) for char in exclude])
+exclude_chars = ''.join(exclude)
 from nltk.tokenize import TweetTokenizer
 tknzr = TweetTokenizer(preserve_case=False,strip_handles=True,reduce_len=False)
 import codecs
@@ -41,32 +53,52 @@ class TermCounter:
         Directory to build a directory of output files containing ranked lists
         of terms. If None, uses the user's current working directory
 
+    cache: tweet_cache.TweetCache, defaults to None
+        Cache of the tokens, entities and top term matches of each text, which
+        can be shared with a NetworkAnalyzer. A new one is made if None
+
     Attributes
     ----------
     reduced_data: boolean
         True if working with tweets from summarized CSV file. False if working
         with the full JSON data.
+
+    store: corpus_store.CorpusStore
+        Columnar store of the tweets, read instead of the tweet files when it
+        exists and is up to date (None otherwise)
     """
 
-    def __init__(self, tweet_dir, working_dir=None):
+    # Fields of full (JSON) tweets read by the analyses (see corpus_io.py)
+    json_fields = ['text', 'extended_tweet.full_text', 'user.screen_name']
+    # Columns of reduced tweets read by the analyses
+    reduced_columns = (corpus_io.TEXT, corpus_io.SCREEN_NAME)
+
+    def __init__(self, tweet_dir, working_dir=None, cache=None):
         self.tweet_dir = tweet_dir
+        if cache is None:
+            self.cache = tweet_cache.TweetCache()
+        else:
+            self.cache = cache
         if working_dir is None:
             self.working_dir = os.getcwd()
         else:
             self.working_dir = working_dir
         if 'reduced' in self.tweet_dir:
             self.reduced_data = True
+            self.store = corpus_store.open_corpus_store(self.tweet_dir)
         else:
             self.reduced_data = False
+            self.store = None
 
     def get_counts(self):
         output_dir = self.working_dir+'/term_counts'
         counts = {}
         for key in ["terms", "hashtags", "mentions", "urls"]:
-            counts[key] = len([r for r in self.a_most_dirty_hand(csv.reader(open(output_dir+"/"+key+".csv"), delimiter=','))])
+            with open(output_dir+"/"+key+".csv") as f:
+                counts[key] = sum([1 for line in f])
         return counts
 
-    def get_ranked_terms(self, max_n=1):
+    def get_ranked_terms(self, max_n=1, n_workers=1, top_k=None, sketch_width=2**18, sketch_depth=4, incremental=False):
         """
         Gets the top terms (currently: hashtags, unigrams) from a set
         of tweets
@@ -74,7 +106,22 @@ class TermCounter:
         INPUT
         -----
         max_n: int
-            Integer specifiying max n-grams to retrieve
+            Integer specifiying max n-grams to retrieve. The n-grams of the
+            tokens of clean_tweet() are counted for 2 <= n <= max_n and written
+            to 2grams.csv, 3grams.csv, ... (see ngram_counter.py)
+        n_workers: int
+            Number of processes counting tweet files at the same time. With
+            more than one, the per-file counts are merged by parallel.py
+        top_k: int, defaults to None
+            If given, only the top_k terms of each list are kept, in bounded
+            memory (see get_heavy_hitters()), rather than exact counts of
+            every term
+        sketch_width, sketch_depth: int
+            Shape of the count-min sketches of the top_k mode
+        incremental: boolean, defaults to False
+            If True, the counts of each file are kept with a manifest of the
+            tweet files in term_counts/.checkpoint (see checkpoint.py), and
+            only new or changed files are counted (exact counts only)
 
         OUTPUT
         ------
@@ -82,126 +129,265 @@ class TermCounter:
         """
         # List out tweet files
         tweet_files = os.listdir(self.tweet_dir)
-        # Get hashtags and unigram counts from each file
-        final_counts = {'terms': Counter(), 'hashtags': Counter(), 'mentions': Counter(), 'urls': Counter()}
-        for filename in tweet_files:
-            print filename
-            file_counts = self.get_terms_from_file(filename, max_n)
-            for key in file_counts.keys():
-                final_counts[key].update(file_counts[key])
+        if top_k is not None:
+            heavy_hitters = self.get_heavy_hitters(tweet_files, max_n, n_workers, top_k, sketch_width, sketch_depth)
+            self.write_heavy_hitters(heavy_hitters)
+            return
+        # Get hashtags and n-gram counts from each file
+        final_counts = self.new_term_counts(max_n)
+        if incremental:
+            manifest = checkpoint.Manifest(self.working_dir+'/term_counts', 'terms',
+                                           {'max_n': max_n, 'reduced_data': self.reduced_data})
+            counts = manifest.run(self, tweet_files, 'get_terms_from_file', (max_n,), n_workers)
+            for key in counts.keys():
+                final_counts[key].update(counts[key])
+        elif n_workers > 1:
+            counts = parallel.map_reduce(TermCounter, (self.tweet_dir, self.working_dir), 'get_terms_from_file',
+                                         tweet_files, (max_n,), n_workers)
+            for key in counts.keys():
+                final_counts[key].update(counts[key])
+        else:
+            for filename in tweet_files:
+                print filename
+                file_counts = self.get_terms_from_file(filename, max_n)
+                for key in file_counts.keys():
+                    final_counts[key].update(file_counts[key])
+            print self.cache.summary()
         # Output ranked counts to files
+        self.write_ranked_terms(final_counts)
+
+    def get_heavy_hitters(self, tweet_files, max_n, n_workers, top_k, sketch_width=2**18, sketch_depth=4):
+        """
+        Counts the terms of each tweet file exactly, then folds the file's
+        counts into one sketches.HeavyHitters per list, so that memory is
+        bounded by the largest file and the size of the summaries rather than
+        by the vocabulary of the whole corpus
+
+        OUTPUT
+        ------
+        heavy_hitters, dict of sketches.HeavyHitters
+            Summaries of terms, hashtags, mentions and urls
+        """
+        heavy_hitters = self.new_heavy_hitters(top_k, sketch_width, sketch_depth, max_n)
+        if n_workers > 1:
+            file_counts = parallel.map_files(TermCounter, (self.tweet_dir, self.working_dir), 'get_terms_from_file',
+                                             tweet_files, (max_n,), n_workers)
+        else:
+            file_counts = (self.get_terms_from_file(filename, max_n) for filename in tweet_files)
+        for counts in file_counts:
+            for key in counts.keys():
+                heavy_hitters[key].update_counts(counts[key])
+        return heavy_hitters
+
+    def new_heavy_hitters(self, top_k, sketch_width=2**18, sketch_depth=4, max_n=1):
+        return dict([(key, sketches.HeavyHitters(top_k, sketch_width, sketch_depth))
+                     for key in self.new_term_counts(max_n).keys()])
+
+    def write_heavy_hitters(self, heavy_hitters):
+        """
+        Writes the ranked list of each summary made by new_heavy_hitters()
+        into the term_counts output directory, as rank, term, count and error
+        (the true count is between count-error and count)
+        """
+        output_dir = self.working_dir+'/term_counts'
+        try:
+            os.makedirs(output_dir)
+        except:
+            print "File '"+output_dir+"' exists"
+        for key in heavy_hitters.keys():
+            with ranked_writer.atomic_open(output_dir+'/'+key+'.csv') as f:
+                csvwriter = csv.writer(f, delimiter=',')
+                for k,(value,term,error) in enumerate(heavy_hitters[key].ranked()):
+                    csvwriter.writerow([k,unicode(term).encode("utf-8"),value,error])
+
+    def write_ranked_terms(self, final_counts, top_k=None):
+        """
+        Writes one ranked list per key of the counts returned by
+        get_terms_from_file() into the term_counts output directory (only the
+        top_k terms of each if given)
+        """
         output_dir = self.working_dir+'/term_counts'
         try:
             os.makedirs(output_dir)
         except:
             print "File '"+output_dir+"' exists"
         for key in final_counts.keys():
-            self.write_ranked_list(final_counts[key], output_dir+'/'+key+'.csv')
+            if isinstance(final_counts[key], ngram_counter.NgramCounter):
+                self.write_ranked_ngrams(final_counts[key], output_dir+'/'+key+'.csv', top_k)
+            else:
+                self.write_ranked_list(final_counts[key], output_dir+'/'+key+'.csv', top_k)
 
     def get_terms_from_file(self, filename, max_n):
         """
         Extracts counts of terms and hashtags for all tweets in a tweet file.
-        File currently extracts unigrams, as preprocessed by clean_tweet()
+        File currently extracts unigrams, as preprocessed by clean_tweet(),
+        and their n-grams up to max_n
 
         OUTPUT
         ------
-        term2count and hashtag2count, Counters
-            Counter objects for terms and hashtags found in the file's tweets
+        counts, dict of Counters
+            Counter objects for terms, hashtags, mentions and urls found in
+            the file's tweets, and NgramCounters for 2grams, 3grams, ...,
+            keyed by their output file name
 
         NOTE: term2count will include hashtags. However, there are instances
         where a hashtag does not fully appear in text (cut off for some reason?),
         but it fully appears in the hashtag field
         """
-        term2count = Counter()
-        hashtag2count = Counter()
-        mention2count = Counter()
-        url2count = Counter()
+        counts = self.new_term_counts(max_n)
         null_rows = 0
         # Get hashtags and raw tweet text
         # this is kinda weird, you pass the filename to this func but assume where it is under tweet dir...
         # wrap the first part as a function (for use with get_full_text()) using f.open() and f.close() instead?
-        with open(self.tweet_dir+'/'+filename, 'rb') as f:
-            # Open the file differently based on CSV or JSON
-            if self.reduced_data is True:
-                tweet_file = self.a_most_dirty_hand(csv.reader(f, delimiter='\t'))
-            else:
-                tweet_file = f
-            # Read through each line of the file and update Counters
-            for tweet in tweet_file:
-                try:
-                    if self.reduced_data is True:
-                        text = unicode(tweet[9], 'utf-8')
-                    else:
-                        tweet = json.loads(line)
-                        text = unicode(tweet['text'], 'utf-8')
-                    # Clean tweet text
-                    clean_text = self.clean_tweet(text)
-                    term2count.update(clean_text)
-                    # Update Counters
-                    hashtag2count.update(self.hashtags(text))
-                    mention2count.update(self.mentions(text))
-                    url2count.update(self.urls(text))
-                except:
-                    print "Null row."
-                    null_rows += 1
+        # Read through each line of the file and update Counters
+        for tweet in corpus_store.read_rows(self.tweet_dir, filename, self.reduced_data, self.store, self.json_fields,
+                                             columns=self.reduced_columns):
+            try:
+                self.count_tweet(tweet, counts)
+            except:
+                print "Null row."
+                null_rows += 1
         print str(null_rows)+" null rows encountered"
-        return {'terms': term2count, 'hashtags': hashtag2count, 'mentions': mention2count, 'urls': url2count}
+        return counts
+
+    def new_term_counts(self, max_n=1):
+        counts = {'terms': Counter(), 'hashtags': Counter(), 'mentions': Counter(), 'urls': Counter()}
+        # The n-gram counters share one vocabulary of token ids
+        vocabulary = ngram_counter.Vocabulary()
+        for n in range(2, max_n+1):
+            counts[str(n)+'grams'] = ngram_counter.NgramCounter(n, vocabulary)
+        return counts
+
+    def count_tweet(self, tweet, counts):
+        """
+        Updates the Counters made by new_term_counts() with the terms,
+        hashtags, mentions and urls of a single row of a tweet file
+        """
+        if self.reduced_data is True:
+            text = tweet[9]
+        else:
+            text = corpus_io.tweet_text(tweet)
+        # Clean tweet text (cached, as retweets repeat the same text)
+        clean_text = self.cache.tokens(text, self.clean_tweet)
+        counts['terms'].update(clean_text)
+        if '2grams' in counts:
+            ids = counts['2grams'].vocabulary.ids(clean_text)
+            n = 2
+            while str(n)+'grams' in counts:
+                counts[str(n)+'grams'].add(ids)
+                n += 1
+        # Update Counters, from a single parse of the text
+        entities = self.cache.entities(text)
+        counts['hashtags'].update(entities.hashtags)
+        counts['mentions'].update(entities.mentions)
+        counts['urls'].update(entities.urls)
 
     def tweets_matching_tokens(self, top_count=20, types=["hashtags"], include_user_if_user_mentions=False):
-        if "term_counts" in os.listdir(self.working_dir) and len(set(types)&set([el.replace(".csv", "") for el in os.listdir(self.working_dir+"/term_counts")])) == len(types):
-            term_counts = Counter()
-            for key in types:
-                with open(self.working_dir+'/term_counts/'+key+'.csv', 'rb') as f:
-                    reader = csv.reader(f)
-                    for row in reader:
-                        if row[1] not in term_counts.keys():
-                            term_counts[row[1]] = int(row[2])
-                        else:
-                            term_counts[row[1]] += int(row[2])
-            top_terms = [el[0] for el in term_counts.most_common(top_count)]
+        """
+        Writes every tweet containing any of the top terms (or, with
+        include_user_if_user_mentions, posted by a top user) once to the
+        top_term_tweets output directory, as the tweet files are read
+
+        The top terms are matched with one Aho-Corasick automaton, so a tweet
+        costs about the same however many terms there are
+        """
+        top_terms = self.get_top_terms(top_count, types)
+        if top_terms is not None:
+            matcher = self.top_term_matcher(top_terms)
             tweet_files = os.listdir(self.tweet_dir)
             # Search through tweet files
-            corpus = []
-            for filename in tweet_files:
-                print filename
-                with open(self.tweet_dir+'/'+filename, 'rb') as f:
-                    # Open the file differently based on CSV or JSON
-                    if self.reduced_data is True:
-                        tweet_file = self.a_most_dirty_hand(csv.reader(f, delimiter='\t'))
-                    else:
-                        tweet_file = f
-                    # Read through each line of the file and update Counters
-                    for tweet in tweet_file:
+            null_rows = 0
+            n_matches = 0
+            with self.open_top_term_tweets(include_user_if_user_mentions) as f:
+                csvwriter = csv.writer(f, delimiter=',')
+                for filename in tweet_files:
+                    print filename
+                    # Whole rows are written out, so read the tweet files
+                    # rather than the columnar store
+                    for tweet in corpus_store.read_rows(self.tweet_dir, filename, self.reduced_data, None, self.json_fields, True,
+                                                             self.reduced_columns):
                         try:
-                            if self.reduced_data is True:
-                                text = unicode(tweet[9], 'utf-8')
-                                screen_name = tweet[-1]
-                            else:
-                                tweet = json.loads(line)
-                                text = unicode(tweet['text'], 'utf-8')
-                                screen_name = tweet['screen_name']
-                            for term in top_terms:
-                                if term in text or (include_user_if_user_mentions == True and term == tweet[-1]):
-                                    corpus.append(tweet)
+                            if self.matches_top_terms(tweet, matcher, top_terms, include_user_if_user_mentions):
+                                csvwriter.writerow(self.top_term_row(tweet))
+                                n_matches += 1
                         except:
                             print "Null row."
                             null_rows += 1
-            output_dir = self.working_dir+'/top_term_tweets'
-            try:
-                os.makedirs(output_dir)
-            except:
-                print "File '"+output_dir+"' exists"
-            if include_user_if_user_mentions == True:
-                filename = output_dir+"/top_mentioned_users_timeline.csv"
-            else:
-                filename = output_dir+"/top_term_tweets.csv"
-            with open(filename, 'a') as f:
-                csvwriter = csv.writer(f, delimiter=',')
-                csvwriter.writerows(corpus)
+            print str(n_matches)+" tweets matching the top terms"
+            print self.cache.summary()
         else:
             print "Cannot run this until you've run get_ranked_terms to generate term counts!!"
             sys.exit()
 
+    def get_top_terms(self, top_count=20, types=["hashtags"]):
+        """
+        Reads the ranked lists written by get_ranked_terms() and returns the
+        top_count terms across the given types, or None if the ranked lists
+        have not been written yet
+        """
+        if "term_counts" in os.listdir(self.working_dir) and len(set(types)&set([el.replace(".csv", "") for el in os.listdir(self.working_dir+"/term_counts")])) == len(types):
+            term_counts = Counter()
+            for key in types:
+                with open(self.working_dir+'/term_counts/'+key+'.csv', 'rb') as f:
+                    reader = csv.reader(f)
+                    for row in reader:
+                        term_counts[row[1]] += int(row[2])
+            return [el[0] for el in term_counts.most_common(top_count)]
+
+    def top_term_matcher(self, top_terms):
+        """
+        Returns the automaton finding the top terms (as returned by
+        get_top_terms()) in unicode tweet text
+        """
+        matcher = multi_matcher.AhoCorasick()
+        for term in top_terms:
+            matcher.add(unicode(term, 'utf-8'))
+        matcher.build()
+        return matcher
+
+    def matches_top_terms(self, tweet, matcher, top_terms, include_user_if_user_mentions=False):
+        """
+        Returns True if the text of a single row of a tweet file contains any
+        of the top terms of matcher, or if include_user_if_user_mentions and
+        the tweet was posted by one of them
+        """
+        if self.reduced_data is True:
+            text = tweet[9]
+            screen_name = tweet[-1]
+        else:
+            text = corpus_io.tweet_text(tweet)
+            screen_name = tweet['user.screen_name']
+        if include_user_if_user_mentions == True and screen_name in top_terms:
+            return True
+        # The terms found in a text are cached per matcher, as retweets repeat
+        # the same text
+        return len(self.cache.get(text, ('top_terms', matcher), matcher.search)) > 0
+
+    def top_term_row(self, tweet):
+        """
+        Returns the CSV row written for a matching tweet: the row itself (with
+        its text encoded back to UTF-8) for reduced data, the JSON line as a
+        single column for full data
+        """
+        if self.reduced_data is True:
+            return tweet[:9]+[tweet[9].encode('utf-8')]+tweet[10:]
+        return [tweet[corpus_io.LINE].rstrip('\n')]
+
+    def open_top_term_tweets(self, include_user_if_user_mentions=False):
+        """
+        Opens (truncates) the output file of tweets_matching_tokens()
+        """
+        output_dir = self.working_dir+'/top_term_tweets'
+        try:
+            os.makedirs(output_dir)
+        except:
+            print "File '"+output_dir+"' exists"
+        if include_user_if_user_mentions == True:
+            filename = output_dir+"/top_mentioned_users_timeline.csv"
+        else:
+            filename = output_dir+"/top_term_tweets.csv"
+        return open(filename, 'w')
+
     # --------------------------------------------------------------------------
     # ---------------------------- Helper functions ----------------------------
     # --------------------------------------------------------------------------
@@ -216,7 +402,10 @@ class TermCounter:
         3. Remove stop words from tweet (NLTK stop word list)
         4. Remove punctuation from tweet, except hashtag (#) symbol
 
-        TODO: this func doesn't play well with wanting to get n-grams or phrases
+        N-grams are counted over the returned list, ie. across removed stop
+        words and links (see get_ranked_terms(max_n=...))
+
+        TODO: this func doesn't play well with wanting to get phrases
 
         OUTPUT
         ------
@@ -231,14 +420,16 @@ class TermCounter:
                         and (gram not in stop_words)]
         # Join text to one string, remove punctuation, join back to list
         text = ' '.join(filtered_text)
-        text_chars_noPunct = [char for char in text if char not in exclude]
-        text_noPunct = "".join(text_chars_noPunct)
+        if isinstance(text, unicode):
+            text_noPunct = text.translate(exclude_table)
+        else:
+            text_noPunct = text.translate(None, exclude_chars)
         # Split back to list of words
         cleaned_text = text_noPunct.strip().split()
         return cleaned_text
 
     def parse(self, text):
-        return ttp.Parser().parse(text)
+        return entity_parser.default_parser.parse(text)
 
     def hashtags(self, text):
         return self.parse(text).tags
@@ -249,26 +440,24 @@ class TermCounter:
     def urls(self, text):
         return self.parse(text).urls
 
-    def write_ranked_list(self, key2value, filename):
+    def write_ranked_ngrams(self, ngrams, filename, top_k=None):
         """
-        Expects a dict where values are counts
-        Writes file (CSV file) of terms, counts, and rank
+        Writes the ranked list of an ngram_counter.NgramCounter as
+        write_ranked_list() does, decoding the n-grams of each count as it is
+        reached (see NgramCounter.ranked())
         """
-        # Dict -> sorted list of (value, key) pairs in high->low order
-        values_keys = [(key2value[key], key) for key in key2value.keys()]
-        values_keys.sort(reverse = True)
-        # Write ranks, keys, and values, to file
-        with open(filename, 'a') as f:
+        with ranked_writer.atomic_open(filename) as f:
             csvwriter = csv.writer(f, delimiter=',')
-            for k,(value,key) in enumerate(values_keys):
-                csvwriter.writerow([k,unicode(key).encode("utf-8"),value])
-    
-    def a_most_dirty_hand(self, csv_reader):
-        while True:
-            try:
-                yield next(csv_reader)
-            except csv.Error:
-                # error handling what you want.
-                pass
-            continue
-        return
+            for k,(value,ngram) in enumerate(ngrams.ranked(temp_dir=os.path.dirname(os.path.abspath(filename)))):
+                if k == top_k:
+                    break
+                csvwriter.writerow([k,ngram.encode("utf-8"),value])
+
+    def write_ranked_list(self, key2value, filename, top_k=None):
+        """
+        Expects a dict where values are counts
+        Writes file (CSV file) of terms, counts, and rank, replacing any
+        earlier one. Lists larger than memory are sorted in runs on disk (see
+        ranked_writer.py); only the top_k terms are written if given
+        """
+        ranked_writer.write_ranked_list(key2value, filename, top_k, format_key=lambda key: unicode(key).encode("utf-8"))
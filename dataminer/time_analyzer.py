@@ -8,11 +8,149 @@ Network Science Institute, Northeastern University, 2017
 """
 
 import os
+import re
 import csv
 import json
+import calendar
+from array import array
 from collections import Counter
 from dateutil import parser
 import datetime
+import numpy as np
+import corpus_store
+import corpus_io
+import checkpoint
+
+# Gardenhose timestamp formats: Twitter's created_at ("Sat Aug 01 10:45:00
+# +0000 2015") and ISO 8601 ("2015-08-01 10:45:00", "2015-08-01T10:45:00Z")
+twitter_time_re = re.compile(r'^\w{3} (\w{3}) (\d\d) (\d\d):(\d\d):(\d\d) ([+-])(\d\d)(\d\d) (\d{4})$')
+iso_time_re = re.compile(r'^(\d{4})-(\d\d)-(\d\d)[T ](\d\d):(\d\d):(\d\d)(?:\.\d+)?(?:Z|([+-])(\d\d):?(\d\d))?$')
+months = dict([(name, k+1) for k, name in enumerate(['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec'])])
+epoch_ordinal = datetime.date(1970, 1, 1).toordinal()
+
+# Bucket sizes of the granularities that are plain integer divisions of epoch
+# seconds. Weeks start on Monday (the epoch was a Thursday)
+bucket_seconds = {'minute': 60, 'hour': 3600, 'day': 86400, 'week': 7*86400}
+week_offset = 3*86400
+# Labels of the named granularities; any other granularity is a strftime format
+granularity_formats = {'minute': "%Y-%m-%d %H:%M", 'hour': "%Y-%m-%d %H", 'day': "%Y-%m-%d", 'week': "%Y-%m-%d", 'month': "%Y-%m", 'year': "%Y"}
+
+def epoch_seconds(year, month, day, hour, minute, second, offset=0):
+    return (datetime.date(year, month, day).toordinal()-epoch_ordinal)*86400+hour*3600+minute*60+second-offset
+
+def parse_timestamp(timestamp):
+    """
+    Returns the seconds since the epoch (UTC) of a tweet timestamp. The
+    Twitter and ISO formats of the Gardenhose are parsed directly, anything
+    else with dateutil. Ints (eg. from the columnar store) are returned as is
+
+    OUTPUT
+    ------
+    seconds, int
+        Raises an error if the timestamp cannot be parsed
+    """
+    if isinstance(timestamp, (int, long)):
+        return timestamp
+    match = twitter_time_re.match(timestamp)
+    if match is not None and match.group(1) in months:
+        month, day, hour, minute, second, sign, offset_hours, offset_minutes, year = match.groups()
+        offset = int(offset_hours)*3600+int(offset_minutes)*60
+        if sign == '-':
+            offset = -offset
+        return epoch_seconds(int(year), months[month], int(day), int(hour), int(minute), int(second), offset)
+    match = iso_time_re.match(timestamp)
+    if match is not None:
+        year, month, day, hour, minute, second, sign, offset_hours, offset_minutes = match.groups()
+        offset = 0
+        if sign is not None:
+            offset = int(offset_hours)*3600+int(offset_minutes)*60
+            if sign == '-':
+                offset = -offset
+        return epoch_seconds(int(year), int(month), int(day), int(hour), int(minute), int(second), offset)
+    return calendar.timegm(parser.parse(timestamp).utctimetuple())
+
+def bucket_timestamps(timestamps, granularity="day"):
+    """
+    Counts epoch seconds per time bucket, including the empty buckets between
+    the first and the last one
+
+    INPUT
+    -----
+    timestamps: np.ndarray (int64)
+        Seconds since the epoch (UTC)
+    granularity: string, defaults to "day"
+        "minute", "hour", "day", "week" (starting on Monday), "month", "year"
+        or a strftime format (eg. "%Y-%m-%d %H:%M"), in which case tweets are
+        binned at the finest unit of the format and bins with the same label
+        (eg. every day's 10 o'clock for "%H") are added up
+
+    OUTPUT
+    ------
+    labels, list of strings
+        Label of each bucket, in time order (label order when bins were added
+        up)
+    counts, np.ndarray (int64)
+        Tweets per bucket
+    """
+    timestamps = np.asarray(timestamps, dtype=np.int64)
+    if len(timestamps) == 0:
+        return [], np.zeros(0, dtype=np.int64)
+    time_format = granularity_formats.get(granularity, granularity)
+    unit = granularity
+    if granularity not in granularity_formats:
+        unit = format_unit(time_format)
+    if unit in bucket_seconds:
+        offset = week_offset if unit == 'week' else 0
+        bins = (timestamps+offset)//bucket_seconds[unit]
+        first = bins.min()
+        starts = np.arange(first, bins.max()+1)*bucket_seconds[unit]-offset
+    elif unit == 'second':
+        bins = timestamps
+        first = bins.min()
+        starts = np.arange(first, bins.max()+1)
+    else:
+        numpy_unit = {'month': 'M', 'year': 'Y'}[unit]
+        bins = timestamps.astype('datetime64[s]').astype('datetime64['+numpy_unit+']').astype(np.int64)
+        first = bins.min()
+        starts = np.arange(first, bins.max()+1).astype('datetime64['+numpy_unit+']').astype('datetime64[s]').astype(np.int64)
+    counts = np.bincount(bins-first)
+    labels = [datetime.datetime.utcfromtimestamp(start).strftime(time_format) for start in starts.tolist()]
+    if len(set(labels)) < len(labels):
+        label2count = Counter()
+        for label, count in zip(labels, counts.tolist()):
+            label2count[label] += count
+        labels = sorted(label2count.keys())
+        counts = np.array([label2count[label] for label in labels], dtype=np.int64)
+    return labels, counts.astype(np.int64)
+
+def bucket_id(timestamp, granularity="day"):
+    """
+    Returns the index of the bucket of epoch seconds at a granularity of fixed
+    length ("minute", "hour", "day" or "week"), counted from the epoch
+    """
+    if granularity not in bucket_seconds:
+        raise ValueError("Granularity must be one of "+", ".join(sorted(bucket_seconds.keys()))+", not "+granularity)
+    offset = week_offset if granularity == 'week' else 0
+    return (timestamp+offset)//bucket_seconds[granularity]
+
+def bucket_label(bucket, granularity="day"):
+    """
+    Returns the label of a bucket index of bucket_id(), as in
+    bucket_timestamps()
+    """
+    offset = week_offset if granularity == 'week' else 0
+    start = bucket*bucket_seconds[granularity]-offset
+    return datetime.datetime.utcfromtimestamp(start).strftime(granularity_formats[granularity])
+
+def format_unit(time_format):
+    """
+    Returns the finest unit of a strftime format
+    """
+    directives = set(re.findall(r'%(.)', time_format))
+    for unit, unit_directives in [('second', 'ScTX'), ('minute', 'MR'), ('hour', 'HIpk'), ('day', 'dejaAwxDuUVWGg'), ('month', 'mbBh')]:
+        if directives & set(unit_directives):
+            return unit
+    return 'year'
 
 class TimeAnalyzer:
     """
@@ -36,7 +174,16 @@ class TimeAnalyzer:
     reduced_data: boolean
         True if working with tweets from summarized CSV file. False if working
         with the full JSON data.
+
+    store: corpus_store.CorpusStore
+        Columnar store of the tweets, read instead of the tweet files when it
+        exists and is up to date (None otherwise)
     """
+    # Fields of full (JSON) tweets read by the analyses (see corpus_io.py)
+    json_fields = ['created_at']
+    # Columns of reduced tweets read by the analyses
+    reduced_columns = (corpus_io.CREATED_AT,)
+
     def __init__(self, tweet_dir, working_dir=None):
         self.tweet_dir = tweet_dir
         self.got_top_terms = False
@@ -46,73 +193,117 @@ class TimeAnalyzer:
             self.working_dir = working_dir
         if 'reduced' in self.tweet_dir:
             self.reduced_data = True
+            self.store = corpus_store.open_corpus_store(self.tweet_dir)
         else:
             self.reduced_data = False
+            self.store = None
     
-    def get_timeline(self):
+    def get_timestamps(self, incremental=False):
+        """
+        Returns the timestamps of all tweets, in seconds since the epoch (UTC),
+        as an np.ndarray (int64). Rows of the columnar store are read a whole
+        file at a time
+
+        INPUT
+        -----
+        incremental: boolean, defaults to False
+            If True, the tweets per second of each file are kept with a
+            manifest of the tweet files in timelines/.checkpoint (see
+            checkpoint.py), and only new or changed files are read. The
+            timestamps are then returned in time order
+        """
         # List out tweet files
         tweet_files = os.listdir(self.tweet_dir)
-        null_rows = 0
-        # Get edges from each tweet file
-        timeline = Counter()
-        for filename in tweet_files:
-            with open(self.tweet_dir+'/'+filename, 'rb') as f:
-                # Open the file differently based on CSV or JSON
-                if self.reduced_data is True:
-                    tweet_file = self.a_most_dirty_hand(csv.reader(f, delimiter='\t'))
-                else:
-                    tweet_file = f
-                # Read through each line of the file and update Counters
-                for tweet in tweet_file:
-                    try:
-                        if self.reduced_data is True:
-                            timeline.update([parser.parse(tweet[2]).strftime("%Y-%m-%d")])
-                        else:
-                            tweet = json.loads(line)
-                            timeline.update([parser.parse(tweet["created_at"]).strftime("%Y-%m-%d")])
-                    except:
-                        print "Null row."
-                        null_rows += 1
-        return timeline
-
-    def write_timelines(self):
-        timeline = self.get_timeline()
-        earliest = sorted(timeline.keys())[0]
-        latest = sorted(timeline.keys())[-1]
-        time_cursor = parser.parse(earliest)
-        end_time = parser.parse(latest)
-        cumulative = []
-        spiked = []
-        cumulative_count = 0
-        while time_cursor <= end_time:
-            time_str = time_cursor.strftime("%Y-%m-%d")
-            this_count = 0
-            if time_str in timeline.keys():
-                cumulative_count += timeline[time_str]
-                this_count = timeline[time_str]
-            cumulative.append([time_str, cumulative_count])
-            spiked.append([time_str, this_count])
-            time_cursor = time_cursor+datetime.timedelta(days=1)
+        if incremental:
+            manifest = checkpoint.Manifest(self.working_dir+'/timelines', 'timestamps', {'reduced_data': self.reduced_data})
+            second2count = manifest.run(self, tweet_files, 'get_timestamp_counts_from_file')
+            seconds = np.array(sorted(second2count.keys()), dtype=np.int64)
+            counts = np.array([second2count[second] for second in seconds.tolist()], dtype=np.int64)
+            return np.repeat(seconds, counts)
+        timestamps = [self.get_timestamps_from_file(filename) for filename in tweet_files]
+        if not timestamps:
+            return np.zeros(0, dtype=np.int64)
+        return np.concatenate(timestamps)
+
+    def get_timestamps_from_file(self, filename):
+        """
+        Returns the timestamps of the tweets of one file as an np.ndarray
+        (int64), skipping rows without one
+        """
+        if self.store is not None:
+            first_row, end_row = self.store.file_rows[filename]
+            created_at = np.asarray(self.store.created_at[first_row:end_row])
+            return created_at[created_at != corpus_store.NULL_TIME]
+        # Read through each line of the file and collect timestamps
+        file_timestamps = array('l')
+        for tweet in corpus_store.read_rows(self.tweet_dir, filename, self.reduced_data, None, self.json_fields,
+                                             columns=self.reduced_columns):
+            try:
+                self.update_timeline(tweet, file_timestamps)
+            except:
+                print "Null row."
+        return np.frombuffer(file_timestamps, dtype=np.int64)
+
+    def get_timestamp_counts_from_file(self, filename):
+        """
+        Returns the tweets of one file per second, as a dict (epoch seconds
+        -> count)
+        """
+        seconds, counts = np.unique(self.get_timestamps_from_file(filename), return_counts=True)
+        return dict(zip(seconds.tolist(), counts.tolist()))
+
+    def get_timeline(self, granularity="day", incremental=False):
+        """
+        Returns a Counter of the tweets per time bucket (see
+        bucket_timestamps())
+        """
+        labels, counts = bucket_timestamps(self.get_timestamps(incremental), granularity)
+        return Counter(dict(zip(labels, counts.tolist())))
+
+    def update_timeline(self, tweet, timeline):
+        """
+        Appends the timestamp (epoch seconds) of a single row of a tweet file
+        to timeline, an array('l')
+        """
+        if self.reduced_data is True:
+            timeline.append(parse_timestamp(tweet[2]))
+        else:
+            timeline.append(parse_timestamp(tweet["created_at"]))
+
+    def write_timelines(self, timeline=None, granularity="day", incremental=False):
+        """
+        Writes the spiked (tweets per bucket) and cumulative timelines. Day
+        timelines are spiked.csv and cumulative.csv; other granularities get
+        their name (or the letters of their strftime format) as a suffix, eg.
+        spiked-hour.csv
+
+        INPUT
+        -----
+        timeline: array or np.ndarray of epoch seconds, defaults to None
+            Timestamps of the tweets, read with get_timestamps() if None
+        granularity: string, defaults to "day"
+            See bucket_timestamps()
+        incremental: boolean, defaults to False
+            See get_timestamps()
+        """
+        if timeline is None:
+            timeline = self.get_timestamps(incremental)
+        elif isinstance(timeline, array):
+            timeline = np.frombuffer(timeline, dtype=np.int64)
+        labels, spiked = bucket_timestamps(timeline, granularity)
+        cumulative = np.cumsum(spiked)
         try:
             os.makedirs(self.working_dir+'/timelines')
         except:
             print "File '"+self.working_dir+'/timelines'+"' exists"
-        spiked_filename = self.working_dir+'/timelines'+"/spiked.csv"
-        cumulative_filename = self.working_dir+'/timelines'+"/cumulative.csv"
+        suffix = ""
+        if granularity != "day":
+            suffix = "-"+re.sub(r'[^0-9A-Za-z]', '', granularity)
+        spiked_filename = self.working_dir+'/timelines'+"/spiked"+suffix+".csv"
+        cumulative_filename = self.working_dir+'/timelines'+"/cumulative"+suffix+".csv"
         with open(spiked_filename, 'w') as f:
             csvwriter = csv.writer(f, delimiter=',')
-            csvwriter.writerows(spiked)
+            csvwriter.writerows(zip(labels, spiked.tolist()))
         with open(cumulative_filename, 'w') as f:
             csvwriter = csv.writer(f, delimiter=',')
-            csvwriter.writerows(cumulative)
-
-        
-    def a_most_dirty_hand(self, csv_reader):
-        while True:
-            try:
-                yield next(csv_reader)
-            except csv.Error:
-                # error handling what you want.
-                pass
-            continue
-        return
+            csvwriter.writerows(zip(labels, cumulative.tolist()))
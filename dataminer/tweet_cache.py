@@ -0,0 +1,103 @@
+"""Tweet Cache (tweet_cache.py)
+Bounded memoization of per-text results (cleaned tokens, entities, top term
+matches), keyed on a hash of the tweet text. Retweets repeat the same text
+verbatim, so on retweet-heavy corpora most texts are tokenized and parsed only
+once
+
+Contributors:
+Devin Gaffney & Ryan J. Gallagher
+Network Science Institute, Northeastern University, 2017
+"""
+import hashlib
+from collections import OrderedDict
+import entity_parser
+
+class TweetCache:
+    """
+    Least recently used cache of the results computed from tweet texts
+
+    Example:
+        import tweet_cache
+        cache = tweet_cache.TweetCache(max_size=200000)
+        tc = term_counter.TermCounter(tweet_dir, working_dir, cache=cache)
+        na = network_analyzer.NetworkAnalyzer(tweet_dir, working_dir, cache=cache)
+        ...
+        print cache.summary()
+
+    Parameters
+    ----------
+    max_size: int, defaults to 100000
+        Number of distinct texts kept. The least recently used text is evicted
+        when a new one comes in and the cache is full
+
+    Attributes
+    ----------
+    entries: OrderedDict (md5 digest of the text -> dict (part -> value))
+        Cached parts of each text, least recently used first
+
+    hits, misses, evictions: int
+        Number of lookups of a part that was cached, lookups that had to
+        compute it, and texts evicted
+    """
+    def __init__(self, max_size=100000):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, text, part, compute):
+        """
+        Returns the cached part of a text, computing it with compute(text) on
+        a miss. Cached values are shared between callers and must not be
+        modified
+
+        INPUT
+        -----
+        text: string
+            Tweet text
+        part: hashable
+            Name of the result, eg. 'tokens' or 'entities'
+        compute: function
+            Computes the part from the text
+        """
+        if isinstance(text, unicode):
+            key = hashlib.md5(text.encode('utf-8')).digest()
+        else:
+            key = hashlib.md5(text).digest()
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            entry = {}
+            if len(self.entries) >= self.max_size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+        # (Re)insert as most recently used
+        self.entries[key] = entry
+        if part in entry:
+            self.hits += 1
+            return entry[part]
+        self.misses += 1
+        value = compute(text)
+        entry[part] = value
+        return value
+
+    def tokens(self, text, clean_tweet):
+        """
+        Returns clean_tweet(text), from the cache when possible
+        """
+        return self.get(text, 'tokens', clean_tweet)
+
+    def entities(self, text):
+        """
+        Returns entity_parser.parse_entities(text), from the cache when
+        possible
+        """
+        return self.get(text, 'entities', entity_parser.parse_entities)
+
+    def hit_rate(self):
+        if self.hits+self.misses == 0:
+            return 0.0
+        return float(self.hits)/(self.hits+self.misses)
+
+    def summary(self):
+        return "Tweet cache: "+str(self.hits)+" hits, "+str(self.misses)+" misses ("+str(round(100*self.hit_rate(), 1))+"% hit rate), "+str(len(self.entries))+" texts cached, "+str(self.evictions)+" evicted"